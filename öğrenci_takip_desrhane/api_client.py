@@ -0,0 +1,153 @@
+import functools
+import http.client
+import json
+import logging
+import sqlite3
+import threading
+import urllib.parse
+import weakref
+
+log = logging.getLogger(__name__)
+
+API_TIMEOUT_S = 60
+# server-side exceptions re-raised with their own type, so callers' except clauses keep working
+REMOTE_ERRORS = {'IntegrityError': sqlite3.IntegrityError, 'OperationalError': sqlite3.OperationalError,
+                 'ValueError': ValueError, 'TypeError': TypeError, 'KeyError': KeyError}
+
+
+class _ConnSlot:
+    # lives in a thread's local storage; when the thread exits the slot is collected
+    # and its connection closed
+    __slots__ = ('conn', 'used', 'close', '__weakref__')
+
+    def __init__(self, conn, release):
+        self.conn = conn
+        self.used = False
+        # runs once: on _drop_connection or when the slot is collected
+        self.close = weakref.finalize(self, release, conn)
+
+
+class RemoteError(RuntimeError):
+    def __init__(self, status, kind, message):
+        super().__init__(message)
+        self.status = status
+        self.kind = kind
+
+
+class RemoteDatabase:
+    # client-mode stand-in for Database: the same method names, answered by api_server.
+    # Each thread keeps one keep-alive HTTP connection. Results come back as JSON, so
+    # tuples arrive as lists.
+    instrumentation = None
+
+    def __init__(self, url, token=None, timeout=API_TIMEOUT_S):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = set()
+        # also checks early that the server is reachable and accepts the token
+        self.methods = frozenset(self._request('GET', '/api'))
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('methods', ()):
+            return functools.partial(self.call, name)
+        raise AttributeError(name)
+
+    def call(self, method, *args, **kwargs):
+        return self._request('POST', f'/api/{method}', {'args': args, 'kwargs': kwargs})
+
+    def _slot(self):
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            slot = _ConnSlot(conn, self._release)
+            self._local.slot = slot
+            with self._lock:
+                self._conns.add(conn)
+        return slot
+
+    def _release(self, conn):
+        with self._lock:
+            self._conns.discard(conn)
+        conn.close()
+
+    def _drop_connection(self):
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            return
+        self._local.slot = None
+        slot.close()
+
+    def _request(self, verb, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        while True:
+            slot = self._slot()
+            conn, reused = slot.conn, slot.used
+            try:
+                conn.request(verb, self.prefix + path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._drop_connection()
+                # the server closed an idle keep-alive connection before reading the
+                # request: retry once on a new one
+                if reused:
+                    continue
+                raise
+            except Exception:
+                self._drop_connection()
+                raise
+            slot.used = True
+            if resp.will_close:
+                self._drop_connection()
+            break
+        try:
+            doc = json.loads(data)
+        except ValueError:
+            raise RemoteError(resp.status, 'ApiError', f'Sunucudan geçersiz yanıt ({resp.status})')
+        if resp.status != 200 or 'error' in doc:
+            err = doc.get('error') or {}
+            kind, message = err.get('type', 'ApiError'), err.get('message', '')
+            if kind in REMOTE_ERRORS:
+                raise REMOTE_ERRORS[kind](message)
+            raise RemoteError(resp.status, kind, message)
+        return doc['result']
+
+    def start_backup(self, callback=None, **kwargs):
+        # same contract as Database.start_backup; the backup is written on the server,
+        # so the destination and progress arguments do not apply
+        progress = kwargs.pop('progress', None)
+        kwargs.pop('dest_dir', None)
+
+        def _run():
+            try:
+                dest = self.call('backup', **kwargs)
+            except Exception as e:
+                log.exception('Remote backup failed')
+                if callback:
+                    callback(None, e)
+                return
+            finally:
+                # this thread's connection is not needed afterwards
+                self._drop_connection()
+            if progress:
+                progress(1, 1)
+            if callback:
+                callback(dest, None)
+        t = threading.Thread(target=_run, name='db-backup', daemon=True)
+        t.start()
+        return t
+
+    def close(self):
+        with self._lock:
+            conns, self._conns = self._conns, set()
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,288 @@
+import asyncio
+import hmac
+import inspect
+import ipaddress
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import Database, READ_POOL_SIZE
+from telegram_bot import TelegramNotifier
+
+log = logging.getLogger(__name__)
+
+API_HOST = '127.0.0.1'
+API_PORT = 8765
+# idle keep-alive connections are closed after this long
+KEEPALIVE_TIMEOUT_S = 60
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_HEADERS = 100
+BACKUP_DIR = 'backups'
+# backups started by clients: the newest BACKUP_KEEP are kept on the server
+BACKUP_KEEP = 14
+# the only backup arguments a client chooses; where backups go and how many are kept is
+# the server's configuration
+BACKUP_OPTIONS = ('compress', 'verify')
+
+# Database methods reachable over HTTP: what the desktop app calls in client mode, and
+# nothing else. Outbox delivery, digests, imports, pruning and the change-feed
+# callbacks stay in the server's own process (or manage.py).
+READ_METHODS = frozenset({
+    'authenticate', 'get_setting', 'cache_stats',
+    'get_student', 'list_students', 'search_students', 'count_students', 'list_classes',
+    'list_attendance', 'count_attendance', 'attendance_monthly',
+    'list_appointments', 'list_exams', 'exam_summary', 'student_exam_summary', 'exam_rank',
+    'list_users', 'count_users', 'list_backups', 'last_change_seq', 'changes_since',
+    # authenticate writes only when it upgrades a password hash, and backup copies through
+    # its own connection and writes only its metadata row at the end: both take the write
+    # lock for one short statement, so they stay on the reader pool instead of holding up
+    # the writer thread for a PBKDF2 round or a whole backup
+    'backup',
+})
+# run one at a time on the writer thread; the rest go to the reader pool
+WRITE_METHODS = frozenset({
+    'create_user', 'delete_user', 'change_password',
+    'add_student', 'edit_student', 'delete_student',
+    'add_attendance', 'add_attendance_bulk',
+    'add_appointment', 'delete_appointment', 'add_availability', 'delete_availability',
+    'add_exam', 'enqueue_message', 'enqueue_messages', 'set_setting',
+    # read-only, but sweeps the appointment schedules under the write lock
+    'find_free_slots',
+})
+ALLOWED_METHODS = READ_METHODS | WRITE_METHODS
+# settings never sent to clients
+SECRET_SETTINGS = frozenset({'telegram_token'})
+# the only settings clients may change: what AdminDashboard saves. The token is write-only
+# (see SECRET_SETTINGS); internal keys (password_iterations, telegram_update_offset,
+# digest_last_day) are kept by the server's own processes
+CLIENT_SETTINGS = frozenset({'telegram_token', 'telegram_mode', 'telegram_digest_time'})
+# never sent back from authenticate
+PRIVATE_USER_FIELDS = ('password', 'password_hash', 'salt')
+# request errors caused by the caller's input: reported without a traceback in the log
+CLIENT_ERRORS = (sqlite3.IntegrityError, ValueError, TypeError, KeyError)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}
+
+
+def exposed_methods():
+    return sorted(ALLOWED_METHODS)
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _encode(doc):
+    # tuples become lists; anything else JSON lacks (datetime) is sent as text
+    return json.dumps(doc, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def _error(status, message, kind='ApiError'):
+    return status, _encode({'error': {'type': kind, 'message': message}})
+
+
+class ApiServer:
+    # HTTP/1.1 + JSON front for one Database, so front-desk PCs stop opening the SQLite
+    # file over a shared drive. POST /api/<method> with {"args": [...], "kwargs": {...}}
+    # answers {"result": ...} or {"error": {"type", "message"}}; GET /api lists methods.
+    # The event loop only parses and routes: writes run one at a time on a dedicated
+    # writer thread, reads on a pool of reader threads (each with its own pooled
+    # Database reader connection). Connections are kept alive between requests.
+    def __init__(self, db, host=API_HOST, port=API_PORT, token=None, readers=READ_POOL_SIZE, backup_dir=BACKUP_DIR,
+                 backup_keep=BACKUP_KEEP):
+        if token is None and not is_loopback(host):
+            raise ValueError(f'{host} adresinde dinlemek için erişim anahtarı (token) gerekli')
+        self.db = db
+        self.host = host
+        self.port = port
+        self.token = token
+        self.backup_dir = backup_dir
+        self.backup_keep = backup_keep
+        self.methods = frozenset(exposed_methods())
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='api-read')
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='api-write')
+        self._server = None
+        self._loop = None
+        self._thread = None
+        # counters, updated on the event loop thread
+        self.connections = 0
+        self.requests = 0
+        self._handlers = set()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        log.info('API server listening on %s:%d', self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self._shutdown()
+
+    async def _shutdown(self):
+        # closing the server does not end kept-alive connections: cancel their handlers
+        self._server.close()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def start_background(self):
+        # runs the server on its own event loop thread (GUI host, tests); returns the port
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            try:
+                loop.run_forever()
+            finally:
+                loop.run_until_complete(self._shutdown())
+                loop.close()
+        self._thread = threading.Thread(target=run, name='api-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+        elif self._server is not None:
+            self._server.close()
+        self._readers.shutdown()
+        self._writer.shutdown()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                parts = line.decode('latin-1').split()
+                if len(parts) != 3:
+                    self._respond(writer, *_error(400, 'Geçersiz istek'), keep_alive=False)
+                    break
+                verb, target, version = parts
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = h.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                    if len(headers) > MAX_HEADERS:
+                        break
+                if len(headers) > MAX_HEADERS:
+                    self._respond(writer, *_error(431, 'Çok fazla başlık'), keep_alive=False)
+                    break
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    self._respond(writer, *_error(413, 'İstek çok büyük'), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                conn_header = headers.get('connection', '').lower()
+                keep_alive = conn_header != 'close' if version == 'HTTP/1.1' else conn_header == 'keep-alive'
+                self.requests += 1
+                status, payload = await self._dispatch(verb, target, headers, body)
+                self._respond(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+    def _respond(self, writer, status, payload, keep_alive):
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\nContent-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + payload)
+
+    async def _dispatch(self, verb, target, headers, body):
+        if self.token is not None:
+            scheme, _, given = headers.get('authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(given.encode(), self.token.encode()):
+                return _error(401, 'Yetkisiz')
+        path = target.split('?', 1)[0].rstrip('/')
+        if path == '/api':
+            return 200, _encode({'result': sorted(self.methods)})
+        name = path[len('/api/'):] if path.startswith('/api/') else None
+        if name not in self.methods:
+            return _error(404, f'Bilinmeyen işlem: {path}')
+        if verb != 'POST':
+            return _error(405, 'POST bekleniyor')
+        try:
+            doc = json.loads(body or b'{}')
+            args, kwargs = list(doc.get('args') or ()), dict(doc.get('kwargs') or {})
+        except (ValueError, TypeError, AttributeError):
+            return _error(400, 'Geçersiz JSON')
+        executor = self._writer if name in WRITE_METHODS else self._readers
+        return await self._loop.run_in_executor(executor, self._call, name, args, kwargs)
+
+    def _call(self, name, args, kwargs):
+        # runs on a worker thread; the reply is encoded there too, off the event loop
+        if name == 'backup':
+            # backups go to the server's disk, whatever path and retention the client had
+            # configured; positional arguments follow Database.backup(dest_dir, compress, verify)
+            options = dict(zip(BACKUP_OPTIONS, args[1:3]))
+            options.update((k, v) for k, v in kwargs.items() if k in BACKUP_OPTIONS)
+            args, kwargs = [], dict(options, dest_dir=self.backup_dir, keep=self.backup_keep)
+        elif name == 'get_setting' and (args[0] if args else kwargs.get('k')) in SECRET_SETTINGS:
+            return 200, _encode({'result': None})
+        elif name == 'set_setting' and (args[0] if args else kwargs.get('k')) not in CLIENT_SETTINGS:
+            return _error(403, 'Bu ayar istemciden değiştirilemez')
+        try:
+            result = getattr(self.db, name)(*args, **kwargs)
+            if inspect.isgenerator(result):
+                result = list(result)
+            if name == 'authenticate' and result:
+                result = {k: v for k, v in result.items() if k not in PRIVATE_USER_FIELDS}
+            return 200, _encode({'result': result})
+        except CLIENT_ERRORS as e:
+            log.info('API %s rejected: %s', name, e)
+            return _error(400, str(e), type(e).__name__)
+        except Exception as e:
+            log.exception('API %s failed', name)
+            return _error(500, str(e), type(e).__name__)
+
+
+def serve(db_path, host=API_HOST, port=API_PORT, token=None, backup_dir=BACKUP_DIR, backup_keep=BACKUP_KEEP):
+    db = Database(db_path)
+    try:
+        server = ApiServer(db, host, port, token=token, backup_dir=backup_dir, backup_keep=backup_keep)
+    except ValueError:
+        db.close()
+        raise
+    # client-mode GUIs only queue Telegram messages: the server delivers them
+    notifier = TelegramNotifier(db)
+    notifier.start()
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        notifier.stop()
+        server.stop()
+        db.close()
@@ -0,0 +1,80 @@
+import collections
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    # bounded LRU with a per-entry time-to-live, safe to share between threads.
+    # Writers call invalidate() after their commit; a reader that loaded a value before
+    # that commit passes the generation it saw to put(), and the stale value is dropped.
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.expired = self.invalidations = 0
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+                self.expired += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def get_or_load(self, key, load, cache_none=True):
+        # read-through; load() runs outside the lock
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self.generation
+        value = load()
+        if value is not None or cache_none:
+            self.put(key, value, generation)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def invalidate_where(self, predicate):
+        # predicate(key, value); for lookups keyed by something other than what changed
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, (_, v) in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None, 'evictions': self.evictions,
+                    'expired': self.expired, 'invalidations': self.invalidations}
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from matplotlib.figure import Figure
+
+EXAM_HISTORY = 6
+SERIES_CACHE_SIZE = 256
+
+
+class ExamChart:
+    # one Figure for the lifetime of the dashboard; a lookup only swaps the line data.
+    # Built on matplotlib.figure.Figure (not pyplot) so nothing is registered globally;
+    # the caller attaches a canvas (FigureCanvasTkAgg in the GUI, Agg in tests).
+    def __init__(self, db, figsize=(6, 3)):
+        self.db = db
+        self.figure = Figure(figsize=figsize)
+        self.ax = self.figure.add_subplot()
+        self.score_line, = self.ax.plot([], [], marker='o', color='seagreen', label='Puan')
+        self.mean_line, = self.ax.plot([], [], linestyle='--', color='gray', label='Sınıf ortalaması')
+        self.ax.set_ylim(0, 100)
+        self.ax.set_title('Son Sınav Performansı')
+        self.ax.legend(loc='lower right', fontsize=8)
+        # student_id -> (exam count, names, scores), least recently used first
+        self._series = OrderedDict()
+
+    def series(self, student_id):
+        # the student's exam count comes from the aggregates (one row read); the
+        # cached series is reused until a new exam is added for the student
+        summary = self.db.student_exam_summary(student_id)
+        count = summary['n'] if summary else 0
+        cached = self._series.get(student_id)
+        if cached is not None and cached[0] == count:
+            self._series.move_to_end(student_id)
+            return cached
+        rows = self.db.list_exams(student_id, limit=EXAM_HISTORY)[::-1] if count else []
+        cached = (count, [r['name'] for r in rows], [r['score'] for r in rows])
+        self._series[student_id] = cached
+        if len(self._series) > SERIES_CACHE_SIZE:
+            self._series.popitem(last=False)
+        return cached
+
+    def show(self, student_id):
+        # returns the caption text, or None if the student has no exams
+        _, names, scores = self.series(student_id)
+        if not names:
+            return None
+        x = list(range(len(names)))
+        # class averages change with every other student's exam, so they are not cached
+        means = [(self.db.exam_summary(n) or {}).get('mean', float('nan')) for n in names]
+        self.score_line.set_data(x, scores)
+        self.mean_line.set_data(x, means)
+        self.ax.set_xticks(x, names)
+        self.ax.set_xlim(-0.5, len(names) - 0.5)
+        self.figure.canvas.draw_idle()
+        summary = self.db.student_exam_summary(student_id)
+        ranked = self.db.exam_rank(names[-1], scores[-1])
+        if not ranked:
+            return ''
+        rank, n, pct = ranked
+        return (f"Genel ortalama: {summary['mean']:.1f} (±{summary['std']:.1f})  |  "
+                f"{names[-1]}: {rank}/{n}. sıra, %{pct:.0f} dilim")
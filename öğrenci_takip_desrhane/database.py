@@ -2,55 +2,499 @@ import sqlite3
 import os
 import shutil
 import datetime
+import time
+import json
 import logging
 import hashlib
 import binascii
+import hmac
+import threading
+import contextlib
+import weakref
+import gzip
+import re
+import itertools
+import heapq
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from schedule import TeacherSchedule
+from instrumentation import Instrumentation, TimedConnection, SLOW_QUERY_MS
+from cache import TTLCache
 
 
 
-logging.basicConfig(filename='smartdershane.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+log = logging.getLogger(__name__)
+
+ATTENDANCE_STATUSES = ('Gelen', 'Geç Kaldı', 'Gelmedi', 'İzinli')
+
+# connection tuning (WAL: readers never block the writer and vice versa)
+BUSY_TIMEOUT_S = 30
+CACHE_SIZE_KIB = 20000
+READ_POOL_SIZE = 8
+
+# online backup: pages copied per step, and read size when compressing
+BACKUP_STEP_PAGES = 1024
+BACKUP_COPY_CHUNK = 1024 * 1024
+
+# read-through caches for get_student, get_setting and authenticate. Writes through this
+# Database invalidate them at once; the TTL bounds staleness from other processes
+# (manage.py, a second GUI) writing the same file.
+CACHE_TTL_S = 60
+STUDENT_CACHE_SIZE = 5000
+SETTINGS_CACHE_SIZE = 256
+USER_CACHE_SIZE = 1000
+
+# change feed (changes table, see _migrate_9): rows kept after pruning at startup, and
+# rows read per changes_since call by poll_changes
+CHANGE_LOG_KEEP = 100000
+CHANGES_BATCH = 1000
+
+# parent digests list the appointments of this many days after the digest day
+DIGEST_APPOINTMENT_DAYS = 7
+
+# password hashing cost; stored per user so it can be raised later, old hashes are
+# upgraded on the next successful login
+PASSWORD_ALGO = 'sha256'
+PASSWORD_ITERATIONS = 100000
+
+USER_ROLES = ('admin', 'teacher', 'parent')
+USER_CHUNK_SIZE = 500
+
+MAX_APPOINTMENTS_PER_WEEK = 3
+# a claimed outbox row goes back to pending if its worker has not finished it by then
+OUTBOX_LEASE_S = 120
+FREE_SLOTS_LIMIT = 20
+FREE_SLOTS_DAYS = 14
+# reasons returned by add_appointment when a booking is refused
+APPOINTMENT_CONFLICTS = ('weekly_limit', 'unavailable', 'teacher_busy')
+# appointment/availability times are stored in this form so they sort as text
+TS_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _parse_ts(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+def _fmt_ts(dt):
+    return dt.strftime(TS_FORMAT)
+
+
+# search folding: Turkish İ/I/ı/i all become 'i' and ş/ğ/ö/ü/ç lose their marks, so
+# "ILGAZ", "ılgaz" and "Ilgaz" match each other and "sukru" finds "Şükrü".
+# str.lower() alone is wrong here ('İ'.lower() is 'i' + combining dot).
+_TR_FOLD = str.maketrans({
+    'İ': 'i', 'I': 'i', 'ı': 'i', 'Ş': 's', 'ş': 's', 'Ğ': 'g', 'ğ': 'g', 'Ö': 'o', 'ö': 'o',
+    'Ü': 'u', 'ü': 'u', 'Ç': 'c', 'ç': 'c', 'Â': 'a', 'â': 'a', 'Î': 'i', 'î': 'i', 'Û': 'u', 'û': 'u',
+})
+
+
+def tr_fold(text):
+    if text is None:
+        return ''
+    return str(text).translate(_TR_FOLD).lower()
+
+
+def hash_password(password, algo=PASSWORD_ALGO, iterations=PASSWORD_ITERATIONS, salt=None):
+    # returns (hash_hex, salt); module level so it can run in worker processes
+    if salt is None:
+        salt = hashlib.sha256(os.urandom(60)).hexdigest()
+    pwdhash = hashlib.pbkdf2_hmac(algo, password.encode('utf-8'), salt.encode('ascii'), iterations)
+    return (binascii.hexlify(pwdhash).decode('ascii'), salt)
+
+
+def verify_password(password, salt, stored_hash, algo=PASSWORD_ALGO, iterations=PASSWORD_ITERATIONS):
+    ph, _ = hash_password(password, algo, iterations, salt)
+    return hmac.compare_digest(ph, stored_hash)
+
+
+def _add_column(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+
+def _migrate_1(cur):
+    # base schema; also upgrades databases created before versioning
+    cur.execute('''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT)''')
+    # upgradeable columns for hashed passwords
+    _add_column(cur, 'users', 'password_hash', 'TEXT')
+    _add_column(cur, 'users', 'salt', 'TEXT')
+    cur.execute('''CREATE TABLE IF NOT EXISTS students (id INTEGER PRIMARY KEY, name TEXT, surname TEXT, tc TEXT, parent_chat_id TEXT)''')
+    # class (şube) column for roll-call by class
+    _add_column(cur, 'students', 'class_name', 'TEXT')
+    cur.execute('''CREATE TABLE IF NOT EXISTS attendance (id INTEGER PRIMARY KEY, student_id INTEGER, status TEXT, ts TEXT)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS appointments (id INTEGER PRIMARY KEY, student_id INTEGER, teacher_id INTEGER, start_ts TEXT, duration_min INTEGER)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS teacher_availability (id INTEGER PRIMARY KEY, teacher_id INTEGER, start_ts TEXT, end_ts TEXT)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS backups (id INTEGER PRIMARY KEY, path TEXT, ts TEXT)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS exams (id INTEGER PRIMARY KEY, student_id INTEGER, name TEXT, score INTEGER, ts TEXT)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT)''')
+
+
+def _migrate_2(cur):
+    # indexes on the hot lookup columns (student/teacher + time)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_ts ON attendance(student_id, ts, status)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_attendance_ts ON attendance(ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_exams_student_ts ON exams(student_id, ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_appointments_student_start ON appointments(student_id, start_ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_appointments_teacher_start ON appointments(teacher_id, start_ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_availability_teacher_start ON teacher_availability(teacher_id, start_ts, end_ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_students_class ON students(class_name, surname, name)')
+    _unique_tc_index(cur)
+
+
+def _unique_tc_index(cur):
+    # TC must be unique; empty/NULL TC (not entered yet) is allowed many times. While
+    # duplicates exist only the plain idx_students_tc is built; Database re-checks on
+    # every start while that index is there and swaps in ux_students_tc once the
+    # duplicates are resolved.
+    cur.execute("SELECT tc FROM students WHERE tc <> '' GROUP BY tc HAVING COUNT(*) > 1")
+    dups = [r[0] for r in cur.fetchall()]
+    if dups:
+        log.warning('Duplicate TC numbers, unique TC index postponed until they are fixed: %s', ', '.join(dups))
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_students_tc ON students(tc)')
+        return False
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_students_tc ON students(tc) WHERE tc <> ''")
+    cur.execute('DROP INDEX IF EXISTS idx_students_tc')
+    return True
+
+
+def _migrate_3(cur):
+    # normalize stored appointment/availability times to TS_FORMAT (sortable text)
+    cur.execute("UPDATE appointments SET start_ts = strftime('%Y-%m-%dT%H:%M:%S', start_ts) WHERE strftime('%Y-%m-%dT%H:%M:%S', start_ts) IS NOT NULL")
+    cur.execute("UPDATE teacher_availability SET start_ts = strftime('%Y-%m-%dT%H:%M:%S', start_ts) WHERE strftime('%Y-%m-%dT%H:%M:%S', start_ts) IS NOT NULL")
+    cur.execute("UPDATE teacher_availability SET end_ts = strftime('%Y-%m-%dT%H:%M:%S', end_ts) WHERE strftime('%Y-%m-%dT%H:%M:%S', end_ts) IS NOT NULL")
+
+
+def _migrate_4(cur):
+    # persistent Telegram outbox (delivered by TelegramNotifier's worker)
+    cur.execute('''CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, chat_id TEXT, text TEXT, status TEXT NOT NULL DEFAULT 'pending',
+                   attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, last_error TEXT, created_ts TEXT, sent_ts TEXT)''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)')
+
+
+def _migrate_5(cur):
+    # backup metadata for retention and the admin view
+    _add_column(cur, 'backups', 'size', 'INTEGER')
+    _add_column(cur, 'backups', 'compressed', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(cur, 'backups', 'verified', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _migrate_6(cur):
+    # full-text index over students (folded with tr_fold), kept in sync by triggers.
+    # These triggers call the tr_fold UDF; migration 13 replaces them with ones that
+    # only copy columns.
+    cur.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(name, surname, tc,
+                   tokenize='unicode61 remove_diacritics 0', prefix='1 2 3')""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+                     INSERT INTO students_fts(rowid,name,surname,tc) VALUES (new.id, tr_fold(new.name), tr_fold(new.surname), new.tc);
+                   END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+                     DELETE FROM students_fts WHERE rowid=old.id;
+                   END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF name, surname, tc ON students BEGIN
+                     DELETE FROM students_fts WHERE rowid=old.id;
+                     INSERT INTO students_fts(rowid,name,surname,tc) VALUES (new.id, tr_fold(new.name), tr_fold(new.surname), new.tc);
+                   END""")
+    cur.execute('DELETE FROM students_fts')
+    cur.execute('INSERT INTO students_fts(rowid,name,surname,tc) SELECT id, tr_fold(name), tr_fold(surname), tc FROM students')
+
+
+def _migrate_7(cur):
+    # per-user hash algorithm and cost; existing hashes were made with the old fixed values
+    _add_column(cur, 'users', 'hash_algo', 'TEXT')
+    _add_column(cur, 'users', 'hash_iterations', 'INTEGER')
+    cur.execute("UPDATE users SET hash_algo='sha256', hash_iterations=100000 WHERE password_hash IS NOT NULL AND hash_algo IS NULL")
+
+
+def _migrate_8(cur):
+    # exam aggregates kept up to date by add_exam: running n/sum/sum of squares/min/max
+    # per exam and per student, and a per-exam histogram (one row per distinct score)
+    # for rank and percentile lookups
+    for table, key in (('exam_stats', 'exam TEXT PRIMARY KEY'), ('student_exam_stats', 'student_id INTEGER PRIMARY KEY')):
+        cur.execute(f'''CREATE TABLE IF NOT EXISTS {table} ({key}, n INTEGER NOT NULL, total REAL NOT NULL,
+                       total_sq REAL NOT NULL, min_score REAL, max_score REAL)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS exam_score_buckets (exam TEXT NOT NULL, score REAL NOT NULL, n INTEGER NOT NULL,
+                   PRIMARY KEY (exam, score)) WITHOUT ROWID''')
+    _rebuild_exam_stats_sql(cur)
+
+
+def _migrate_9(cur):
+    # change feed: one row per inserted, updated or deleted row, written by triggers so
+    # writes from every client (other GUIs, manage.py) show up. AUTOINCREMENT keeps seq
+    # increasing without gaps, also after the oldest rows are pruned.
+    cur.execute('''CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL,
+                   op TEXT NOT NULL, row_id INTEGER NOT NULL)''')
+    for table in ('students', 'attendance', 'exams', 'appointments', 'teacher_availability', 'users'):
+        for op, ref in (('insert', 'new'), ('update', 'new'), ('delete', 'old')):
+            cur.execute(f'''CREATE TRIGGER IF NOT EXISTS changes_{table}_{op} AFTER {op.upper()} ON {table} BEGIN
+                              INSERT INTO changes (tbl, op, row_id) VALUES ('{table}', '{op}', {ref}.id);
+                            END''')
+
+
+def _migrate_10(cur):
+    # day-range lookups for the parent digest (attendance already has idx_attendance_ts)
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_exams_ts ON exams(ts)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments(start_ts)')
+
+
+def _migrate_11(cur):
+    # the inbound Telegram bot finds a parent's children by chat id
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_students_parent_chat ON students(parent_chat_id)')
+
+
+def _migrate_12(cur):
+    # outbox rows are claimed by one delivery worker (with a lease) before they are sent
+    _add_column(cur, 'outbox', 'claimed_by', 'TEXT')
+    _add_column(cur, 'outbox', 'lease_until', 'REAL')
+
+
+def _migrate_13(cur):
+    # the search text is folded in Python when a student is written and stored in
+    # name_fold/surname_fold; the FTS triggers only copy those columns, so any SQLite
+    # client can write to students (migration 6's triggers called the tr_fold UDF,
+    # which only Database's connections have). A writer that leaves the fold columns
+    # alone gets lower() of the name instead: searchable, minus the Turkish folding.
+    _add_column(cur, 'students', 'name_fold', 'TEXT')
+    _add_column(cur, 'students', 'surname_fold', 'TEXT')
+    for t in ('students_fts_ai', 'students_fts_au'):
+        cur.execute(f'DROP TRIGGER IF EXISTS {t}')
+    cur.execute('SELECT id, name, surname FROM students')
+    cur.executemany('UPDATE students SET name_fold=?, surname_fold=? WHERE id=?',
+                    [(tr_fold(r[1]), tr_fold(r[2]), r[0]) for r in cur.fetchall()])
+    cur.execute("""CREATE TRIGGER students_fts_ai AFTER INSERT ON students BEGIN
+                     INSERT INTO students_fts(rowid,name,surname,tc)
+                     VALUES (new.id, COALESCE(new.name_fold, lower(new.name)), COALESCE(new.surname_fold, lower(new.surname)), new.tc);
+                   END""")
+    # a name changed without its fold column (another client) falls back to lower()
+    cur.execute("""CREATE TRIGGER students_fts_au AFTER UPDATE OF name, surname, tc, name_fold, surname_fold ON students BEGIN
+                     DELETE FROM students_fts WHERE rowid=old.id;
+                     INSERT INTO students_fts(rowid,name,surname,tc) VALUES (new.id,
+                       CASE WHEN new.name IS NOT old.name AND new.name_fold IS old.name_fold THEN lower(new.name) ELSE COALESCE(new.name_fold, lower(new.name)) END,
+                       CASE WHEN new.surname IS NOT old.surname AND new.surname_fold IS old.surname_fold THEN lower(new.surname) ELSE COALESCE(new.surname_fold, lower(new.surname)) END,
+                       new.tc);
+                   END""")
+    cur.execute('DELETE FROM students_fts')
+    cur.execute('INSERT INTO students_fts(rowid,name,surname,tc) SELECT id, name_fold, surname_fold, tc FROM students')
+
+
+def _rebuild_exam_stats_sql(cur):
+    # rows without a student, exam name or score are not counted
+    cur.execute('DELETE FROM exam_stats')
+    cur.execute('DELETE FROM student_exam_stats')
+    cur.execute('DELETE FROM exam_score_buckets')
+    cur.execute('''INSERT INTO exam_stats SELECT name, COUNT(*), SUM(score), SUM(score*score), MIN(score), MAX(score)
+                   FROM exams WHERE score IS NOT NULL AND name IS NOT NULL AND student_id IS NOT NULL GROUP BY name''')
+    cur.execute('''INSERT INTO student_exam_stats SELECT student_id, COUNT(*), SUM(score), SUM(score*score), MIN(score), MAX(score)
+                   FROM exams WHERE score IS NOT NULL AND name IS NOT NULL AND student_id IS NOT NULL GROUP BY student_id''')
+    cur.execute('INSERT INTO exam_score_buckets SELECT name, score, COUNT(*) FROM exams WHERE score IS NOT NULL AND name IS NOT NULL AND student_id IS NOT NULL GROUP BY name, score')
+
+
+def _group_stats(np, keys, scores):
+    # one pass over the sorted arrays: (key, n, sum, sum_sq, min, max) per key and
+    # (key, score, n) per distinct score
+    order = np.lexsort((scores, keys))
+    keys, scores = keys[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    sums = np.add.reduceat(scores, starts)
+    sums_sq = np.add.reduceat(scores * scores, starts)
+    stats = zip(keys[starts].tolist(), (ends - starts).tolist(), sums.tolist(), sums_sq.tolist(),
+                scores[starts].tolist(), scores[ends - 1].tolist())
+    b_starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (scores[1:] != scores[:-1])])
+    b_ends = np.r_[b_starts[1:], len(keys)]
+    buckets = zip(keys[b_starts].tolist(), scores[b_starts].tolist(), (b_ends - b_starts).tolist())
+    return list(stats), list(buckets)
+
+
+MIGRATIONS = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+    (5, _migrate_5),
+    (6, _migrate_6),
+    (7, _migrate_7),
+    (8, _migrate_8),
+    (9, _migrate_9),
+    (10, _migrate_10),
+    (11, _migrate_11),
+    (12, _migrate_12),
+    (13, _migrate_13),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class _ReaderSlot:
+    # lives in a thread's local storage; when the thread exits the slot is
+    # collected and its connection goes back to the pool
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
 
 class Database:
-    def __init__(self, path='smartdershane.db'):
+    def __init__(self, path='smartdershane.db', password_algo=None, password_iterations=None, instrumentation=None,
+                 cache_ttl=CACHE_TTL_S):
         self.path = path
-        self.conn = sqlite3.connect(self.path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        # opt-in timing of every public method and SQL statement (see instrumentation.py)
+        if instrumentation is None and os.environ.get('SMARTDERSHANE_INSTRUMENT'):
+            instrumentation = Instrumentation(float(os.environ.get('SMARTDERSHANE_SLOW_MS', SLOW_QUERY_MS)))
+        self.instrumentation = instrumentation or None
+        self.password_algo = password_algo or PASSWORD_ALGO
+        self.password_iterations = password_iterations or PASSWORD_ITERATIONS
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._idle_readers = []
+        self._all_readers = set()
+        self._closed = False
+        # teacher_id -> TeacherSchedule, guarded by the write lock
+        self._schedules = {}
+        self._data_version = None
+        self._schedule_changes = None
+        self._student_cache = TTLCache(STUDENT_CACHE_SIZE, cache_ttl)
+        self._settings_cache = TTLCache(SETTINGS_CACHE_SIZE, cache_ttl)
+        # (username, role) -> users row; misses are not cached so unknown names cannot fill it
+        self._user_cache = TTLCache(USER_CACHE_SIZE, cache_ttl)
+        # in-process change subscribers: [(callback, tables)], and the last seq delivered
+        self._subscribers = []
+        self._dispatch_lock = threading.RLock()
+        self._dispatched_seq = 0
+        self.conn = self._connect()
         self._init_db()
+        self.prune_changes()
+        if password_iterations is None:
+            # admins can raise the cost without a code change
+            tuned = self.get_setting('password_iterations')
+            if tuned:
+                self.password_iterations = int(tuned)
+        if self.instrumentation:
+            self.instrumentation.instrument(self)
 
-    def _init_db(self):
-        cur = self.conn.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT)''')
-        # ensure upgradeable columns for hashed passwords
-        cur.execute("PRAGMA table_info(users)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'password_hash' not in cols:
-            try:
-                cur.execute('ALTER TABLE users ADD COLUMN password_hash TEXT')
-            except Exception:
-                pass
-        if 'salt' not in cols:
+    def _connect(self, readonly=False):
+        if self.instrumentation:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT_S, factory=TimedConnection)
+            conn.instrumentation = self.instrumentation
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT_S)
+        conn.row_factory = sqlite3.Row
+        # only needed while migration 6 runs; the current triggers use plain SQL
+        conn.create_function('tr_fold', 1, tr_fold, deterministic=True)
+        if not readonly:
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KIB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if readonly:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def _reader(self):
+        # per-thread read connection handed out from a small pool
+        if self.path == ':memory:':
+            return self.conn
+        slot = getattr(self._local, 'slot', None)
+        if slot is not None:
+            return slot.conn
+        with self._pool_lock:
+            conn = self._idle_readers.pop() if self._idle_readers else None
+        if conn is None:
+            conn = self._connect(readonly=True)
+            with self._pool_lock:
+                self._all_readers.add(conn)
+        slot = _ReaderSlot(conn)
+        weakref.finalize(slot, self._release_reader, conn)
+        self._local.slot = slot
+        return conn
+
+    def _release_reader(self, conn):
+        with self._pool_lock:
+            if not self._closed and len(self._idle_readers) < READ_POOL_SIZE:
+                self._idle_readers.append(conn)
+                return
+            self._all_readers.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _read(self):
+        return self._reader().cursor()
+
+    @contextlib.contextmanager
+    def _write(self, immediate=False):
+        # writes are serialized on the single writer connection
+        with self._write_lock:
+            cur = self.conn.cursor()
+            changes = self.conn.total_changes
             try:
-                cur.execute('ALTER TABLE users ADD COLUMN salt TEXT')
+                if immediate:
+                    cur.execute('BEGIN IMMEDIATE')
+                yield cur
+                self.conn.commit()
             except Exception:
-                pass
-        cur.execute('''CREATE TABLE IF NOT EXISTS students (id INTEGER PRIMARY KEY, name TEXT, surname TEXT, tc TEXT, parent_chat_id TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS attendance (id INTEGER PRIMARY KEY, student_id INTEGER, status TEXT, ts TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS appointments (id INTEGER PRIMARY KEY, student_id INTEGER, teacher_id INTEGER, start_ts TEXT, duration_min INTEGER)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS teacher_availability (id INTEGER PRIMARY KEY, teacher_id INTEGER, start_ts TEXT, end_ts TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS backups (id INTEGER PRIMARY KEY, path TEXT, ts TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS exams (id INTEGER PRIMARY KEY, student_id INTEGER, name TEXT, score INTEGER, ts TEXT)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT)''')
-        self.conn.commit()
+                self.conn.rollback()
+                self._schedules.clear()
+                raise
+            if self._schedule_changes == changes:
+                # the write went through a method that keeps the schedules current
+                self._schedule_changes = self.conn.total_changes
+        if self._subscribers:
+            # outside the write lock, so subscribers may read or write themselves
+            self.poll_changes()
+
+    def _schedule(self, cur, teacher_id):
+        # caller holds the write lock. The cached index is dropped when another
+        # connection committed (data_version) or someone wrote through self.conn directly.
+        dv = cur.execute('PRAGMA data_version').fetchone()[0]
+        if dv != self._data_version or self.conn.total_changes != self._schedule_changes:
+            self._schedules.clear()
+            self._data_version = dv
+            self._schedule_changes = self.conn.total_changes
+        sched = self._schedules.get(teacher_id)
+        if sched is None:
+            cur.execute('SELECT id, start_ts, end_ts FROM teacher_availability WHERE teacher_id=?', (teacher_id,))
+            avail = [(r['id'], _parse_ts(r['start_ts']), _parse_ts(r['end_ts'])) for r in cur.fetchall()]
+            cur.execute('SELECT id, start_ts, duration_min FROM appointments WHERE teacher_id=? ORDER BY start_ts', (teacher_id,))
+            bookings = []
+            for r in cur.fetchall():
+                start = _parse_ts(r['start_ts'])
+                bookings.append((r['id'], start, start + datetime.timedelta(minutes=r['duration_min'] or 15)))
+            sched = TeacherSchedule(avail, bookings)
+            self._schedules[teacher_id] = sched
+        return sched
+
+    def _init_db(self):
+        # schema is versioned with PRAGMA user_version; nothing runs when it is current
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            with self._write(immediate=True) as cur:
+                # re-read under the write lock, another client may have migrated meanwhile
+                version = cur.execute('PRAGMA user_version').fetchone()[0]
+                for v, migrate in MIGRATIONS:
+                    if v > version:
+                        migrate(cur)
+                        cur.execute(f'PRAGMA user_version={v}')
+                        log.info('Schema migrated to version %d', v)
+        cur = self._read()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_students_tc'")
+        if cur.fetchone():
+            # migration 2 found duplicate TCs: retry the unique index
+            with self._write(immediate=True) as wcur:
+                if _unique_tc_index(wcur):
+                    log.info('Duplicate TC numbers resolved, unique TC index created')
         # add default admin if not exists (use hashed password)
-        cur.execute("SELECT * FROM users WHERE username='admin'")
+        cur.execute("SELECT id FROM users WHERE username='admin'")
         if not cur.fetchone():
             self.create_user('admin', 'admin', 'admin')
-            logging.info('Default admin created')
+            log.info('Default admin created')
 
     def authenticate(self, username, password, role):
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM users WHERE username=? AND role=?', (username, role))
-        row = cur.fetchone()
+        # CPU-heavy (PBKDF2): GUI callers run this on a worker thread
+        row = self._user_cache.get_or_load((username, role), lambda: self._load_user(username, role), cache_none=False)
         if not row:
             return None
         r = dict(row)
@@ -58,126 +502,393 @@ class Database:
         ph = r.get('password_hash')
         salt = r.get('salt')
         if ph and salt:
-            if self._verify_password(password, salt, ph):
+            algo = r.get('hash_algo') or 'sha256'
+            iterations = r.get('hash_iterations') or 100000
+            if not verify_password(password, salt, ph, algo, iterations):
+                return None
+            if (algo, iterations) == (self.password_algo, self.password_iterations):
                 return r
+        elif r.get('password') != password:
             return None
-        # legacy: plain password in 'password' column
-        if r.get('password') == password:
-            # upgrade: hash and store
-            sh, sl = self._hash_password(password)
-            try:
-                cur.execute('UPDATE users SET password_hash=?, salt=? WHERE id=?', (sh, sl, r['id']))
-                self.conn.commit()
-            except Exception:
-                pass
-            return r
-        return None
+        # legacy plain password or outdated hash cost: re-hash with the current settings
+        self._store_password(r['id'], password)
+        return r
+
+    def _load_user(self, username, role):
+        cur = self._read()
+        cur.execute('SELECT * FROM users WHERE username=? AND role=?', (username, role))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+    def _forget_user(self, user_id):
+        self._user_cache.invalidate_where(lambda key, row: row['id'] == user_id)
+
+    def _store_password(self, user_id, password):
+        sh, sl = hash_password(password, self.password_algo, self.password_iterations)
+        try:
+            with self._write() as wcur:
+                wcur.execute('UPDATE users SET password_hash=?, salt=?, hash_algo=?, hash_iterations=?, password=NULL WHERE id=?',
+                             (sh, sl, self.password_algo, self.password_iterations, user_id))
+        except Exception:
+            log.exception('Password hash upgrade failed for user %s', user_id)
+        self._forget_user(user_id)
 
     def create_user(self, username, password, role):
-        cur = self.conn.cursor()
-        ph, sl = self._hash_password(password)
-        cur.execute('INSERT INTO users (username, password_hash, salt, role) VALUES (?,?,?,?)', (username, ph, sl, role))
-        self.conn.commit()
+        ph, sl = hash_password(password, self.password_algo, self.password_iterations)
+        with self._write() as cur:
+            cur.execute('INSERT INTO users (username, password_hash, salt, hash_algo, hash_iterations, role) VALUES (?,?,?,?,?,?)',
+                        (username, ph, sl, self.password_algo, self.password_iterations, role))
         return True
 
-    def list_users(self):
-        cur = self.conn.cursor()
-        cur.execute('SELECT id, username, role FROM users ORDER BY id')
+    def create_users_bulk(self, users, workers=None, chunk_size=USER_CHUNK_SIZE):
+        # users: iterable of (username, password, role), consumed in chunks so a large CSV
+        # is never held in memory. Passwords are hashed in a process pool (all cores by
+        # default) and every chunk is inserted in one transaction. Duplicates and invalid
+        # rows are collected in the report instead of raising.
+        report = {'created': 0, 'duplicates': [], 'invalid': []}
+        seen = set()
+        it = iter(users)
+        workers = workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            line = 0
+            while True:
+                chunk = list(itertools.islice(it, chunk_size))
+                if not chunk:
+                    break
+                todo = []
+                for username, password, role in chunk:
+                    line += 1
+                    username = (username or '').strip()
+                    if not username or not password or role not in USER_ROLES:
+                        report['invalid'].append((line, username, 'kullanıcı adı, parola veya rol geçersiz'))
+                    elif username in seen:
+                        report['duplicates'].append(username)
+                    else:
+                        seen.add(username)
+                        todo.append((username, password, role))
+                if not todo:
+                    continue
+                pwds = [p for _, p, _ in todo]
+                algo, iters = self.password_algo, self.password_iterations
+                if pool is not None:
+                    hashes = list(pool.map(hash_password, pwds, itertools.repeat(algo), itertools.repeat(iters),
+                                           chunksize=max(1, len(pwds) // (4 * workers))))
+                else:
+                    hashes = [hash_password(p, algo, iters) for p in pwds]
+                with self._write(immediate=True) as cur:
+                    names = [u for u, _, _ in todo]
+                    cur.execute(f"SELECT username FROM users WHERE username IN ({','.join('?' * len(names))})", names)
+                    existing = {r[0] for r in cur.fetchall()}
+                    rows = [(u, ph, sl, algo, iters, role) for (u, _, role), (ph, sl) in zip(todo, hashes) if u not in existing]
+                    cur.executemany('INSERT INTO users (username, password_hash, salt, hash_algo, hash_iterations, role) VALUES (?,?,?,?,?,?)', rows)
+                report['duplicates'].extend(u for u in names if u in existing)
+                report['created'] += len(rows)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        log.info('Bulk user import: %d created, %d duplicates, %d invalid', report['created'], len(report['duplicates']), len(report['invalid']))
+        return report
+
+    def list_users(self, after_id=None, limit=None):
+        cur = self._read()
+        cur.execute('SELECT id, username, role FROM users WHERE id > ? ORDER BY id LIMIT ?',
+                    (after_id if after_id is not None else -1, limit if limit is not None else -1))
         return [dict(r) for r in cur.fetchall()]
 
+    def count_users(self):
+        cur = self._read()
+        cur.execute('SELECT COUNT(*) FROM users')
+        return cur.fetchone()[0]
+
     def delete_user(self, user_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM users WHERE id=?', (user_id,))
-        self.conn.commit()
-        logging.info(f'User {user_id} deleted')
+        with self._write() as cur:
+            cur.execute('DELETE FROM users WHERE id=?', (user_id,))
+        self._forget_user(user_id)
+        log.info('User %s deleted', user_id)
 
     def change_password(self, user_id, new_password):
-        ph, sl = self._hash_password(new_password)
-        cur = self.conn.cursor()
-        cur.execute('UPDATE users SET password_hash=?, salt=? WHERE id=?', (ph, sl, user_id))
-        self.conn.commit()
-        logging.info(f'Password changed for user {user_id}')
-
-    def _hash_password(self, password):
-        salt = hashlib.sha256(os.urandom(60)).hexdigest().encode('ascii')
-        pwdhash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-        pwdhash = binascii.hexlify(pwdhash)
-        return (pwdhash.decode('ascii'), salt.decode('ascii'))
-
-    def _verify_password(self, provided_password, salt_hex, stored_hash_hex):
-        salt = salt_hex.encode('ascii')
-        pwdhash = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt, 100000)
-        pwdhash = binascii.hexlify(pwdhash).decode('ascii')
-        return pwdhash == stored_hash_hex
+        ph, sl = hash_password(new_password, self.password_algo, self.password_iterations)
+        with self._write() as cur:
+            cur.execute('UPDATE users SET password_hash=?, salt=?, hash_algo=?, hash_iterations=? WHERE id=?',
+                        (ph, sl, self.password_algo, self.password_iterations, user_id))
+        self._forget_user(user_id)
+        log.info('Password changed for user %s', user_id)
 
     # Students
-    def add_student(self, name, surname, tc, parent_chat_id=None):
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO students (name,surname,tc,parent_chat_id) VALUES (?,?,?,?)', (name,surname,tc,parent_chat_id))
-        self.conn.commit()
-        logging.info(f'Added student {name} {surname}')
-
-    def list_students(self):
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM students')
+    def add_student(self, name, surname, tc, parent_chat_id=None, class_name=None):
+        with self._write() as cur:
+            cur.execute('INSERT INTO students (name,surname,tc,parent_chat_id,class_name,name_fold,surname_fold) VALUES (?,?,?,?,?,?,?)',
+                        (name, surname, tc, parent_chat_id, class_name, tr_fold(name), tr_fold(surname)))
+        log.info('Added student %s %s', name, surname)
+
+    def list_students(self, class_name=None, after_id=None, limit=None):
+        # keyset pagination: pass the last id of the previous page as after_id. A class
+        # roster is ordered by (surname, name, id), the id order otherwise.
+        cur = self._read()
+        limit = limit if limit is not None else -1
+        if class_name is not None and after_id is not None:
+            cur.execute('''SELECT * FROM students WHERE class_name=? AND (surname, name, id) > (SELECT surname, name, id FROM students WHERE id=?)
+                           ORDER BY surname, name, id LIMIT ?''', (class_name, after_id, limit))
+        elif class_name is not None:
+            cur.execute('SELECT * FROM students WHERE class_name=? ORDER BY surname, name, id LIMIT ?', (class_name, limit))
+        else:
+            cur.execute('SELECT * FROM students WHERE id > ? ORDER BY id LIMIT ?', (after_id if after_id is not None else -1, limit))
+        return [dict(r) for r in cur.fetchall()]
+
+    def search_students(self, query, limit=20):
+        # search-as-you-type: whole-word matches first, then prefix matches. No bm25
+        # ranking: common names match thousands of rows and sorting them all costs
+        # more than the lookup, while LIMIT lets FTS stop early.
+        terms = [t for t in re.split(r'\W+', tr_fold(query)) if t]
+        if not terms:
+            return []
+        cur = self._read()
+        sql = 'SELECT s.* FROM students_fts JOIN students s ON s.id=students_fts.rowid WHERE students_fts MATCH ? LIMIT ?'
+        cur.execute(sql, (' '.join(f'"{t}"' for t in terms), limit))
+        rows = [dict(r) for r in cur.fetchall()]
+        if len(rows) < limit:
+            seen = {r['id'] for r in rows}
+            cur.execute(sql, (' '.join(f'"{t}"*' for t in terms), limit + len(rows)))
+            rows += [dict(r) for r in cur.fetchall() if r['id'] not in seen][:limit - len(rows)]
+        return rows
+
+    def upsert_students(self, rows):
+        # rows: dicts with tc, name, surname and optional class_name, parent_chat_id.
+        # Matches on TC: existing students are updated, new ones inserted, all in one
+        # transaction. A TC repeated within the batch counts as an update (last row wins).
+        # Returns (inserted, updated).
+        if not rows:
+            return 0, 0
+        batch = {}
+        for r in rows:
+            batch[r['tc']] = r
+        repeats = len(rows) - len(batch)
+        with self._write(immediate=True) as cur:
+            tcs = list(batch)
+            # tc <> '' lets SQLite use the partial unique index (ux_students_tc)
+            cur.execute(f"SELECT tc, id FROM students WHERE tc <> '' AND tc IN ({','.join('?' * len(tcs))})", tcs)
+            known = {r['tc']: r['id'] for r in cur.fetchall()}
+            new_rows, upd_rows = [], []
+            for tc, r in batch.items():
+                values = (r['name'], r['surname'], tr_fold(r['name']), tr_fold(r['surname']),
+                          r.get('class_name') or None, r.get('parent_chat_id') or None)
+                if tc in known:
+                    upd_rows.append(values + (known[tc],))
+                else:
+                    new_rows.append(values + (tc,))
+            cur.executemany('INSERT INTO students (name,surname,name_fold,surname_fold,class_name,parent_chat_id,tc) VALUES (?,?,?,?,?,?,?)', new_rows)
+            cur.executemany('UPDATE students SET name=?, surname=?, name_fold=?, surname_fold=?, class_name=COALESCE(?, class_name), '
+                            'parent_chat_id=COALESCE(?, parent_chat_id) WHERE id=?', upd_rows)
+        self._student_cache.invalidate(*known.values())
+        return len(new_rows), len(upd_rows) + repeats
+
+    def count_students(self):
+        cur = self._read()
+        cur.execute('SELECT COUNT(*) FROM students')
+        return cur.fetchone()[0]
+
+    def list_classes(self):
+        cur = self._read()
+        cur.execute("SELECT DISTINCT class_name FROM students WHERE class_name IS NOT NULL AND class_name <> '' ORDER BY class_name")
+        return [r[0] for r in cur.fetchall()]
+
+    def students_for_chat(self, chat_id):
+        # a parent's children, by the Telegram chat linked to them
+        cur = self._read()
+        cur.execute('SELECT * FROM students WHERE parent_chat_id=? ORDER BY name, surname', (str(chat_id),))
         return [dict(r) for r in cur.fetchall()]
 
     def get_student(self, sid):
-        cur = self.conn.cursor()
+        # copies, so callers may modify what they get without touching the cache
+        r = self._student_cache.get_or_load(sid, lambda: self._load_student(sid), cache_none=False)
+        return dict(r) if r else None
+
+    def _load_student(self, sid):
+        cur = self._read()
         cur.execute('SELECT * FROM students WHERE id=?', (sid,))
         r = cur.fetchone()
         return dict(r) if r else None
 
     # Attendance
     def add_attendance(self, student_id, status):
-        cur = self.conn.cursor()
         ts = datetime.datetime.now().isoformat()
-        cur.execute('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)', (student_id,status,ts))
-        self.conn.commit()
-        logging.info(f'Attendance for {student_id}: {status}')
+        with self._write() as cur:
+            cur.execute('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)', (student_id,status,ts))
+        log.info('Attendance for %s: %s', student_id, status)
+
+    def add_attendance_bulk(self, records):
+        # records: iterable of (student_id, status) for a whole class.
+        # Written in a single transaction (one fsync per class instead of per student).
+        ts = datetime.datetime.now().isoformat()
+        rows = [(sid, status, ts) for sid, status in records]
+        if not rows:
+            return []
+        for _, status, _ in rows:
+            if status not in ATTENDANCE_STATUSES:
+                raise ValueError(f'Geçersiz yoklama durumu: {status}')
+        with self._write(immediate=True) as cur:
+            # the write lock is held until commit, so ids above the current max are ours
+            cur.execute('SELECT COALESCE(MAX(id), 0) FROM attendance')
+            last_id = cur.fetchone()[0]
+            cur.executemany('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)', rows)
+            cur.execute('SELECT id FROM attendance WHERE id > ? ORDER BY id', (last_id,))
+            ids = [r[0] for r in cur.fetchall()]
+        log.info('Bulk attendance: %d rows', len(ids))
+        return ids
+
+    def list_attendance(self, before_id=None, limit=20, after_id=None):
+        # newest first; keyset on id (pass the last id of the previous page as before_id).
+        # after_id returns the rows added since the newest one a caller already has.
+        cur = self._read()
+        if after_id is not None:
+            cur.execute('SELECT a.*, s.name, s.surname FROM attendance a LEFT JOIN students s ON a.student_id=s.id WHERE a.id > ? ORDER BY a.id DESC LIMIT ?', (after_id, limit))
+        elif before_id is None:
+            cur.execute('SELECT a.*, s.name, s.surname FROM attendance a LEFT JOIN students s ON a.student_id=s.id ORDER BY a.id DESC LIMIT ?', (limit,))
+        else:
+            cur.execute('SELECT a.*, s.name, s.surname FROM attendance a LEFT JOIN students s ON a.student_id=s.id WHERE a.id < ? ORDER BY a.id DESC LIMIT ?', (before_id, limit))
+        return [dict(r) for r in cur.fetchall()]
+
+    def attendance_summary(self, student_id, since=None, recent=5):
+        # {'counts': {status: n}, 'absences': [ts, ...]} for one student from since (a date
+        # or ISO text) on; absences are the latest `recent` 'Gelmedi' marks, newest first.
+        # Both read only the (student_id, ts, status) index.
+        since = str(since) if since is not None else ''
+        cur = self._read()
+        cur.execute('SELECT status, COUNT(*) FROM attendance WHERE student_id=? AND ts >= ? GROUP BY status', (student_id, since))
+        counts = {r[0]: r[1] for r in cur.fetchall()}
+        cur.execute("SELECT ts FROM attendance WHERE student_id=? AND ts >= ? AND status='Gelmedi' ORDER BY ts DESC LIMIT ?",
+                    (student_id, since, recent))
+        return {'counts': counts, 'absences': [r[0] for r in cur.fetchall()]}
+
+    def count_attendance(self):
+        cur = self._read()
+        cur.execute('SELECT COUNT(*) FROM attendance')
+        return cur.fetchone()[0]
+
+    def attendance_monthly(self, start, end, by='student', batch=1000):
+        # per-month status counts for attendance in [start, end) (ISO date strings),
+        # one row per (student, month) or (class, month). Generator: rows are fetched
+        # in batches of `batch` and never collected into a list.
+        # Rows: (month, student_id, name, surname, class_name, *counts, total) or
+        #       (month, class_name, students, *counts, total); counts follow ATTENDANCE_STATUSES.
+        if by not in ('student', 'class'):
+            raise ValueError(f'Geçersiz rapor türü: {by}')
+        counts = ', '.join(f'SUM(status = ?) AS c{i}' for i in range(len(ATTENDANCE_STATUSES)))
+        # grouping by student first walks idx_attendance_student_ts (covering) in order;
+        # only the per-student-month rows reach the join and the class grouping
+        per_student = f'''SELECT student_id, substr(ts, 1, 7) AS month, {counts}, COUNT(*) AS total
+                          FROM attendance WHERE ts >= ? AND ts < ? GROUP BY student_id, month'''
+        cols = ', '.join(f'm.c{i}' for i in range(len(ATTENDANCE_STATUSES)))
+        sums = ', '.join(f'SUM(m.c{i})' for i in range(len(ATTENDANCE_STATUSES)))
+        if by == 'student':
+            sql = f'''SELECT m.month, m.student_id, s.name, s.surname, s.class_name, {cols}, m.total
+                      FROM ({per_student}) m LEFT JOIN students s ON s.id = m.student_id
+                      ORDER BY m.month, s.class_name, s.surname, s.name, m.student_id'''
+        else:
+            sql = f'''SELECT m.month, COALESCE(s.class_name, '') AS class_name, COUNT(*), {sums}, SUM(m.total)
+                      FROM ({per_student}) m LEFT JOIN students s ON s.id = m.student_id
+                      GROUP BY m.month, class_name ORDER BY m.month, class_name'''
+        cur = self._read()
+        cur.execute(sql, ATTENDANCE_STATUSES + (start, end))
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                yield tuple(r)
 
     # Appointments
     def add_appointment(self, student_id, teacher_id, start_ts, duration_min=15):
-        # enforce max 3 appointments per student per calendar week
-        cur = self.conn.cursor()
-        start = datetime.datetime.fromisoformat(start_ts)
-        monday = start - datetime.timedelta(days=start.weekday())
-        sunday = monday + datetime.timedelta(days=6, hours=23, minutes=59, seconds=59)
-        # count existing appointments for this student in the same calendar week by parsing stored timestamps
-        cur.execute('SELECT start_ts FROM appointments WHERE student_id=?', (student_id,))
-        rows = cur.fetchall()
-        c = 0
-        for r in rows:
-            try:
-                appt_dt = datetime.datetime.fromisoformat(r['start_ts'])
-                if appt_dt >= monday and appt_dt <= sunday:
-                    c += 1
-            except Exception:
-                continue
-        if c >= 3:
-            return False, 'Haftada maksimum 3 randevu hakkı dolu'
-        # check teacher availability slots (if any exists, require the appointment to be inside a slot)
-        cur.execute('SELECT * FROM teacher_availability WHERE teacher_id=?', (teacher_id,))
-        slots = cur.fetchall()
-        if slots:
-            ok_slot = False
-            appt_start = start
-            appt_end = start + datetime.timedelta(minutes=duration_min)
-            for sl in slots:
-                s_start = datetime.datetime.fromisoformat(sl['start_ts'])
-                s_end = datetime.datetime.fromisoformat(sl['end_ts'])
-                if appt_start >= s_start and appt_end <= s_end:
-                    ok_slot = True
+        # returns (ok, err, reason); reason is one of APPOINTMENT_CONFLICTS when ok is False
+        start = _parse_ts(start_ts)
+        end = start + datetime.timedelta(minutes=duration_min)
+        start_ts = _fmt_ts(start)
+        monday = datetime.datetime.combine(start.date() - datetime.timedelta(days=start.weekday()), datetime.time())
+        next_monday = monday + datetime.timedelta(days=7)
+        # check + insert in one IMMEDIATE transaction so concurrent bookings cannot both pass
+        with self._write(immediate=True) as cur:
+            # enforce max 3 appointments per student per calendar week (indexed range count)
+            cur.execute('SELECT COUNT(*) FROM appointments WHERE student_id=? AND start_ts >= ? AND start_ts < ?',
+                        (student_id, _fmt_ts(monday), _fmt_ts(next_monday)))
+            if cur.fetchone()[0] >= MAX_APPOINTMENTS_PER_WEEK:
+                return False, 'Haftada maksimum 3 randevu hakkı dolu', 'weekly_limit'
+            sched = self._schedule(cur, teacher_id)
+            # if the teacher has availability slots, the appointment must be inside one
+            if sched.has_availability() and not sched.is_available(start, end):
+                return False, 'Seçilen öğretmen bu saatte müsait değil', 'unavailable'
+            clash = sched.conflict(start, end)
+            if clash is not None:
+                return False, f'Öğretmenin bu saatte başka randevusu var (#{clash})', 'teacher_busy'
+            cur.execute('INSERT INTO appointments (student_id,teacher_id,start_ts,duration_min) VALUES (?,?,?,?)', (student_id,teacher_id,start_ts,duration_min))
+            sched.add_booking(cur.lastrowid, start, end)
+        log.info('Appointment added for student %s with teacher %s at %s', student_id, teacher_id, start_ts)
+        return True, None, None
+
+    def find_free_slots(self, start_ts=None, end_ts=None, teacher_id=None, student_id=None, limit=FREE_SLOTS_LIMIT,
+                        duration_min=15):
+        # the first `limit` bookable slots in [start_ts, end_ts) (default: now to
+        # FREE_SLOTS_DAYS ahead) for one teacher or every teacher with availability in the
+        # range, earliest first: availability windows minus appointments, on a
+        # duration_min grid. With student_id, weeks where the student already has
+        # MAX_APPOINTMENTS_PER_WEEK appointments are skipped. Teachers without any
+        # availability accept any time in add_appointment and are not listed.
+        start = _parse_ts(start_ts) if start_ts is not None else datetime.datetime.now().replace(second=0, microsecond=0)
+        end = _parse_ts(end_ts) if end_ts is not None else start + datetime.timedelta(days=FREE_SLOTS_DAYS)
+        duration = datetime.timedelta(minutes=duration_min)
+        monday = datetime.datetime.combine(start.date() - datetime.timedelta(days=start.weekday()), datetime.time())
+        full_weeks = set()
+        cur = self._read()
+        if student_id is not None:
+            cur.execute('SELECT start_ts FROM appointments WHERE student_id=? AND start_ts >= ? AND start_ts < ?',
+                        (student_id, _fmt_ts(monday), _fmt_ts(end)))
+            per_week = collections.Counter(_parse_ts(r[0]).date().isocalendar()[:2] for r in cur.fetchall())
+            full_weeks = {w for w, n in per_week.items() if n >= MAX_APPOINTMENTS_PER_WEEK}
+        if teacher_id is not None:
+            teachers = [teacher_id]
+        else:
+            cur.execute('SELECT DISTINCT teacher_id FROM teacher_availability WHERE start_ts < ? AND end_ts > ?',
+                        (_fmt_ts(end), _fmt_ts(start)))
+            teachers = [r[0] for r in cur.fetchall()]
+        slots = []
+        # the schedules are shared with add_appointment: walk them under the write lock.
+        # Each teacher's sweep is lazy, so the merge stops after `limit` slots.
+        with self._write() as cur:
+            sweeps = [zip(self._schedule(cur, tid).free_slots(start, end, duration), itertools.repeat(tid)) for tid in teachers]
+            for t, tid in heapq.merge(*sweeps):
+                if t.date().isocalendar()[:2] in full_weeks:
+                    continue
+                slots.append({'teacher_id': tid, 'start_ts': _fmt_ts(t), 'end_ts': _fmt_ts(t + duration)})
+                if len(slots) >= limit:
                     break
-            if not ok_slot:
-                return False, 'Seçilen öğretmen bu saatte müsait değil'
-        cur.execute('INSERT INTO appointments (student_id,teacher_id,start_ts,duration_min) VALUES (?,?,?,?)', (student_id,teacher_id,start_ts,duration_min))
-        self.conn.commit()
-        logging.info(f'Appointment added for student {student_id} with teacher {teacher_id} at {start_ts}')
-        return True, None
+        return slots
+
+    def add_availability(self, teacher_id, start_ts, end_ts):
+        start = _parse_ts(start_ts)
+        end = _parse_ts(end_ts)
+        if end <= start:
+            raise ValueError('Bitiş zamanı başlangıçtan sonra olmalı')
+        with self._write() as cur:
+            sched = self._schedule(cur, teacher_id)
+            cur.execute('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUES (?,?,?)', (teacher_id,_fmt_ts(start),_fmt_ts(end)))
+            av_id = cur.lastrowid
+            sched.add_availability(av_id, start, end)
+        return av_id
+
+    def delete_availability(self, av_id):
+        with self._write() as cur:
+            cur.execute('SELECT teacher_id FROM teacher_availability WHERE id=?', (av_id,))
+            row = cur.fetchone()
+            if not row:
+                return False
+            sched = self._schedule(cur, row['teacher_id'])
+            cur.execute('DELETE FROM teacher_availability WHERE id=?', (av_id,))
+            sched.remove_availability(av_id)
+        log.info('Availability %s deleted', av_id)
+        return True
 
     def list_appointments(self, student_id=None):
-        cur = self.conn.cursor()
+        cur = self._read()
         if student_id:
             cur.execute('SELECT * FROM appointments WHERE student_id=? ORDER BY start_ts DESC', (student_id,))
         else:
@@ -185,82 +896,486 @@ class Database:
         return [dict(r) for r in cur.fetchall()]
 
     def delete_appointment(self, appt_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM appointments WHERE id=?', (appt_id,))
-        self.conn.commit()
-        logging.info(f'Appointment {appt_id} deleted')
+        with self._write() as cur:
+            cur.execute('SELECT teacher_id FROM appointments WHERE id=?', (appt_id,))
+            row = cur.fetchone()
+            if row:
+                sched = self._schedule(cur, row['teacher_id'])
+                cur.execute('DELETE FROM appointments WHERE id=?', (appt_id,))
+                sched.remove_booking(appt_id)
+        log.info('Appointment %s deleted', appt_id)
 
     # Student edits
-    def edit_student(self, student_id, name=None, surname=None, tc=None, parent_chat_id=None):
-        cur = self.conn.cursor()
+    def edit_student(self, student_id, name=None, surname=None, tc=None, parent_chat_id=None, class_name=None):
         # build dynamic update
         fields = []
         params = []
         if name is not None:
-            fields.append('name=?'); params.append(name)
+            fields.append('name=?, name_fold=?'); params.extend((name, tr_fold(name)))
         if surname is not None:
-            fields.append('surname=?'); params.append(surname)
+            fields.append('surname=?, surname_fold=?'); params.extend((surname, tr_fold(surname)))
         if tc is not None:
             fields.append('tc=?'); params.append(tc)
         if parent_chat_id is not None:
             fields.append('parent_chat_id=?'); params.append(parent_chat_id)
+        if class_name is not None:
+            fields.append('class_name=?'); params.append(class_name)
         if not fields:
             return False
         params.append(student_id)
         sql = f"UPDATE students SET {', '.join(fields)} WHERE id=?"
-        cur.execute(sql, params)
-        self.conn.commit()
-        logging.info(f'Student {student_id} updated')
+        with self._write() as cur:
+            cur.execute(sql, params)
+        self._student_cache.invalidate(student_id)
+        log.info('Student %s updated', student_id)
         return True
 
     def delete_student(self, student_id):
-        cur = self.conn.cursor()
-        cur.execute('DELETE FROM students WHERE id=?', (student_id,))
-        self.conn.commit()
-        logging.info(f'Student {student_id} deleted')
+        with self._write() as cur:
+            cur.execute('DELETE FROM students WHERE id=?', (student_id,))
+        self._student_cache.invalidate(student_id)
+        log.info('Student %s deleted', student_id)
 
     # Exams
     def add_exam(self, student_id, name, score, ts=None):
-        cur = self.conn.cursor()
         if ts is None:
             ts = datetime.datetime.now().isoformat()
-        cur.execute('INSERT INTO exams (student_id,name,score,ts) VALUES (?,?,?,?)', (student_id,name,score,ts))
-        self.conn.commit()
-        logging.info(f'Exam {name} for student {student_id} added')
+        with self._write() as cur:
+            cur.execute('INSERT INTO exams (student_id,name,score,ts) VALUES (?,?,?,?)', (student_id,name,score,ts))
+            if score is not None and name is not None and student_id is not None:
+                # aggregates move in the same transaction as the row
+                for table, key in (('exam_stats', 'exam'), ('student_exam_stats', 'student_id')):
+                    cur.execute(f'''INSERT INTO {table} ({key}, n, total, total_sq, min_score, max_score) VALUES (?,1,?,?,?,?)
+                                    ON CONFLICT({key}) DO UPDATE SET n=n+1, total=total+excluded.total,
+                                    total_sq=total_sq+excluded.total_sq, min_score=MIN(min_score, excluded.min_score),
+                                    max_score=MAX(max_score, excluded.max_score)''',
+                                (name if key == 'exam' else student_id, score, score * score, score, score))
+                cur.execute('''INSERT INTO exam_score_buckets (exam, score, n) VALUES (?,?,1)
+                               ON CONFLICT(exam, score) DO UPDATE SET n=n+1''', (name, score))
+        log.info('Exam %s for student %s added', name, student_id)
+
+    def _summary(self, table, key, value):
+        cur = self._read()
+        cur.execute(f'SELECT n, total, total_sq, min_score, max_score FROM {table} WHERE {key}=?', (value,))
+        r = cur.fetchone()
+        if not r or not r['n']:
+            return None
+        n = r['n']
+        mean = r['total'] / n
+        # population standard deviation from the running sums
+        var = max(r['total_sq'] / n - mean * mean, 0.0)
+        return {'n': n, 'mean': mean, 'std': var ** 0.5, 'min': r['min_score'], 'max': r['max_score']}
+
+    def exam_summary(self, name):
+        return self._summary('exam_stats', 'exam', name)
+
+    def student_exam_summary(self, student_id):
+        return self._summary('student_exam_stats', 'student_id', student_id)
+
+    def exam_rank(self, name, score):
+        # (rank, n, percentile): rank 1 is the top score; percentile is the share of
+        # scores below this one, counting ties as half
+        cur = self._read()
+        cur.execute('''SELECT COALESCE(SUM(CASE WHEN score > ? THEN n END), 0) AS above,
+                              COALESCE(SUM(CASE WHEN score = ? THEN n END), 0) AS same,
+                              COALESCE(SUM(n), 0) AS total
+                       FROM exam_score_buckets WHERE exam=?''', (score, score, name))
+        r = cur.fetchone()
+        if not r['total']:
+            return None
+        below = r['total'] - r['above'] - r['same']
+        return r['above'] + 1, r['total'], 100.0 * (below + 0.5 * r['same']) / r['total']
+
+    def rebuild_exam_stats(self):
+        # full recompute for when the aggregates drift (rows edited outside add_exam);
+        # vectorized with NumPy when it is installed, plain GROUP BY otherwise
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        with self._write(immediate=True) as cur:
+            if np is None:
+                _rebuild_exam_stats_sql(cur)
+            else:
+                # plain tuples instead of sqlite3.Row halve the fetch cost; exam names
+                # become dense integer codes so NumPy only works on numbers
+                cur.row_factory = None
+                cur.execute('SELECT student_id, name, score FROM exams WHERE score IS NOT NULL AND name IS NOT NULL AND student_id IS NOT NULL')
+                rows = cur.fetchall()
+                codes = {}
+                exam_idx = np.fromiter((codes.setdefault(r[1], len(codes)) for r in rows), np.int64, len(rows))
+                exam_names = list(codes)
+                students = np.fromiter((r[0] for r in rows), np.int64, len(rows))
+                scores = np.fromiter((r[2] for r in rows), np.float64, len(rows))
+                del rows
+                cur.execute('DELETE FROM exam_stats')
+                cur.execute('DELETE FROM student_exam_stats')
+                cur.execute('DELETE FROM exam_score_buckets')
+                if len(scores):
+                    stats, buckets = _group_stats(np, exam_idx, scores)
+                    cur.executemany('INSERT INTO exam_stats VALUES (?,?,?,?,?,?)', ((exam_names[k],) + tuple(v) for k, *v in stats))
+                    cur.executemany('INSERT INTO exam_score_buckets VALUES (?,?,?)', ((exam_names[k], sc, n) for k, sc, n in buckets))
+                    stats, _ = _group_stats(np, students, scores)
+                    cur.executemany('INSERT INTO student_exam_stats VALUES (?,?,?,?,?,?)', stats)
+            cur.execute('SELECT COUNT(*) FROM exam_stats')
+            exams = cur.fetchone()[0]
+        log.info('Exam statistics rebuilt for %d exams', exams)
+        return exams
 
-    def list_exams(self, student_id):
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM exams WHERE student_id=? ORDER BY ts DESC', (student_id,))
+    def list_exams(self, student_id, limit=None):
+        # newest first
+        cur = self._read()
+        cur.execute('SELECT * FROM exams WHERE student_id=? ORDER BY ts DESC LIMIT ?', (student_id, limit if limit is not None else -1))
         return [dict(r) for r in cur.fetchall()]
 
     # Backup
-    def backup(self, dest_dir='backups'):
+    def backup(self, dest_dir='backups', compress=False, verify=True, keep=None, pages=BACKUP_STEP_PAGES, progress=None):
+        # online backup through the SQLite backup API; other threads keep reading and writing.
+        # progress(copied_pages, total_pages) is called after every step.
         os.makedirs(dest_dir, exist_ok=True)
         ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         dest = os.path.join(dest_dir, f'smartdershane_{ts}.db')
-        self.conn.commit()
-        self.conn.close()
-        shutil.copyfile(self.path, dest)
-        # reopen
-        self.conn = sqlite3.connect(self.path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        cur = self.conn.cursor()
-        cur.execute('INSERT INTO backups (path,ts) VALUES (?,?)', (dest,ts))
-        self.conn.commit()
-        logging.info(f'Database backed up to {dest}')
+        n = 1
+        while os.path.exists(dest) or os.path.exists(dest + '.gz'):
+            dest = os.path.join(dest_dir, f'smartdershane_{ts}_{n}.db')
+            n += 1
+        src = self._connect(readonly=True)
+        try:
+            # hold one read snapshot for the whole copy: WAL writers are not blocked and
+            # the backup does not restart when they commit
+            src.execute('BEGIN')
+            src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            dst = sqlite3.connect(dest)
+            try:
+                def _step(status, remaining, total):
+                    if progress:
+                        progress(total - remaining, total)
+                src.backup(dst, pages=pages, progress=_step)
+            finally:
+                dst.close()
+            src.rollback()
+        except Exception:
+            if os.path.exists(dest):
+                os.remove(dest)
+            raise
+        finally:
+            src.close()
+        if verify:
+            check = sqlite3.connect(dest)
+            try:
+                result = check.execute('PRAGMA integrity_check').fetchone()[0]
+            finally:
+                check.close()
+            if result != 'ok':
+                os.remove(dest)
+                raise RuntimeError(f'Yedek doğrulanamadı: {result}')
+        if compress:
+            with open(dest, 'rb') as f, gzip.open(dest + '.gz', 'wb') as g:
+                shutil.copyfileobj(f, g, BACKUP_COPY_CHUNK)
+            os.remove(dest)
+            dest += '.gz'
+        with self._write() as cur:
+            cur.execute('INSERT INTO backups (path,ts,size,compressed,verified) VALUES (?,?,?,?,?)',
+                        (dest, ts, os.path.getsize(dest), int(compress), int(verify)))
+        log.info('Database backed up to %s', dest)
+        if keep:
+            self.prune_backups(keep)
         return dest
 
+    def start_backup(self, callback=None, **kwargs):
+        # runs backup() on a background thread; callback(dest, error) is called from that thread
+        def _run():
+            try:
+                dest = self.backup(**kwargs)
+            except Exception as e:
+                log.exception('Backup failed')
+                if callback:
+                    callback(None, e)
+                return
+            if callback:
+                callback(dest, None)
+        t = threading.Thread(target=_run, name='db-backup', daemon=True)
+        t.start()
+        return t
+
+    def list_backups(self):
+        cur = self._read()
+        cur.execute('SELECT * FROM backups ORDER BY id DESC')
+        return [dict(r) for r in cur.fetchall()]
+
+    def prune_backups(self, keep):
+        # retention: keep the newest `keep` backups, delete older files and rows
+        cur = self._read()
+        cur.execute('SELECT id, path FROM backups ORDER BY id DESC LIMIT -1 OFFSET ?', (keep,))
+        old = cur.fetchall()
+        for r in old:
+            try:
+                if r['path'] and os.path.exists(r['path']):
+                    os.remove(r['path'])
+            except OSError:
+                log.exception('Could not remove old backup %s', r['path'])
+        if old:
+            with self._write() as wcur:
+                wcur.executemany('DELETE FROM backups WHERE id=?', [(r['id'],) for r in old])
+            log.info('Pruned %d old backups', len(old))
+        return len(old)
+
+    # Telegram outbox
+    def enqueue_messages(self, messages):
+        # messages: iterable of (chat_id, text); one transaction for the batch
+        rows = self._outbox_rows(messages)
+        if not rows:
+            return 0
+        with self._write() as cur:
+            cur.executemany("INSERT INTO outbox (chat_id,text,created_ts) VALUES (?,?,?)", rows)
+        return len(rows)
+
+    def _outbox_rows(self, messages):
+        ts = datetime.datetime.now().isoformat()
+        return [(str(chat_id), text, ts) for chat_id, text in messages if chat_id]
+
+    def enqueue_message(self, chat_id, text):
+        return self.enqueue_messages([(chat_id, text)]) == 1
+
+    def due_messages(self, limit=100, now=None):
+        # read-only view of what is due; delivery goes through claim_messages
+        if now is None:
+            now = time.time()
+        cur = self._read()
+        cur.execute("SELECT * FROM outbox WHERE status='pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?", (now, limit))
+        return [dict(r) for r in cur.fetchall()]
+
+    def claim_messages(self, worker, limit=100, skip_chats=(), lease_s=OUTBOX_LEASE_S, now=None):
+        # atomically hands up to `limit` due messages to `worker` (status 'sending') and
+        # returns them, oldest first, so several notifiers on a shared database never
+        # send the same row. Chats in skip_chats (waiting on rate limits) and chats that
+        # still have a message in flight are left out, which keeps each chat's order.
+        # Claims whose lease ran out (worker crashed mid-batch) are returned to pending.
+        if now is None:
+            now = time.time()
+        with self._write(immediate=True) as cur:
+            cur.execute("UPDATE outbox SET status='pending', claimed_by=NULL, lease_until=NULL WHERE status='sending' AND lease_until < ?", (now,))
+            cur.execute("""SELECT * FROM outbox WHERE status='pending' AND next_attempt_at <= ?
+                             AND chat_id NOT IN (SELECT value FROM json_each(?))
+                             AND chat_id NOT IN (SELECT chat_id FROM outbox WHERE status='sending')
+                           ORDER BY id LIMIT ?""", (now, json.dumps([str(c) for c in skip_chats]), limit))
+            rows = [dict(r) for r in cur.fetchall()]
+            cur.executemany("UPDATE outbox SET status='sending', claimed_by=?, lease_until=? WHERE id=? AND status='pending'",
+                            [(worker, now + lease_s, r['id']) for r in rows])
+        return rows
+
+    def release_messages(self, ids):
+        # claimed but not attempted (chat became rate limited, worker stopping)
+        if not ids:
+            return
+        with self._write() as cur:
+            cur.executemany("UPDATE outbox SET status='pending', claimed_by=NULL, lease_until=NULL WHERE id=? AND status='sending'",
+                            [(i,) for i in ids])
+
+    def next_message_due_at(self):
+        cur = self._read()
+        cur.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status='pending'")
+        return cur.fetchone()[0]
+
+    def mark_messages_sent(self, ids):
+        if not ids:
+            return
+        ts = datetime.datetime.now().isoformat()
+        with self._write() as cur:
+            cur.executemany("UPDATE outbox SET status='sent', sent_ts=?, attempts=attempts+1, lease_until=NULL WHERE id=?", [(ts, i) for i in ids])
+
+    def mark_message_retry(self, msg_id, next_attempt_at, error):
+        with self._write() as cur:
+            cur.execute("""UPDATE outbox SET status='pending', claimed_by=NULL, lease_until=NULL, attempts=attempts+1,
+                           next_attempt_at=?, last_error=? WHERE id=?""", (next_attempt_at, error, msg_id))
+
+    def mark_message_failed(self, msg_id, error):
+        with self._write() as cur:
+            cur.execute("UPDATE outbox SET status='failed', lease_until=NULL, attempts=attempts+1, last_error=? WHERE id=?", (error, msg_id))
+        log.warning('Outbox message %s failed permanently: %s', msg_id, error)
+
+    def outbox_counts(self):
+        cur = self._read()
+        cur.execute('SELECT status, COUNT(*) AS c FROM outbox GROUP BY status')
+        return {r['status']: r['c'] for r in cur.fetchall()}
+
+    # Parent digests
+    def parent_digest(self, day, appointment_days=DIGEST_APPOINTMENT_DAYS):
+        # one query for the whole school: the day's attendance and exam scores and the
+        # appointments of the following appointment_days days, for students with a
+        # parent chat. Yields (chat_id, items) per parent; items are dicts with kind
+        # ('attendance', 'exam' or 'appointment'), student_id, name, surname, ts, detail
+        # (status, exam name or teacher) and score, ordered by student, kind and time.
+        day = datetime.date.fromisoformat(str(day))
+        start, end = day.isoformat(), (day + datetime.timedelta(days=1)).isoformat()
+        appt_end = (day + datetime.timedelta(days=1 + appointment_days)).isoformat()
+        cur = self._read()
+        cur.execute('''SELECT s.parent_chat_id AS chat_id, s.id AS student_id, s.name, s.surname, e.kind, e.ts, e.detail, e.score
+                       FROM (SELECT 0 AS k, 'attendance' AS kind, student_id, ts, status AS detail, NULL AS score
+                               FROM attendance WHERE ts >= ? AND ts < ?
+                             UNION ALL
+                             SELECT 1, 'exam', student_id, ts, name, score FROM exams WHERE ts >= ? AND ts < ?
+                             UNION ALL
+                             SELECT 2, 'appointment', a.student_id, a.start_ts, u.username, NULL
+                               FROM appointments a LEFT JOIN users u ON u.id = a.teacher_id
+                               WHERE a.start_ts >= ? AND a.start_ts < ?) e
+                       JOIN students s ON s.id = e.student_id
+                       WHERE s.parent_chat_id IS NOT NULL AND s.parent_chat_id <> ''
+                       ORDER BY s.parent_chat_id, s.surname, s.name, s.id, e.k, e.ts''',
+                    (start, end, start, end, end, appt_end))
+        cols = [d[0] for d in cur.description]
+        chat, items = None, []
+        while True:
+            rows = cur.fetchmany(1000)
+            for r in rows:
+                if r[0] != chat:
+                    if items:
+                        yield chat, items
+                    chat, items = r[0], []
+                items.append(dict(zip(cols[1:], tuple(r)[1:])))
+            if not rows:
+                break
+        if items:
+            yield chat, items
+
+    def enqueue_digest(self, day, messages):
+        # queues one day's digests (chat_id, text) at most once, also with several
+        # notifiers running on different PCs: returns how many were queued, or None when
+        # that day's digest was already queued
+        day = str(day)
+        rows = self._outbox_rows(messages)
+        with self._write(immediate=True) as cur:
+            cur.execute("SELECT v FROM settings WHERE k='digest_last_day'")
+            r = cur.fetchone()
+            if r and r[0] >= day:
+                return None
+            cur.executemany("INSERT INTO outbox (chat_id,text,created_ts) VALUES (?,?,?)", rows)
+            cur.execute("INSERT OR REPLACE INTO settings (k,v) VALUES ('digest_last_day',?)", (day,))
+        self._settings_cache.invalidate('digest_last_day')
+        log.info('Digest for %s: %d messages queued', day, len(rows))
+        return len(rows)
+
+    # Change feed
+    def last_change_seq(self):
+        # high-water mark of the change feed; start polling changes_since from here
+        cur = self._read()
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name='changes'")
+        r = cur.fetchone()
+        return r[0] if r else 0
+
+    def changes_since(self, seq, limit=CHANGES_BATCH):
+        # [(seq, table, op, row_id)] committed after seq, oldest first, op is 'insert',
+        # 'update' or 'delete'. Several changes to one row are all listed. Returns None
+        # when the feed was pruned past seq: the caller has to reload and restart from
+        # last_change_seq().
+        cur = self._read()
+        cur.execute('SELECT seq, tbl, op, row_id FROM changes WHERE seq > ? ORDER BY seq LIMIT ?', (seq, limit))
+        rows = [tuple(r) for r in cur.fetchall()]
+        # seq has no gaps and pruning keeps the newest row, so a missing seq + 1 means pruned
+        if rows and rows[0][0] > seq + 1:
+            return None
+        # the feed is the only sign of writes made by other processes: drop what they changed
+        students = [row_id for _, tbl, _, row_id in rows if tbl == 'students']
+        if students:
+            self._student_cache.invalidate(*students)
+        users = {row_id for _, tbl, _, row_id in rows if tbl == 'users'}
+        if users:
+            self._user_cache.invalidate_where(lambda key, row: row['id'] in users)
+        return rows
+
+    def subscribe(self, callback, tables=None, since=None):
+        # callback(changes) for every commit, by this or any other client: changes as in
+        # changes_since, limited to tables, or None after a gap (reload). Delivery is in
+        # seq order on the thread that committed or called poll_changes; writes from
+        # other processes arrive on the next poll_changes. Tk code should poll
+        # changes_since on its own thread instead. Returns a function that unsubscribes.
+        entry = (callback, frozenset(tables) if tables else None)
+        with self._dispatch_lock:
+            if not self._subscribers:
+                self._dispatched_seq = self.last_change_seq() if since is None else since
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._dispatch_lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def poll_changes(self):
+        # delivers changes committed since the last delivery to subscribers; returns their number
+        delivered = 0
+        with self._dispatch_lock:
+            while self._subscribers:
+                changes = self.changes_since(self._dispatched_seq)
+                if changes is None:
+                    self._dispatched_seq = self.last_change_seq()
+                elif not changes:
+                    break
+                else:
+                    self._dispatched_seq = changes[-1][0]
+                    delivered += len(changes)
+                for callback, tables in list(self._subscribers):
+                    batch = changes if changes is None or tables is None else [c for c in changes if c[1] in tables]
+                    if batch is None or batch:
+                        try:
+                            callback(batch)
+                        except Exception:
+                            log.exception('Change subscriber failed')
+                if changes is None or len(changes) < CHANGES_BATCH:
+                    break
+        return delivered
+
+    def prune_changes(self, keep=CHANGE_LOG_KEEP):
+        # drops all but the newest keep rows of the feed, once it has grown past twice
+        # that, so opening the database does not write every time
+        keep = max(keep, 1)
+        cur = self._read()
+        cur.execute('SELECT MIN(seq), MAX(seq) FROM changes')
+        low, high = cur.fetchone()
+        if low is None or high - low + 1 <= 2 * keep:
+            return 0
+        with self._write() as cur:
+            cur.execute('DELETE FROM changes WHERE seq <= ?', (high - keep,))
+            removed = cur.rowcount
+        log.info('Change feed pruned: %d rows', removed)
+        return removed
+
     # Settings
     def set_setting(self, k, v):
-        cur = self.conn.cursor()
-        cur.execute('INSERT OR REPLACE INTO settings (k,v) VALUES (?,?)', (k,v))
-        self.conn.commit()
+        with self._write() as cur:
+            cur.execute('INSERT OR REPLACE INTO settings (k,v) VALUES (?,?)', (k,v))
+        self._settings_cache.invalidate(k)
 
     def get_setting(self, k):
-        cur = self.conn.cursor()
+        # unset keys are cached too: they are looked up on every start
+        return self._settings_cache.get_or_load(k, lambda: self._load_setting(k))
+
+    def _load_setting(self, k):
+        cur = self._read()
         cur.execute('SELECT v FROM settings WHERE k=?', (k,))
         r = cur.fetchone()
         return r['v'] if r else None
 
+    def cache_stats(self):
+        # {'students'|'settings'|'users': {size, hits, misses, hit_rate, evictions, ...}}
+        return {'students': self._student_cache.stats(), 'settings': self._settings_cache.stats(),
+                'users': self._user_cache.stats()}
+
     def close(self):
-        self.conn.close()
+        try:
+            with self._write_lock:
+                self.conn.execute('PRAGMA optimize')
+        except Exception:
+            pass
+        with self._pool_lock:
+            self._closed = True
+            readers = list(self._all_readers)
+            self._all_readers.clear()
+            self._idle_readers = []
+        for conn in readers:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self._write_lock:
+            self.conn.close()
@@ -0,0 +1,110 @@
+import csv
+import itertools
+import logging
+import os
+import time
+from database import tr_fold
+
+log = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 2000
+
+# column names seen in enrollment exports (compared after tr_fold)
+COLUMN_ALIASES = {
+    'tc': 'tc', 'tckn': 'tc', 'tc kimlik': 'tc', 'tc kimlik no': 'tc', 'tc no': 'tc', 'kimlik no': 'tc',
+    'ad': 'name', 'adi': 'name', 'isim': 'name', 'name': 'name', 'ogrenci adi': 'name',
+    'soyad': 'surname', 'soyadi': 'surname', 'soyisim': 'surname', 'surname': 'surname', 'ogrenci soyadi': 'surname',
+    'sinif': 'class_name', 'sube': 'class_name', 'sinif/sube': 'class_name', 'class': 'class_name', 'class name': 'class_name',
+    'veli chat id': 'parent_chat_id', 'veli telegram': 'parent_chat_id', 'parent chat id': 'parent_chat_id',
+}
+
+
+def valid_tc(tc):
+    # T.C. kimlik numarası: 11 digits, no leading zero, two check digits
+    if len(tc) != 11 or not tc.isdigit() or tc[0] == '0':
+        return False
+    d = [int(c) for c in tc]
+    if ((d[0] + d[2] + d[4] + d[6] + d[8]) * 7 - (d[1] + d[3] + d[5] + d[7])) % 10 != d[9]:
+        return False
+    return sum(d[:10]) % 10 == d[10]
+
+
+def _map_header(header):
+    return [COLUMN_ALIASES.get(' '.join(tr_fold(h or '').replace('_', ' ').replace('.', '').split())) for h in header]
+
+
+def iter_csv(path):
+    # yields (line_no, row dict); Excel's Turkish CSV export uses ';'
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ';' if sample.count(';') > sample.count(',') else ','
+        reader = csv.reader(f, delimiter=delimiter)
+        header = _map_header(next(reader, []))
+        for line_no, values in enumerate(reader, start=2):
+            if any(v.strip() for v in values):
+                yield line_no, {k: v.strip() for k, v in zip(header, values) if k}
+
+
+def iter_xlsx(path):
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError('Excel içe aktarma için openpyxl gerekli (pip install openpyxl)')
+    # read_only streams rows instead of loading the whole sheet
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = _map_header([str(h) if h is not None else '' for h in next(rows, [])])
+        for line_no, values in enumerate(rows, start=2):
+            cells = ['' if v is None else (str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)).strip() for v in values]
+            if any(cells):
+                yield line_no, {k: v for k, v in zip(header, cells) if k}
+    finally:
+        wb.close()
+
+
+def iter_rows(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.xlsx', '.xlsm'):
+        return iter_xlsx(path)
+    return iter_csv(path)
+
+
+def _validate(rows, errors):
+    for line_no, row in rows:
+        tc = row.get('tc', '')
+        if not row.get('name') or not row.get('surname'):
+            errors.append((line_no, tc, 'ad/soyad eksik'))
+        elif not valid_tc(tc):
+            errors.append((line_no, tc, 'geçersiz TC kimlik numarası'))
+        else:
+            yield row
+
+
+def import_students(db, path, chunk_size=IMPORT_CHUNK_SIZE):
+    # streaming import: the file is read chunk by chunk and each chunk is upserted by TC
+    # in one transaction. Returns a report with throughput and per-row errors.
+    t0 = time.perf_counter()
+    errors = []
+    report = {'rows': 0, 'inserted': 0, 'updated': 0, 'errors': errors}
+    counted = _count(iter_rows(path), report)
+    valid = _validate(counted, errors)
+    while True:
+        chunk = list(itertools.islice(valid, chunk_size))
+        if not chunk:
+            break
+        inserted, updated = db.upsert_students(chunk)
+        report['inserted'] += inserted
+        report['updated'] += updated
+    report['elapsed'] = time.perf_counter() - t0
+    report['rows_per_sec'] = report['rows'] / report['elapsed'] if report['elapsed'] else 0.0
+    log.info('Student import %s: %d rows, %d new, %d updated, %d errors, %.0f rows/s', path, report['rows'],
+             report['inserted'], report['updated'], len(errors), report['rows_per_sec'])
+    return report
+
+
+def _count(rows, report):
+    for item in rows:
+        report['rows'] += 1
+        yield item
@@ -0,0 +1,178 @@
+import bisect
+import functools
+import inspect
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+SLOW_QUERY_MS = 100.0
+# histogram bucket upper bounds in ms: 10 µs .. ~2 min, 4 buckets per doubling (≤19% error)
+BUCKET_BOUNDS_MS = tuple(0.01 * 2 ** (i / 4) for i in range(96))
+SQL_KEY_LENGTH = 160
+
+slow_log = logging.getLogger('smartdershane.slow_query')
+
+
+class LatencyHistogram:
+    # fixed log-scale buckets: constant memory and O(1) record, percentiles within one bucket
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        i = bisect.bisect_left(BUCKET_BOUNDS_MS, ms)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.total_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def percentile(self, q):
+        # upper bound of the bucket holding the q-th percentile (0 < q <= 100)
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q / 100.0 * self.count
+            seen = 0
+            for i, n in enumerate(self.buckets):
+                seen += n
+                if seen >= rank and n:
+                    bound = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max_ms
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def summary(self):
+        return {'count': self.count, 'total_ms': self.total_ms, 'mean_ms': self.total_ms / self.count if self.count else None,
+                'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95), 'p99_ms': self.percentile(99), 'max_ms': self.max_ms}
+
+
+def redact(parameters):
+    # parameters may hold passwords, TC numbers and message text: only their shape is logged
+    if not parameters:
+        return 'no params'
+    if isinstance(parameters, dict):
+        return f"params {', '.join(sorted(parameters))} redacted"
+    try:
+        return f'{len(parameters)} params redacted'
+    except TypeError:
+        return 'params redacted'
+
+
+def sql_key(sql):
+    return re.sub(r'\s+', ' ', sql).strip()[:SQL_KEY_LENGTH]
+
+
+class Instrumentation:
+    # per-method call counts and latency histograms, per-statement SQL timings and a
+    # slow-query log. Opt-in: Database(instrumentation=...) or SMARTDERSHANE_INSTRUMENT=1.
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self.methods = {}
+        self.statements = {}
+
+    def _histogram(self, table, key):
+        h = table.get(key)
+        if h is None:
+            with self._lock:
+                h = table.setdefault(key, LatencyHistogram())
+        return h
+
+    def record(self, name, seconds):
+        self._histogram(self.methods, name).record(seconds * 1000)
+
+    def record_sql(self, sql, parameters, seconds, many=False):
+        ms = seconds * 1000
+        key = sql_key(sql)
+        self._histogram(self.statements, key).record(ms)
+        if ms >= self.slow_ms:
+            slow_log.warning('Slow query %.1f ms%s: %s [%s]', ms, ' [executemany]' if many else '', key,
+                             'batch redacted' if many else redact(parameters))
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+            if inspect.isgenerator(result):
+                return self._timed_generator(name, result, elapsed)
+            self.record(name, elapsed)
+            return result
+        return timed
+
+    def _timed_generator(self, name, gen, elapsed):
+        # a generator's cost is in its iteration: time spent inside next(), not in the consumer
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    elapsed += time.perf_counter() - t0
+                    return
+                elapsed += time.perf_counter() - t0
+                yield item
+        finally:
+            self.record(name, elapsed)
+
+    def instrument(self, obj):
+        # replaces obj's public methods with timed wrappers (on the instance only)
+        for name, _ in inspect.getmembers(type(obj), inspect.isfunction):
+            if not name.startswith('_'):
+                setattr(obj, name, self.wrap(name, getattr(obj, name)))
+        return obj
+
+    def stats(self, kind='methods'):
+        # [(name, summary)] sorted by total time, most expensive first
+        table = self.methods if kind == 'methods' else self.statements
+        with self._lock:
+            items = list(table.items())
+        rows = [(name, h.summary()) for name, h in items]
+        rows.sort(key=lambda r: r[1]['total_ms'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
+            self.statements = {}
+
+
+class TimedCursor(sqlite3.Cursor):
+    # statement time covers execution up to the first row; fetching is part of the method time
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.instrumentation.record_sql(sql, parameters, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.instrumentation.record_sql(sql, None, time.perf_counter() - t0, many=True)
+
+
+class TimedConnection(sqlite3.Connection):
+    # sqlite3.connect(..., factory=TimedConnection); Connection.execute does not go
+    # through cursor(), so both are overridden
+    instrumentation = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,93 @@
+import atexit
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+
+LOG_FILE = 'smartdershane.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 10
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # one JSON object per line: ts, level, logger, thread, msg (+ exc)
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # the stock prepare() formats the message on the caller's thread; here the record is
+    # queued as is (%-args and all) and the listener thread does the formatting.
+    # Arguments must not be mutated after the call, which holds for this codebase.
+    def prepare(self, record):
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def setup_logging(path=LOG_FILE, level=logging.INFO, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                  compress=True, json_lines=True):
+    # root logger -> queue -> listener thread -> rotating file (smartdershane.log.1.gz, ...).
+    # Callers only pay for building the LogRecord; disabled levels cost one level check.
+    # Safe to call more than once: a running pipeline is replaced.
+    global _listener, _queue_handler
+    with _lock:
+        _shutdown_locked()
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        if compress:
+            handler.namer = lambda name: name + '.gz'
+            handler.rotator = _gzip_rotator
+        handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        q = queue.SimpleQueue()
+        _queue_handler = _DeferredQueueHandler(q)
+        _listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        _listener.start()
+    return _listener
+
+
+def _shutdown_locked():
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        # stop() drains the queue before returning
+        _listener.stop()
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
+
+
+def shutdown_logging():
+    with _lock:
+        _shutdown_locked()
+
+
+atexit.register(shutdown_logging)
@@ -1,14 +1,50 @@
+import time
+_STARTED = time.perf_counter()
 import os
+import sys
+import logging
 import threading
 import datetime
 import customtkinter as ctk
-from tkinter import messagebox
-from database import Database
+from tkinter import messagebox, filedialog
+from database import Database, ATTENDANCE_STATUSES, CHANGES_BATCH
 from telegram_bot import TelegramNotifier
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from reports import start_attendance_report
+from logsetup import setup_logging
+# matplotlib (charts, FigureCanvasTkAgg) is imported by ParentDashboard on first use
 
 APP_DB = 'f:/öğrenci_takip_desrhane/smartdershane.db'
+# client mode: SMARTDERSHANE_API=http://sunucu:8765 uses the API server (manage.py serve)
+# instead of opening APP_DB
+APP_API = os.environ.get('SMARTDERSHANE_API')
+APP_API_TOKEN = os.environ.get('SMARTDERSHANE_API_TOKEN')
+BACKUP_DIR = 'f:/öğrenci_takip_desrhane/backups'
+BACKUP_KEEP = 14
+ATTENDANCE_LOG_ROWS = 200
+SEARCH_RESULTS = 50
+SEARCH_DEBOUNCE_MS = 150
+LOGIN_POLL_MS = 50
+LOG_FILE = 'f:/öğrenci_takip_desrhane/smartdershane.log'
+PERF_ROWS = 25
+PERF_REFRESH_MS = 5000
+# dashboards pick up rows written by other clients from the change feed this often
+CHANGES_POLL_MS = 1000
+SLOT_SEARCH_DAYS = 14
+SLOT_PICKER_LIMIT = 30
+NOTIFY_MODE_LABELS = {'instant': 'Her yoklamada anlık', 'digest': 'Günlük özet (devamsızlık anlık)'}
+ATTENDANCE_COLORS = {'Gelen': 'green', 'Geç Kaldı': 'yellow', 'Gelmedi': 'red', 'İzinli': 'blue'}
+log = logging.getLogger(__name__)
+# SMARTDERSHANE_PROFILE_STARTUP=1 reports time to login window and to each dashboard
+PROFILE_STARTUP = bool(os.environ.get('SMARTDERSHANE_PROFILE_STARTUP'))
+
+
+def startup_mark(label, since=_STARTED):
+    # elapsed since `since` (default: start of main.py's imports); no-op unless profiling
+    if not PROFILE_STARTUP:
+        return
+    ms = (time.perf_counter() - since) * 1000
+    print(f'startup {label}: {ms:.0f} ms', file=sys.stderr)
+    log.info('startup %s: %.0f ms', label, ms)
 
 
 class App(ctk.CTk):
@@ -19,15 +55,26 @@ class App(ctk.CTk):
         self.title('SmartDershane')
         self.geometry('900x600')
 
-        self.db = Database(APP_DB)
+        if APP_API:
+            from api_client import RemoteDatabase
+            self.db = RemoteDatabase(APP_API, token=APP_API_TOKEN)
+        else:
+            self.db = Database(APP_DB)
         self.notifier = TelegramNotifier(self.db)
+        if not APP_API:
+            # delivers queued Telegram messages (and anything left pending from a previous
+            # run). In client mode the API server's process does this, once for all PCs.
+            self.notifier.start()
 
         self.current_user = None
 
         self.login_frame = LoginFrame(self, self.db, self.on_login)
         self.login_frame.pack(fill='both', expand=True)
+        # idle callbacks run once the window has been laid out and drawn
+        self.after_idle(startup_mark, 'login_window')
 
     def on_login(self, user):
+        t0 = time.perf_counter()
         self.current_user = user
         self.login_frame.pack_forget()
         role = user['role']
@@ -38,6 +85,7 @@ class App(ctk.CTk):
         else:
             self.dashboard = ParentDashboard(self, self.db)
         self.dashboard.pack(fill='both', expand=True)
+        self.after_idle(startup_mark, f'dashboard[{role}]', t0)
 
 
 class LoginFrame(ctk.CTkFrame):
@@ -61,21 +109,203 @@ class LoginFrame(ctk.CTkFrame):
         self.role_var = ctk.CTkComboBox(self, values=['admin','teacher','parent'])
         self.role_var.grid(row=3, column=1, sticky='w', padx=10)
 
-        ctk.CTkButton(self, text='Giriş', command=self.do_login).grid(row=4, column=0, columnspan=2, pady=20)
+        self.login_btn = ctk.CTkButton(self, text='Giriş', command=self.do_login)
+        self.login_btn.grid(row=4, column=0, columnspan=2, pady=(20,6))
+        self.progress = ctk.CTkProgressBar(self, mode='indeterminate')
+        self.status = ctk.CTkLabel(self, text='')
+        self.status.grid(row=6, column=0, columnspan=2)
+        self._auth = None
+        self.bind_all('<Return>', lambda e: self.do_login())
 
     def do_login(self):
-        user = self.db.authenticate(self.username.get(), self.password.get(), self.role_var.get())
-        if user:
-            self.login_callback(user)
+        if self._auth is not None:
+            return
+        # PBKDF2 runs on a worker; the Tk loop only polls the result
+        auth = self._auth = {'state': 'running', 'user': None, 'error': None}
+        username, password, role = self.username.get(), self.password.get(), self.role_var.get()
+
+        def work():
+            try:
+                auth['user'] = self.db.authenticate(username, password, role)
+            except Exception as e:
+                auth['error'] = e
+            auth['state'] = 'done'
+
+        self.login_btn.configure(state='disabled')
+        self.status.configure(text='Doğrulanıyor...')
+        self.progress.grid(row=5, column=0, columnspan=2, pady=4)
+        self.progress.start()
+        threading.Thread(target=work, name='login', daemon=True).start()
+        self.after(LOGIN_POLL_MS, self._poll_login)
+
+    def _poll_login(self):
+        auth = self._auth
+        if auth['state'] == 'running':
+            self.after(LOGIN_POLL_MS, self._poll_login)
+            return
+        self._auth = None
+        self.progress.stop()
+        self.progress.grid_remove()
+        self.login_btn.configure(state='normal')
+        self.status.configure(text='')
+        if auth['error'] is not None:
+            messagebox.showerror('Hata', str(auth['error']))
+        elif auth['user']:
+            self.unbind_all('<Return>')
+            self.login_callback(auth['user'])
         else:
             messagebox.showerror('Hata', 'Geçersiz kimlik bilgileri')
 
 
+class VirtualList(ctk.CTkFrame):
+    # fixed pool of row labels over a keyset-paged source; labels are recycled while
+    # scrolling, so memory and redraw cost do not grow with the number of rows.
+    # fetch_page(after_key, limit) -> rows, count() -> total rows (for the scrollbar)
+    def __init__(self, parent, fetch_page, format_row, count=None, row_color=None, key='id',
+                 visible_rows=12, page_size=100, max_rows=None, width=260, **kwargs):
+        super().__init__(parent, width=width, **kwargs)
+        self.fetch_page = fetch_page
+        self.format_row = format_row
+        self.count = count
+        self.row_color = row_color
+        self.key = key
+        self.visible_rows = visible_rows
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.rows = []
+        self.total = 0
+        self.exhausted = False
+        self.top = 0
+        self.selected = None
+
+        self.grid_columnconfigure(0, weight=1)
+        self.labels = []
+        for i in range(visible_rows):
+            lbl = ctk.CTkLabel(self, text='', anchor='w', width=width - 30, corner_radius=6)
+            lbl.grid(row=i, column=0, sticky='ew', padx=(6,2), pady=1)
+            lbl.bind('<Button-1>', lambda e, i=i: self._select(i))
+            self._bind_wheel(lbl)
+            self.labels.append(lbl)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, rowspan=visible_rows, sticky='ns')
+        self._bind_wheel(self)
+
+    def _bind_wheel(self, widget):
+        widget.bind('<MouseWheel>', lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        widget.bind('<Button-4>', lambda e: self.scroll(-3))
+        widget.bind('<Button-5>', lambda e: self.scroll(3))
+
+    def set_source(self, fetch_page, count=None):
+        self.fetch_page = fetch_page
+        self.count = count
+        self.refresh()
+
+    def refresh(self):
+        self.rows = []
+        self.exhausted = False
+        self.top = 0
+        self.selected = None
+        self.total = self.count() if self.count else 0
+        if self.max_rows is not None:
+            self.total = min(self.total, self.max_rows)
+        self._ensure_loaded(self.visible_rows)
+        self._render()
+
+    def _ensure_loaded(self, n):
+        # keyset paging: keep fetching after the last loaded key until n rows are available
+        while len(self.rows) < n and not self.exhausted:
+            after = self.rows[-1][self.key] if self.rows else None
+            page = self.fetch_page(after, self.page_size)
+            self.rows.extend(page)
+            if len(page) < self.page_size or (self.max_rows is not None and len(self.rows) >= self.max_rows):
+                self.exhausted = True
+        if self.max_rows is not None:
+            del self.rows[self.max_rows:]
+        self.total = len(self.rows) if self.exhausted else max(self.total, len(self.rows))
+
+    def prepend(self, rows):
+        # newest-first lists: new rows go on top, the view stays put when scrolled down
+        if not rows:
+            return
+        self.rows[:0] = rows
+        if self.top:
+            self.top += len(rows)
+        self.total += len(rows)
+        if self.max_rows is not None:
+            del self.rows[self.max_rows:]
+            self.total = min(self.total, self.max_rows)
+        self._render()
+
+    def load_new(self):
+        # oldest-first lists: fetch rows added after the last loaded one, if it was the end
+        if self.exhausted and (self.max_rows is None or len(self.rows) < self.max_rows):
+            self.exhausted = False
+            self._ensure_loaded(len(self.rows) + self.page_size)
+            self._render()
+
+    def patch(self, fn):
+        # fn(row) -> replacement row, or None to drop it; for rows changed elsewhere
+        rows = []
+        for row in self.rows:
+            new = fn(row)
+            if new is not None:
+                rows.append(new)
+        self.total -= len(self.rows) - len(rows)
+        self.rows = rows
+        if self.selected is not None:
+            self.selected = next((r for r in rows if r[self.key] == self.selected[self.key]), None)
+        self.top = max(0, min(self.top, len(rows) - self.visible_rows))
+        self._render()
+
+    def scroll(self, delta):
+        self._move_to(self.top + delta)
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self._move_to(int(float(args[1]) * max(self.total, 1)))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (self.visible_rows if args[2] == 'pages' else 1)
+            self.scroll(step)
+
+    def _move_to(self, top):
+        self._ensure_loaded(top + self.visible_rows)
+        self.top = max(0, min(top, len(self.rows) - self.visible_rows))
+        self._render()
+
+    def _render(self):
+        for i, lbl in enumerate(self.labels):
+            idx = self.top + i
+            if idx < len(self.rows):
+                row = self.rows[idx]
+                color = self.row_color(row) if self.row_color else 'transparent'
+                if self.selected is not None and row[self.key] == self.selected[self.key]:
+                    color = 'gray70'
+                lbl.configure(text=self.format_row(row), fg_color=color)
+            else:
+                lbl.configure(text='', fg_color='transparent')
+        total = max(self.total, len(self.rows), 1)
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + self.visible_rows) / total))
+
+    def _select(self, i):
+        idx = self.top + i
+        if idx < len(self.rows):
+            self.selected = self.rows[idx]
+            self._render()
+
+    def get_selected(self):
+        # selected row, or the first row when nothing was clicked yet
+        if self.selected is not None:
+            return self.selected
+        return self.rows[0] if self.rows else None
+
+
 class AdminDashboard(ctk.CTkFrame):
     def __init__(self, parent, db, notifier):
         super().__init__(parent)
         self.db = db
         self.notifier = notifier
+        # position in the change feed; taken before the lists load so nothing is missed
+        self._change_seq = self.db.last_change_seq()
 
         self.left = ctk.CTkFrame(self, width=300)
         self.left.pack(side='left', fill='y', padx=10, pady=10)
@@ -83,7 +313,14 @@ class AdminDashboard(ctk.CTkFrame):
         self.right.pack(side='right', fill='both', expand=True, padx=10, pady=10)
 
         ctk.CTkLabel(self.left, text='Öğrenciler', font=ctk.CTkFont(size=18)).pack(pady=5)
-        self.student_list = ctk.CTkScrollableFrame(self.left, width=260, height=300)
+        # search-as-you-type (name, surname or TC)
+        self.search_entry = ctk.CTkEntry(self.left, placeholder_text='Öğrenci ara (ad, soyad, TC)')
+        self.search_entry.pack(fill='x', padx=6, pady=(0,4))
+        self.search_entry.bind('<KeyRelease>', self.on_search_key)
+        self._search_job = None
+        self.student_list = VirtualList(self.left, fetch_page=lambda after, n: self.db.list_students(after_id=after, limit=n),
+                                        format_row=lambda s: f"{s['id']}: {s['name']} {s['surname']}",
+                                        count=self.db.count_students, visible_rows=12)
         self.student_list.pack()
         self.refresh_students()
 
@@ -94,17 +331,19 @@ class AdminDashboard(ctk.CTkFrame):
         self.form_surname = ctk.CTkEntry(self.right, placeholder_text='Soyisim')
         self.form_tc = ctk.CTkEntry(self.right, placeholder_text='TC Kimlik')
         self.form_parent_chat = ctk.CTkEntry(self.right, placeholder_text='Veli Telegram Chat ID')
-        for w in (self.form_name, self.form_surname, self.form_tc, self.form_parent_chat):
+        self.form_class = ctk.CTkEntry(self.right, placeholder_text='Sınıf (örn. 9-A)')
+        for w in (self.form_name, self.form_surname, self.form_tc, self.form_parent_chat, self.form_class):
             w.pack(pady=6, fill='x')
 
         ctk.CTkButton(self.right, text='Öğrenci Ekle', command=self.add_student).pack(pady=6)
 
         # Attendance status selector
         ctk.CTkLabel(self.right, text='Yoklama Durumu:').pack(pady=(10,0))
-        self.status_cb = ctk.CTkComboBox(self.right, values=['Gelen','Geç Kaldı','Gelmedi','İzinli'])
+        self.status_cb = ctk.CTkComboBox(self.right, values=list(ATTENDANCE_STATUSES))
         self.status_cb.set('Gelen')
         self.status_cb.pack(pady=6, fill='x')
         ctk.CTkButton(self.right, text='Seçiliye Yoklama Al', command=self.manual_attendance).pack(pady=6)
+        ctk.CTkButton(self.right, text='Sınıf Yoklaması', command=self.open_roll_call).pack(pady=6)
 
         # Appointment section
         ctk.CTkLabel(self.right, text='Randevu Oluştur (15dk, max 3/hafta)').pack(pady=(10,0))
@@ -114,6 +353,7 @@ class AdminDashboard(ctk.CTkFrame):
         for w in (self.app_student_id, self.app_teacher_id, self.app_datetime):
             w.pack(pady=4, fill='x')
         ctk.CTkButton(self.right, text='Randevu Kaydet', command=self.create_appointment).pack(pady=6)
+        ctk.CTkButton(self.right, text='Boş Saatleri Bul', command=self.open_slot_picker).pack(pady=(0,6))
         ctk.CTkLabel(self.right, text='Randevu İptal (ID)').pack(pady=(6,0))
         self.cancel_appt_id = ctk.CTkEntry(self.right, placeholder_text='Randevu ID')
         self.cancel_appt_id.pack(pady=4, fill='x')
@@ -140,12 +380,52 @@ class AdminDashboard(ctk.CTkFrame):
         except Exception:
             pass
         ctk.CTkButton(self.right, text='Token Kaydet', command=self.save_token).pack(pady=6)
+        # instant: one message per attendance mark; digest: one message per parent a day
+        # (absences are still sent at once)
+        ctk.CTkLabel(self.right, text='Veli Bildirimi').pack(pady=(6,0))
+        self.notify_mode_cb = ctk.CTkComboBox(self.right, values=list(NOTIFY_MODE_LABELS.values()))
+        self.notify_mode_cb.set(NOTIFY_MODE_LABELS.get(self.notifier.mode, NOTIFY_MODE_LABELS['instant']))
+        self.notify_mode_cb.pack(pady=4, fill='x')
+        self.digest_time_entry = ctk.CTkEntry(self.right, placeholder_text='Özet saati (SS:DD)')
+        self.digest_time_entry.insert(0, self.notifier.digest_time)
+        self.digest_time_entry.pack(pady=4, fill='x')
+        ctk.CTkButton(self.right, text='Bildirim Ayarını Kaydet', command=self.save_notify_mode).pack(pady=6)
+
+        # online backup (runs in the background, the app stays usable)
+        ctk.CTkLabel(self.right, text='Veritabanı Yedeği').pack(pady=(10,0))
+        self.backup_progress = ctk.CTkProgressBar(self.right)
+        self.backup_progress.set(0)
+        self.backup_progress.pack(pady=4, fill='x')
+        self.backup_btn = ctk.CTkButton(self.right, text='Yedek Al', command=self.start_backup)
+        self.backup_btn.pack(pady=4)
+
+        # monthly attendance report, grouped in SQL and streamed to CSV/XLSX in the background
+        ctk.CTkLabel(self.right, text='Aylık Yoklama Raporu').pack(pady=(10,0))
+        self.report_year = ctk.CTkEntry(self.right, placeholder_text='Yıl (YYYY)')
+        self.report_year.insert(0, str(datetime.date.today().year))
+        self.report_month = ctk.CTkEntry(self.right, placeholder_text='Ay (1-12, boş: tüm yıl)')
+        self.report_by = ctk.CTkOptionMenu(self.right, values=['Öğrenci', 'Sınıf'])
+        for w in (self.report_year, self.report_month, self.report_by):
+            w.pack(pady=3, fill='x')
+        self.report_btn = ctk.CTkButton(self.right, text='Rapor Oluştur', command=self.start_report)
+        self.report_btn.pack(pady=4)
+
+        # latency per Database operation; only when instrumentation is on (SMARTDERSHANE_INSTRUMENT=1)
+        if self.db.instrumentation:
+            ctk.CTkLabel(self.right, text='Performans (ms)').pack(pady=(10,0))
+            self.perf_box = ctk.CTkTextbox(self.right, height=180, font=ctk.CTkFont(family='Courier', size=11))
+            self.perf_box.pack(pady=4, fill='x')
+            ctk.CTkButton(self.right, text='Yenile', command=self.refresh_perf).pack(pady=4)
+            self.refresh_perf()
 
         # attendance log area
         self.att_frame = ctk.CTkFrame(self.right)
         self.att_frame.pack(fill='both', expand=True, pady=8)
         ctk.CTkLabel(self.att_frame, text='Son Yoklamalar').pack()
-        self.att_list = ctk.CTkScrollableFrame(self.att_frame, height=200)
+        self.att_list = VirtualList(self.att_frame, fetch_page=lambda before, n: self.db.list_attendance(before_id=before, limit=n),
+                                    format_row=lambda r: f"{r['ts'][:19]} - {r['name']} {r['surname']} - {r['status']}",
+                                    row_color=lambda r: ATTENDANCE_COLORS.get(r['status'], 'blue'),
+                                    count=self.db.count_attendance, visible_rows=8, page_size=20, max_rows=ATTENDANCE_LOG_ROWS, width=520)
         self.att_list.pack(fill='both', expand=True)
         self.refresh_attendance()
 
@@ -160,7 +440,9 @@ class AdminDashboard(ctk.CTkFrame):
             w.pack(fill='x', pady=3)
         ctk.CTkButton(self.user_frame, text='Kullanıcı Ekle', command=self.create_user).pack(pady=4, fill='x')
 
-        self.users_listbox = ctk.CTkScrollableFrame(self.left, width=260, height=140)
+        self.users_listbox = VirtualList(self.left, fetch_page=lambda after, n: self.db.list_users(after_id=after, limit=n),
+                                         format_row=lambda u: f"{u['id']}: {u['username']} ({u['role']})",
+                                         count=self.db.count_users, visible_rows=5)
         self.users_listbox.pack(pady=6)
         self.refresh_users()
         ctk.CTkButton(self.left, text='Seçili Sil', command=self.delete_selected_user).pack(pady=4)
@@ -188,37 +470,48 @@ class AdminDashboard(ctk.CTkFrame):
         for w in (self.exam_student_id, self.exam_name, self.exam_score):
             w.pack(fill='x', pady=2)
         ctk.CTkButton(self.right, text='Sınav Kaydet', command=self.add_exam_action).pack(pady=4)
+        self.after(CHANGES_POLL_MS, self._poll_changes)
 
     def refresh_students(self):
-        for child in self.student_list.winfo_children():
-            child.destroy()
-        students = self.db.list_students()
-        for s in students:
-            lbl = ctk.CTkLabel(self.student_list, text=f"{s['id']}: {s['name']} {s['surname']}")
-            lbl.pack(anchor='w', padx=6, pady=2)
+        self.on_search()
+
+    def on_search_key(self, event=None):
+        # debounce: search once typing pauses
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DEBOUNCE_MS, self.on_search)
+
+    def on_search(self):
+        self._search_job = None
+        q = self.search_entry.get().strip()
+        if not q:
+            self.student_list.set_source(lambda after, n: self.db.list_students(after_id=after, limit=n), self.db.count_students)
+            return
+        # top matches come as a single page
+        self.student_list.set_source(lambda after, n: [] if after is not None else self.db.search_students(q, limit=SEARCH_RESULTS))
 
     def add_student(self):
         name = self.form_name.get()
         surname = self.form_surname.get()
         tc = self.form_tc.get()
         chat = self.form_parent_chat.get()
+        class_name = self.form_class.get().strip() or None
         if not name or not surname:
             messagebox.showwarning('Eksik', 'İsim veya soyisim eksik')
             return
-        self.db.add_student(name, surname, tc, chat)
-        self.refresh_students()
+        try:
+            self.db.add_student(name, surname, tc, chat, class_name=class_name)
+        except Exception as e:
+            messagebox.showerror('Hata', f'Öğrenci eklenemedi (TC kayıtlı olabilir): {e}')
+            return
+        self.apply_changes()
 
     # User management actions
     def refresh_users(self):
-        for child in self.users_listbox.winfo_children():
-            child.destroy()
         try:
-            users = self.db.list_users()
+            self.users_listbox.refresh()
         except Exception:
-            users = []
-        for u in users:
-            lbl = ctk.CTkLabel(self.users_listbox, text=f"{u['id']}: {u['username']} ({u['role']})")
-            lbl.pack(anchor='w', padx=6, pady=2)
+            pass
 
     def create_user(self):
         uname = self.new_username.get().strip()
@@ -232,24 +525,23 @@ class AdminDashboard(ctk.CTkFrame):
             messagebox.showinfo('Tamam','Kullanıcı oluşturuldu')
             self.new_username.delete(0,'end')
             self.new_password.delete(0,'end')
-            self.refresh_users()
+            self.apply_changes()
         except Exception as e:
             messagebox.showerror('Hata', str(e))
 
     def delete_selected_user(self):
-        kids = self.users_listbox.winfo_children()
-        if not kids:
+        user = self.users_listbox.get_selected()
+        if not user:
             messagebox.showinfo('Bilgi','Kullanıcı yok')
             return
-        first = kids[0].cget('text').split(':')[0]
-        uid = int(first)
+        uid = user['id']
         confirm = messagebox.askyesno('Onay','Seçili kullanıcıyı silmek istiyor musunuz?')
         if not confirm:
             return
         try:
             self.db.delete_user(uid)
             messagebox.showinfo('Tamam','Kullanıcı silindi')
-            self.refresh_users()
+            self.apply_changes()
         except Exception as e:
             messagebox.showerror('Hata', str(e))
 
@@ -268,90 +560,144 @@ class AdminDashboard(ctk.CTkFrame):
             messagebox.showerror('Hata', str(e))
 
     def manual_attendance(self):
-        # take first listed student as example
-        kids = self.student_list.winfo_children()
-        if not kids:
+        # selected student (first listed one if nothing is selected)
+        student = self.student_list.get_selected()
+        if not student:
             messagebox.showinfo('Bilgi','Öğrenci yok')
             return
-        first = kids[0].cget('text').split(':')[0]
-        sid = int(first)
+        sid = student['id']
         status = self.status_cb.get()
         self.db.add_attendance(sid, status)
-        threading.Thread(target=self.notifier.notify_parent_attendance, args=(sid,status), daemon=True).start()
+        self.notifier.notify_parent_attendance(sid, status)
         messagebox.showinfo('Yoklama','Yoklama kaydedildi ve veli bilgilendirildi (varsa)')
-        self.refresh_attendance()
+        self.apply_changes()
+
+    def open_roll_call(self):
+        RollCallWindow(self, self.db, self.notifier, on_saved=self.apply_changes)
 
     def refresh_attendance(self):
-        for child in self.att_list.winfo_children():
-            child.destroy()
-        # fetch last 20
-        cur = self.db.conn.cursor()
-        cur.execute('SELECT a.*, s.name, s.surname FROM attendance a LEFT JOIN students s ON a.student_id=s.id ORDER BY a.ts DESC LIMIT 20')
-        for r in cur.fetchall():
-            status = r['status']
-            text = f"{r['ts'][:19]} - {r['name']} {r['surname']} - {status}"
-            color = 'green' if status=='Gelen' else ('yellow' if status=='Geç Kaldı' else ('red' if status=='Gelmedi' else 'blue'))
-            lbl = ctk.CTkLabel(self.att_list, text=text, fg_color=color, corner_radius=6)
-            lbl.pack(fill='x', padx=6, pady=3)
+        self.att_list.refresh()
+
+    def apply_changes(self):
+        # brings the lists up to date with writes from this or any other client: only
+        # new and changed rows are fetched, nothing is re-queried from the top
+        while True:
+            changes = self.db.changes_since(self._change_seq)
+            if changes is None:
+                # fell behind the pruned feed: start over
+                self._change_seq = self.db.last_change_seq()
+                self.refresh_students()
+                self.refresh_users()
+                self.refresh_attendance()
+                return
+            if not changes:
+                return
+            self._change_seq = changes[-1][0]
+            ops = {}
+            for _, table, op, row_id in changes:
+                ops.setdefault(table, {}).setdefault(row_id, set()).add(op)
+            self._apply_student_changes(ops.get('students', {}))
+            attendance = ops.get('attendance', {})
+            if any(o != {'insert'} for o in attendance.values()):
+                self.refresh_attendance()
+            elif attendance:
+                newest = self.att_list.rows[0]['id'] if self.att_list.rows else 0
+                self.att_list.prepend(self.db.list_attendance(after_id=newest, limit=ATTENDANCE_LOG_ROWS))
+            if 'users' in ops:
+                self.refresh_users()
+            if len(changes) < CHANGES_BATCH:
+                return
+
+    def _apply_student_changes(self, ops):
+        if not ops:
+            return
+        fresh = {sid: self.db.get_student(sid) for sid, o in ops.items() if o != {'insert'} and 'delete' not in o}
+        gone = {sid for sid, o in ops.items() if 'delete' in o}
+        self.student_list.patch(lambda r: None if r['id'] in gone else fresh.get(r['id']) or r)
+        if fresh:
+            self.att_list.patch(lambda r: dict(r, name=fresh[r['student_id']]['name'], surname=fresh[r['student_id']]['surname'])
+                                if fresh.get(r['student_id']) else r)
+        if not self.search_entry.get().strip() and any('insert' in o for o in ops.values()):
+            self.student_list.load_new()
+
+    def _poll_changes(self):
+        if not self.winfo_exists():
+            return
+        try:
+            self.apply_changes()
+        except Exception:
+            log.exception('Applying changes failed')
+        self.after(CHANGES_POLL_MS, self._poll_changes)
 
     def create_appointment(self):
-            def cancel_appointment(self):
-                try:
-                    aid = int(self.cancel_appt_id.get())
-                    self.db.delete_appointment(aid)
-                    messagebox.showinfo('Tamam','Randevu iptal edildi')
-                    self.refresh_attendance()
-                except Exception as ex:
-                    messagebox.showerror('Hata', str(ex))
-            def update_student_action(self):
-                try:
-                    sid = int(self.edit_student_id.get())
-                    name = self.edit_student_name.get().strip() or None
-                    surname = self.edit_student_surname.get().strip() or None
-                    if not any([name, surname]):
-                        messagebox.showwarning('Hata','En az bir alanı doldurun')
-                        return
-                    self.db.edit_student(sid, name=name, surname=surname)
-                    messagebox.showinfo('Tamam','Öğrenci güncellendi')
-                    self.refresh_students()
-                except Exception as e:
-                    messagebox.showerror('Hata', str(e))
-
-            def delete_student_action(self):
-                try:
-                    sid = int(self.edit_student_id.get())
-                    confirm = messagebox.askyesno('Onay','Öğrenciyi silmek istiyor musunuz?')
-                    if not confirm:
-                        return
-                    self.db.delete_student(sid)
-                    messagebox.showinfo('Tamam','Öğrenci silindi')
-                    self.refresh_students()
-                except Exception as e:
-                    messagebox.showerror('Hata', str(e))
-
-            def add_exam_action(self):
-                try:
-                    sid = int(self.exam_student_id.get())
-                    name = self.exam_name.get().strip()
-                    score = int(self.exam_score.get())
-                    if not name or score < 0 or score > 100:
-                        messagebox.showwarning('Hata','Geçerli sınav ve puan girin')
-                        return
-                    self.db.add_exam(sid, name, score)
-                    messagebox.showinfo('Tamam','Sınav kaydedildi')
-                except Exception as e:
-                    messagebox.showerror('Hata', str(e))
         try:
             sid = int(self.app_student_id.get())
             tid = int(self.app_teacher_id.get())
             dt = self.app_datetime.get()
             # expect ISO like '2026-02-15T14:30'
-            ok, err = self.db.add_appointment(sid, tid, dt, duration_min=15)
+            ok, err, _ = self.db.add_appointment(sid, tid, dt, duration_min=15)
             if not ok:
                 messagebox.showerror('Randevu Hatası', err)
             else:
                 messagebox.showinfo('Tamam', 'Randevu kaydedildi')
-                self.refresh_attendance()
+                self.apply_changes()
+        except Exception as e:
+            messagebox.showerror('Hata', str(e))
+
+    def open_slot_picker(self):
+        try:
+            sid = int(self.app_student_id.get())
+        except ValueError:
+            messagebox.showerror('Hata', 'Önce öğrenci ID giriniz')
+            return
+        tid = self.app_teacher_id.get().strip()
+        SlotPickerWindow(self, self.db, sid, int(tid) if tid.isdigit() else None, on_booked=self.apply_changes)
+
+    def cancel_appointment(self):
+        try:
+            aid = int(self.cancel_appt_id.get())
+            self.db.delete_appointment(aid)
+            messagebox.showinfo('Tamam','Randevu iptal edildi')
+            self.apply_changes()
+        except Exception as ex:
+            messagebox.showerror('Hata', str(ex))
+
+    def update_student_action(self):
+        try:
+            sid = int(self.edit_student_id.get())
+            name = self.edit_student_name.get().strip() or None
+            surname = self.edit_student_surname.get().strip() or None
+            if not any([name, surname]):
+                messagebox.showwarning('Hata','En az bir alanı doldurun')
+                return
+            self.db.edit_student(sid, name=name, surname=surname)
+            messagebox.showinfo('Tamam','Öğrenci güncellendi')
+            self.apply_changes()
+        except Exception as e:
+            messagebox.showerror('Hata', str(e))
+
+    def delete_student_action(self):
+        try:
+            sid = int(self.edit_student_id.get())
+            confirm = messagebox.askyesno('Onay','Öğrenciyi silmek istiyor musunuz?')
+            if not confirm:
+                return
+            self.db.delete_student(sid)
+            messagebox.showinfo('Tamam','Öğrenci silindi')
+            self.apply_changes()
+        except Exception as e:
+            messagebox.showerror('Hata', str(e))
+
+    def add_exam_action(self):
+        try:
+            sid = int(self.exam_student_id.get())
+            name = self.exam_name.get().strip()
+            score = int(self.exam_score.get())
+            if not name or score < 0 or score > 100:
+                messagebox.showwarning('Hata','Geçerli sınav ve puan girin')
+                return
+            self.db.add_exam(sid, name, score)
+            messagebox.showinfo('Tamam','Sınav kaydedildi')
         except Exception as e:
             messagebox.showerror('Hata', str(e))
 
@@ -360,16 +706,20 @@ class AdminDashboard(ctk.CTkFrame):
             tid = int(self.av_teacher_id.get())
             s = self.av_start.get()
             e = self.av_end.get()
-            # validate
-            datetime.datetime.fromisoformat(s)
-            datetime.datetime.fromisoformat(e)
-            cur = self.db.conn.cursor()
-            cur.execute('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUES (?,?,?)', (tid,s,e))
-            self.db.conn.commit()
+            self.db.add_availability(tid, s, e)
             messagebox.showinfo('Tamam','Müsaitlik kaydedildi')
         except Exception as ex:
             messagebox.showerror('Hata', str(ex))
 
+    def save_notify_mode(self):
+        mode = next(k for k, v in NOTIFY_MODE_LABELS.items() if v == self.notify_mode_cb.get())
+        try:
+            self.notifier.set_mode(mode, self.digest_time_entry.get())
+        except ValueError:
+            messagebox.showwarning('Hata', 'Özet saati SS:DD biçiminde olmalı (örn. 18:00)')
+            return
+        messagebox.showinfo('Tamam', 'Bildirim ayarı kaydedildi')
+
     def save_token(self):
         token = self.token_entry.get().strip()
         if not token:
@@ -385,6 +735,218 @@ class AdminDashboard(ctk.CTkFrame):
         except Exception as ex:
             messagebox.showerror('Hata', str(ex))
 
+    def start_backup(self):
+        self.backup_btn.configure(state='disabled')
+        self.backup_progress.set(0)
+        # written by the backup thread, read by the Tk loop in _poll_backup
+        state = self._backup_state = {'done': 0, 'total': 1, 'result': None}
+
+        def progress(done, total):
+            state['done'] = done
+            state['total'] = total or 1
+
+        def finished(dest, err):
+            state['result'] = (dest, err)
+
+        self.db.start_backup(callback=finished, dest_dir=BACKUP_DIR, compress=True, keep=BACKUP_KEEP, progress=progress)
+        self.after(100, self._poll_backup)
+
+    def _poll_backup(self):
+        state = self._backup_state
+        self.backup_progress.set(state['done'] / state['total'])
+        if state['result'] is None:
+            self.after(100, self._poll_backup)
+            return
+        self.backup_btn.configure(state='normal')
+        dest, err = state['result']
+        if err:
+            messagebox.showerror('Hata', f'Yedek alınamadı: {err}')
+        else:
+            messagebox.showinfo('Tamam', f'Yedek alındı: {dest}')
+
+
+    def refresh_perf(self):
+        rows = self.db.instrumentation.stats()
+        lines = [f"{'İşlem':<24}{'Adet':>7}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, st in rows[:PERF_ROWS]:
+            lines.append(f"{name[:23]:<24}{st['count']:>7}{st['p50_ms']:>9.2f}{st['p95_ms']:>9.2f}{st['p99_ms']:>9.2f}")
+        lines.append('')
+        lines.append(f"{'Önbellek':<24}{'Boyut':>7}{'İsabet':>9}{'Iska':>9}{'Oran':>9}")
+        for name, st in self.db.cache_stats().items():
+            rate = f"{st['hit_rate']:.0%}" if st['hit_rate'] is not None else '-'
+            lines.append(f"{name:<24}{st['size']:>7}{st['hits']:>9}{st['misses']:>9}{rate:>9}")
+        self.perf_box.configure(state='normal')
+        self.perf_box.delete('1.0', 'end')
+        self.perf_box.insert('1.0', '\n'.join(lines))
+        self.perf_box.configure(state='disabled')
+        if not getattr(self, '_perf_scheduled', False):
+            self._perf_scheduled = True
+            self.after(PERF_REFRESH_MS, self._auto_refresh_perf)
+
+    def _auto_refresh_perf(self):
+        self._perf_scheduled = False
+        if self.winfo_exists():
+            self.refresh_perf()
+
+    def start_report(self):
+        try:
+            year = int(self.report_year.get())
+            month = int(self.report_month.get()) if self.report_month.get().strip() else None
+            if month is not None and not 1 <= month <= 12:
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning('Hata', 'Geçerli yıl ve ay girin')
+            return
+        path = filedialog.asksaveasfilename(defaultextension='.csv', initialfile=f'yoklama_{year}.csv',
+                                            filetypes=[('CSV', '*.csv'), ('Excel', '*.xlsx')])
+        if not path:
+            return
+        by = 'class' if self.report_by.get() == 'Sınıf' else 'student'
+        self.report_btn.configure(state='disabled', text='Rapor hazırlanıyor...')
+        # written by the report thread, read by the Tk loop in _poll_report
+        state = self._report_state = {'rows': 0, 'result': None, 'path': path}
+
+        def progress(rows):
+            state['rows'] = rows
+
+        def finished(rows, err):
+            state['result'] = (rows, err)
+
+        start_attendance_report(self.db, path, callback=finished, year=year, month=month, by=by, progress=progress)
+        self.after(100, self._poll_report)
+
+    def _poll_report(self):
+        state = self._report_state
+        if state['result'] is None:
+            self.report_btn.configure(text=f"Rapor hazırlanıyor... ({state['rows']} satır)")
+            self.after(100, self._poll_report)
+            return
+        self.report_btn.configure(state='normal', text='Rapor Oluştur')
+        rows, err = state['result']
+        if err:
+            messagebox.showerror('Hata', f'Rapor oluşturulamadı: {err}')
+        else:
+            messagebox.showinfo('Tamam', f"{rows} satırlık rapor kaydedildi: {state['path']}")
+
+
+class RollCallWindow(ctk.CTkToplevel):
+    # whole-class roll call: one status per student, submitted in a single transaction
+    def __init__(self, parent, db, notifier, on_saved=None):
+        super().__init__(parent)
+        self.db = db
+        self.notifier = notifier
+        self.on_saved = on_saved
+        self.status_vars = {}
+        self.title('Sınıf Yoklaması')
+        self.geometry('560x600')
+
+        classes = self.db.list_classes()
+        ctk.CTkLabel(self, text='Sınıf:').pack(pady=(10,0))
+        self.class_cb = ctk.CTkComboBox(self, values=classes, command=self.load_class)
+        self.class_cb.pack(pady=6, fill='x', padx=10)
+        self.rows_frame = ctk.CTkScrollableFrame(self, height=440)
+        self.rows_frame.pack(fill='both', expand=True, padx=10)
+        ctk.CTkButton(self, text='Yoklamayı Kaydet', command=self.submit).pack(pady=8)
+        if classes:
+            self.class_cb.set(classes[0])
+            self.load_class(classes[0])
+        else:
+            self.class_cb.set('')
+
+    def load_class(self, class_name):
+        for child in self.rows_frame.winfo_children():
+            child.destroy()
+        self.status_vars = {}
+        for s in self.db.list_students(class_name=class_name):
+            row = ctk.CTkFrame(self.rows_frame)
+            row.pack(fill='x', pady=2)
+            ctk.CTkLabel(row, text=f"{s['id']}: {s['name']} {s['surname']}").pack(side='left', padx=6)
+            var = ctk.StringVar(value='Gelen')
+            ctk.CTkSegmentedButton(row, values=list(ATTENDANCE_STATUSES), variable=var).pack(side='right', padx=6)
+            self.status_vars[s['id']] = var
+
+    def submit(self):
+        if not self.status_vars:
+            messagebox.showinfo('Bilgi', 'Bu sınıfta öğrenci yok', parent=self)
+            return
+        records = [(sid, var.get()) for sid, var in self.status_vars.items()]
+        try:
+            ids = self.db.add_attendance_bulk(records)
+        except Exception as e:
+            messagebox.showerror('Hata', str(e), parent=self)
+            return
+        # parents' messages go to the outbox in one transaction
+        self.notifier.notify_class_attendance(records)
+        messagebox.showinfo('Yoklama', f'{len(ids)} öğrenci için yoklama kaydedildi', parent=self)
+        if self.on_saved:
+            self.on_saved()
+        self.destroy()
+
+
+class SlotPickerWindow(ctk.CTkToplevel):
+    # lists the next free 15-minute slots (one teacher, or all of them) within the
+    # student's weekly quota; picking one books it
+    def __init__(self, parent, db, student_id, teacher_id=None, on_booked=None):
+        super().__init__(parent)
+        self.db = db
+        self.student_id = student_id
+        self.on_booked = on_booked
+        self.title(f'Boş Randevu Saatleri - Öğrenci {student_id}')
+        self.geometry('480x600')
+        self.teachers = {u['id']: u['username'] for u in db.list_users() if u['role'] == 'teacher'}
+
+        form = ctk.CTkFrame(self)
+        form.pack(fill='x', padx=10, pady=8)
+        self.teacher_entry = ctk.CTkEntry(form, placeholder_text='Öğretmen ID (boş: hepsi)', width=150)
+        self.start_entry = ctk.CTkEntry(form, placeholder_text='YYYY-MM-DD', width=110)
+        self.days_entry = ctk.CTkEntry(form, placeholder_text='Gün', width=50)
+        if teacher_id is not None:
+            self.teacher_entry.insert(0, str(teacher_id))
+        self.start_entry.insert(0, datetime.date.today().isoformat())
+        self.days_entry.insert(0, str(SLOT_SEARCH_DAYS))
+        for w in (self.teacher_entry, self.start_entry, self.days_entry):
+            w.pack(side='left', padx=3)
+        ctk.CTkButton(form, text='Ara', width=60, command=self.search).pack(side='left', padx=3)
+        self.rows_frame = ctk.CTkScrollableFrame(self, height=500)
+        self.rows_frame.pack(fill='both', expand=True, padx=10, pady=(0,10))
+        self.search()
+
+    def search(self):
+        for child in self.rows_frame.winfo_children():
+            child.destroy()
+        try:
+            tid = self.teacher_entry.get().strip()
+            start = datetime.datetime.fromisoformat(self.start_entry.get().strip())
+            # never offer slots in the past
+            start = max(start, datetime.datetime.now())
+            end = datetime.datetime.combine(start.date(), datetime.time()) + datetime.timedelta(days=int(self.days_entry.get()))
+            slots = self.db.find_free_slots(start, end, teacher_id=int(tid) if tid else None,
+                                            student_id=self.student_id, limit=SLOT_PICKER_LIMIT)
+        except Exception as e:
+            messagebox.showerror('Hata', str(e), parent=self)
+            return
+        if not slots:
+            ctk.CTkLabel(self.rows_frame, text='Bu aralıkta uygun saat yok').pack(pady=10)
+        for slot in slots:
+            t = datetime.datetime.fromisoformat(slot['start_ts'])
+            teacher = self.teachers.get(slot['teacher_id'], f"#{slot['teacher_id']}")
+            row = ctk.CTkFrame(self.rows_frame)
+            row.pack(fill='x', pady=2)
+            ctk.CTkLabel(row, text=f"{t.strftime('%d.%m.%Y %H:%M')}  {teacher}").pack(side='left', padx=6)
+            ctk.CTkButton(row, text='Seç', width=60, command=lambda s=slot: self.book(s)).pack(side='right', padx=6)
+
+    def book(self, slot):
+        ok, err, _ = self.db.add_appointment(self.student_id, slot['teacher_id'], slot['start_ts'], duration_min=15)
+        if not ok:
+            # taken since the list was drawn (or the quota filled): show the fresh list
+            messagebox.showerror('Randevu Hatası', err, parent=self)
+            self.search()
+            return
+        messagebox.showinfo('Tamam', 'Randevu kaydedildi', parent=self)
+        if self.on_booked:
+            self.on_booked()
+        self.destroy()
+
 
 class TeacherDashboard(AdminDashboard):
     pass
@@ -402,33 +964,33 @@ class ParentDashboard(ctk.CTkFrame):
         ctk.CTkButton(self, text='Grafiği Göster', command=self.show_student_graph).pack(pady=6)
         self.graph_frame = ctk.CTkFrame(self)
         self.graph_frame.pack(fill='both', expand=True)
+        # one figure and canvas reused for every lookup; packed on the first graph.
+        # matplotlib is only loaded for parents
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from charts import ExamChart
+        self.chart = ExamChart(db)
+        self.canvas = FigureCanvasTkAgg(self.chart.figure, master=self.graph_frame)
+        self.chart_caption = ctk.CTkLabel(self.graph_frame, text='')
+        self._chart_shown = False
 
     def show_student_graph(self):
-        for w in self.graph_frame.winfo_children():
-            w.destroy()
         try:
             sid = int(self.parent_student_id.get())
         except:
             messagebox.showerror('Hata','Geçersiz öğrenci ID')
             return
-        cur = self.db.conn.cursor()
-        cur.execute('SELECT name,score,ts FROM exams WHERE student_id=? ORDER BY ts DESC LIMIT 6', (sid,))
-        rows = cur.fetchall()[::-1]
-        if not rows:
+        caption = self.chart.show(sid)
+        if caption is None:
             messagebox.showinfo('Bilgi','Sınav bulunamadı')
             return
-        tests = [r['name'] for r in rows]
-        scores = [r['score'] for r in rows]
-        fig, ax = plt.subplots(figsize=(6,3))
-        ax.plot(tests, scores, marker='o', color='seagreen')
-        ax.set_ylim(0,100)
-        ax.set_title('Son Sınav Performansı')
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.get_tk_widget().pack()
-
-    
+        if not self._chart_shown:
+            self.canvas.get_tk_widget().pack()
+            self.chart_caption.pack(pady=4)
+            self._chart_shown = True
+        self.chart_caption.configure(text=caption)
 
 
 if __name__ == '__main__':
+    setup_logging(LOG_FILE)
     app = App()
     app.mainloop()
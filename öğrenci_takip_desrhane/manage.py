@@ -0,0 +1,143 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from database import Database
+from importer import IMPORT_CHUNK_SIZE, import_students
+from reports import export_attendance_report
+from logsetup import LOG_FILE, setup_logging
+
+
+def _read_users(path):
+    # streams rows; the file is never loaded as a whole
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield (row.get('username'), row.get('password'), (row.get('role') or '').strip())
+
+
+def cmd_import_users(args):
+    db = Database(args.db)
+    t0 = time.perf_counter()
+    report = db.create_users_bulk(_read_users(args.csv), workers=args.workers, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - t0
+    db.close()
+    print(f"{report['created']} kullanıcı oluşturuldu ({elapsed:.1f} sn, {report['created'] / max(elapsed, 1e-9):.0f}/sn)")
+    if report['duplicates']:
+        print(f"{len(report['duplicates'])} tekrar eden kullanıcı adı atlandı: {', '.join(report['duplicates'][:50])}")
+    for line, username, reason in report['invalid']:
+        print(f'satır {line}: {username or "-"}: {reason}')
+    return 0 if not report['invalid'] else 1
+
+
+def cmd_import_students(args):
+    db = Database(args.db)
+    try:
+        report = import_students(db, args.file, chunk_size=args.chunk_size)
+    finally:
+        db.close()
+    print(f"{report['rows']} satır okundu: {report['inserted']} yeni, {report['updated']} güncellendi, "
+          f"{len(report['errors'])} hatalı ({report['elapsed']:.1f} sn, {report['rows_per_sec']:.0f} satır/sn)")
+    for line, tc, reason in report['errors']:
+        print(f'satır {line}: {tc or "-"}: {reason}')
+    return 0 if not report['errors'] else 1
+
+
+def cmd_rebuild_exam_stats(args):
+    db = Database(args.db)
+    t0 = time.perf_counter()
+    try:
+        exams = db.rebuild_exam_stats()
+    finally:
+        db.close()
+    print(f'{exams} sınavın istatistikleri yeniden hesaplandı ({time.perf_counter() - t0:.1f} sn)')
+    return 0
+
+
+def cmd_attendance_report(args):
+    db = Database(args.db)
+    t0 = time.perf_counter()
+    try:
+        rows = export_attendance_report(db, args.output, args.year, month=args.month, by=args.by)
+    finally:
+        db.close()
+    print(f'{rows} satır yazıldı: {args.output} ({time.perf_counter() - t0:.1f} sn)')
+    return 0
+
+
+def cmd_serve(args):
+    # imported here: asyncio and the server are only needed by this command
+    from api_server import serve
+    try:
+        serve(args.db, host=args.host, port=args.port, token=args.token or os.environ.get('SMARTDERSHANE_API_TOKEN'),
+              backup_dir=args.backup_dir, backup_keep=args.backup_keep or None)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 0
+
+
+def cmd_telegram_bot(args):
+    from telegram_inbound import run_bot
+    db = Database(args.db)
+    try:
+        if not (args.token or db.get_setting('telegram_token')):
+            print('Telegram token ayarlanmamış (--token veya ayarlardan)', file=sys.stderr)
+            return 1
+        run_bot(db, token=args.token, workers=args.workers)
+    finally:
+        db.close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='manage.py', description='SmartDershane yönetim komutları')
+    parser.add_argument('--db', default='smartdershane.db', help='veritabanı dosyası')
+    parser.add_argument('--log', default=LOG_FILE, help=f'log dosyası (varsayılan: {LOG_FILE}; boş verilirse log yazılmaz)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import-users', help='CSV dosyasından (username,password,role) toplu kullanıcı oluştur')
+    p.add_argument('csv')
+    p.add_argument('--workers', type=int, default=None, help='parola hash işlemi için süreç sayısı (varsayılan: tüm çekirdekler)')
+    p.add_argument('--chunk-size', type=int, default=500)
+    p.set_defaults(func=cmd_import_users)
+
+    p = sub.add_parser('import-students', help='e-Okul CSV/Excel listesinden öğrencileri TC ile ekle/güncelle')
+    p.add_argument('file')
+    p.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    p.set_defaults(func=cmd_import_students)
+
+    p = sub.add_parser('rebuild-exam-stats', help='sınav istatistik tablolarını sıfırdan yeniden hesapla')
+    p.set_defaults(func=cmd_rebuild_exam_stats)
+
+    p = sub.add_parser('attendance-report', help='aylık yoklama raporu (.csv veya .xlsx)')
+    p.add_argument('year', type=int)
+    p.add_argument('output')
+    p.add_argument('--month', type=int, choices=range(1, 13), metavar='1-12')
+    p.add_argument('--by', choices=('student', 'class'), default='student')
+    p.set_defaults(func=cmd_attendance_report)
+
+    p = sub.add_parser('serve', help='ön büro bilgisayarları için HTTP/JSON API sunucusu')
+    p.add_argument('--host', default='127.0.0.1', help='ağdan erişim için 0.0.0.0; yalnızca --token ile')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--token', default=None, help='istemcilerin göndereceği anahtar (varsayılan: SMARTDERSHANE_API_TOKEN)')
+    p.add_argument('--backup-dir', default='backups', help='istemcilerin başlattığı yedeklerin yazılacağı klasör')
+    p.add_argument('--backup-keep', type=int, default=14, help='saklanacak en yeni yedek sayısı (0: hepsi)')
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('telegram-bot', help='velilerin /notlar ve /devamsizlik sorularını yanıtlayan bot')
+    p.add_argument('--token', default=None, help='bot anahtarı (varsayılan: ayarlardaki telegram_token)')
+    p.add_argument('--workers', type=int, default=8, help='aynı anda yanıtlanan soru sayısı')
+    p.set_defaults(func=cmd_telegram_bot)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.log:
+        setup_logging(args.log)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
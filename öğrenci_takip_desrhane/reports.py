@@ -0,0 +1,93 @@
+import csv
+import datetime
+import logging
+import os
+import threading
+from database import ATTENDANCE_STATUSES
+
+log = logging.getLogger(__name__)
+
+REPORT_HEADERS = {
+    'student': ('Ay', 'Öğrenci ID', 'Ad', 'Soyad', 'Sınıf') + ATTENDANCE_STATUSES + ('Toplam', 'Devam %'),
+    'class': ('Ay', 'Sınıf', 'Öğrenci Sayısı') + ATTENDANCE_STATUSES + ('Toplam', 'Devam %'),
+}
+PROGRESS_EVERY = 1000
+
+
+def _period(year, month=None):
+    # [start, end) as ISO date strings, comparable with attendance.ts
+    if month:
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year + (month == 12), month % 12 + 1, 1)
+    else:
+        start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    return start.isoformat(), end.isoformat()
+
+
+def attendance_report(db, year, month=None, by='student'):
+    # generator of report rows; Gelen and Geç Kaldı count as present for the rate
+    start, end = _period(year, month)
+    for row in db.attendance_monthly(start, end, by=by):
+        present, total = row[-5] + row[-4], row[-1]
+        yield row + (round(100.0 * present / total, 1) if total else 0.0,)
+
+
+def write_csv(rows, path, header):
+    # ';' and a BOM so Excel opens it with Turkish characters intact
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_xlsx(rows, path, header):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError('Excel raporu için openpyxl gerekli (pip install openpyxl)')
+    # write_only streams rows to disk instead of keeping the sheet in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Yoklama')
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def _counted(rows, state, progress):
+    for row in rows:
+        state['rows'] += 1
+        if progress and state['rows'] % PROGRESS_EVERY == 0:
+            progress(state['rows'])
+        yield row
+
+
+def export_attendance_report(db, path, year, month=None, by='student', progress=None):
+    # writes the report to .csv or .xlsx (by extension); returns the number of rows.
+    # progress(rows_written) is called every PROGRESS_EVERY rows.
+    state = {'rows': 0}
+    rows = _counted(attendance_report(db, year, month, by), state, progress)
+    if os.path.splitext(path)[1].lower() == '.xlsx':
+        write_xlsx(rows, path, REPORT_HEADERS[by])
+    else:
+        write_csv(rows, path, REPORT_HEADERS[by])
+    log.info('Attendance report %s%s by %s: %d rows -> %s', year, f'-{month:02d}' if month else '', by, state['rows'], path)
+    return state['rows']
+
+
+def start_attendance_report(db, path, callback=None, **kwargs):
+    # runs export_attendance_report on a background thread (it reads through that
+    # thread's own pooled connection); callback(rows, error) is called from that thread
+    def _run():
+        try:
+            rows = export_attendance_report(db, path, **kwargs)
+        except Exception as e:
+            log.exception('Attendance report failed')
+            if callback:
+                callback(None, e)
+            return
+        if callback:
+            callback(rows, None)
+    t = threading.Thread(target=_run, name='attendance-report', daemon=True)
+    t.start()
+    return t
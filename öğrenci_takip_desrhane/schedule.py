@@ -0,0 +1,113 @@
+import bisect
+
+
+class TeacherSchedule:
+    # per-teacher interval index: availability windows (merged) and bookings,
+    # both kept sorted so lookups are a bisect instead of a scan
+    def __init__(self, availability=(), bookings=()):
+        self._avail = {}      # availability id -> (start, end)
+        self._merged = []     # sorted, non-overlapping (start, end)
+        self._merged_starts = []
+        self._bookings = []   # sorted (start, end, appt_id)
+        self._booking_by_id = {}
+        self._max_booking = None
+        for av_id, start, end in availability:
+            self._avail[av_id] = (start, end)
+        self._merge()
+        for appt_id, start, end in bookings:
+            self.add_booking(appt_id, start, end)
+
+    def _merge(self):
+        merged = []
+        for start, end in sorted(self._avail.values()):
+            if merged and start <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        self._merged = merged
+        self._merged_starts = [m[0] for m in merged]
+
+    def has_availability(self):
+        return bool(self._merged)
+
+    def add_availability(self, av_id, start, end):
+        self._avail[av_id] = (start, end)
+        self._merge()
+
+    def remove_availability(self, av_id):
+        if self._avail.pop(av_id, None) is not None:
+            self._merge()
+
+    def is_available(self, start, end):
+        # True if [start, end) lies inside one availability window
+        i = bisect.bisect_right(self._merged_starts, start) - 1
+        return i >= 0 and self._merged[i][1] >= end
+
+    def add_booking(self, appt_id, start, end):
+        item = (start, end, appt_id)
+        bisect.insort(self._bookings, item)
+        self._booking_by_id[appt_id] = item
+        if self._max_booking is None or end - start > self._max_booking:
+            self._max_booking = end - start
+
+    def remove_booking(self, appt_id):
+        item = self._booking_by_id.pop(appt_id, None)
+        if item is None:
+            return
+        i = bisect.bisect_left(self._bookings, item)
+        if i < len(self._bookings) and self._bookings[i] == item:
+            del self._bookings[i]
+
+    def conflict(self, start, end):
+        # first booking overlapping [start, end), or None
+        i = bisect.bisect_left(self._bookings, (end,))
+        # bookings starting before `end`; only the ones that can still reach `start` need checking
+        while i > 0:
+            i -= 1
+            b_start, b_end, appt_id = self._bookings[i]
+            if b_end > start:
+                return appt_id
+            if self._max_booking is None or b_start + self._max_booking <= start:
+                break
+        return None
+
+    def windows_between(self, start, end):
+        # availability windows clipped to [start, end), in order
+        i = max(bisect.bisect_right(self._merged_starts, start) - 1, 0)
+        for w_start, w_end in self._merged[i:]:
+            if w_start >= end:
+                break
+            if w_end > start:
+                yield max(w_start, start), min(w_end, end)
+
+    def bookings_between(self, start, end):
+        # (start, end, appt_id) of the bookings overlapping [start, end), by start
+        i = bisect.bisect_left(self._bookings, (end,))
+        first = i
+        # same walk back as conflict(): stop once no earlier booking can reach `start`
+        while first > 0:
+            if self._bookings[first - 1][0] + self._max_booking <= start:
+                break
+            first -= 1
+        return [b for b in self._bookings[first:i] if b[1] > start]
+
+    def free_slots(self, start, end, duration, step=None):
+        # start times of free [t, t + duration) slots inside [start, end): a sweep over
+        # the availability windows minus the bookings. Slots sit on a `step` grid counted
+        # from midnight (default: duration), so they read 09:00, 09:15, ...
+        step = step or duration
+        for w_start, w_end in self.windows_between(start, end):
+            cursor = w_start
+            for b_start, b_end, _ in self.bookings_between(w_start, w_end) + [(w_end, w_end, None)]:
+                t = _ceil(cursor, step)
+                while t + duration <= b_start:
+                    yield t
+                    t += step
+                cursor = max(cursor, b_end)
+
+
+def _ceil(dt, step):
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    rem = (dt - midnight) % step
+    return dt + (step - rem) if rem else dt
@@ -1,53 +1,294 @@
-
-import requests
 import logging
+import os
+import socket
+import threading
+import time
 from datetime import datetime
 
-logging.basicConfig(filename='smartdershane.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+log = logging.getLogger(__name__)
+
+TELEGRAM_API = 'https://api.telegram.org'
+# Telegram limits: about 30 messages/s overall and 1 message/s to the same chat
+GLOBAL_RATE = 30.0
+PER_CHAT_INTERVAL = 1.0
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+RETRY_BASE_S = 2.0
+RETRY_MAX_S = 300.0
+# Telegram rejects longer texts; digests are split on line boundaries
+MAX_MESSAGE_CHARS = 4096
+
+# 'instant': one message per attendance mark. 'digest': one message per parent each day
+# at the digest time, and only REALTIME_STATUSES are still sent as they happen.
+# Both are settings (telegram_mode, telegram_digest_time) so every PC follows them.
+NOTIFY_MODES = ('instant', 'digest')
+REALTIME_STATUSES = ('Gelmedi',)
+DIGEST_TIME = '18:00'
 
 
 class TelegramNotifier:
-    def __init__(self, db):
+    def __init__(self, db, api_base=TELEGRAM_API, global_rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 retry_base=RETRY_BASE_S, poll_interval=5.0):
         self.db = db
         self.token = db.get_setting('telegram_token')
+        self.api_base = api_base.rstrip('/')
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+        self._next_global = 0.0
+        self._chat_next = {}
+        # outbox rows are claimed under this name (see Database.claim_messages)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+
+    @property
+    def session(self):
+        # one pooled keep-alive session shared by the delivery worker; requests is
+        # imported on first send so it stays out of the GUI's startup path
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+                    self._session = session
+        return self._session
+
+    @property
+    def mode(self):
+        return self.db.get_setting('telegram_mode') or 'instant'
+
+    @property
+    def digest_time(self):
+        return self.db.get_setting('telegram_digest_time') or DIGEST_TIME
+
+    def set_mode(self, mode, digest_time=None):
+        if mode not in NOTIFY_MODES:
+            raise ValueError(f'Geçersiz bildirim modu: {mode}')
+        if digest_time is not None:
+            # HH:MM, zero-padded so it compares as text
+            digest_time = datetime.strptime(digest_time.strip(), '%H:%M').strftime('%H:%M')
+            self.db.set_setting('telegram_digest_time', digest_time)
+        self.db.set_setting('telegram_mode', mode)
+        self._wake.set()
 
     def set_token(self, token: str):
         self.token = token
         try:
             self.db.set_setting('telegram_token', token)
-            logging.info('Telegram token kaydedildi')
+            log.info('Telegram token kaydedildi')
         except Exception:
-            logging.exception('Token kaydedilemedi')
+            log.exception('Token kaydedilemedi')
+        self._wake.set()
 
-    def _send(self, chat_id, text):
-        if not self.token or not chat_id:
-            logging.warning('Telegram token veya chat_id eksik; mesaj gönderilemedi')
+    # delivery worker
+    def start(self):
+        if self._worker and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, name='telegram-outbox', daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._worker:
+            self._worker.join(timeout)
+            self._worker = None
+
+    def _run(self):
+        # pending rows survive restarts; the worker simply picks them up again
+        while not self._stop.is_set():
+            try:
+                self.send_digest_if_due()
+            except Exception:
+                log.exception('Digest error')
+            try:
+                worked = self.deliver_due()
+            except Exception:
+                log.exception('Outbox worker error')
+                worked = False
+            if not worked:
+                now = time.time()
+                due = self.db.next_message_due_at()
+                waiting = [t for t in self._chat_next.values() if t > now]
+                if due is not None and due <= now and waiting:
+                    # what is due belongs to chats still inside their per-chat interval
+                    due = min(waiting)
+                delay = self.poll_interval if due is None else min(max(due - now, 0.05), self.poll_interval)
+                self._wake.wait(delay)
+                self._wake.clear()
+
+    def deliver_due(self):
+        # claim and send one batch of due messages; returns True if something was sent or retried
+        # the token is read again every round: an admin may save it from another PC (API client)
+        self.token = self.db.get_setting('telegram_token')
+        if not self.token:
             return False
-        url = f'https://api.telegram.org/bot{self.token}/sendMessage'
+        now = time.time()
+        # chats waiting on the per-chat interval are skipped in the query, so a batch is
+        # never filled with messages that cannot go out yet
+        blocked = {c for c, t in self._chat_next.items() if t > now}
+        batch = self.db.claim_messages(self.worker_id, limit=BATCH_SIZE, skip_chats=blocked)
+        if not batch:
+            return False
+        worked = False
+        unsent = []
+        for m in batch:
+            chat = m['chat_id']
+            # keep per-chat order: once a chat has to wait, its later messages go back to pending
+            if self._stop.is_set() or chat in blocked or self._chat_next.get(chat, 0) > time.time():
+                blocked.add(chat)
+                unsent.append(m['id'])
+                continue
+            self._wait_global()
+            ok, retry_after, error = self._post(chat, m['text'])
+            self._chat_next[chat] = time.time() + self.per_chat_interval
+            worked = True
+            if ok:
+                # marked right away: a crash later in the batch does not send it again
+                self.db.mark_messages_sent([m['id']])
+                continue
+            attempts = m['attempts'] + 1
+            if retry_after is None and attempts >= MAX_ATTEMPTS:
+                self.db.mark_message_failed(m['id'], error)
+            elif retry_after is False:
+                # permanent error (chat not found, bot blocked): do not retry
+                self.db.mark_message_failed(m['id'], error)
+            else:
+                delay = retry_after if retry_after else min(self.retry_base * (2 ** (attempts - 1)), RETRY_MAX_S)
+                self.db.mark_message_retry(m['id'], time.time() + delay, error)
+                if retry_after:
+                    self._chat_next[chat] = time.time() + retry_after
+                blocked.add(chat)
+        self.db.release_messages(unsent)
+        if len(self._chat_next) > 10000:
+            now = time.time()
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        return worked
+
+    def _wait_global(self):
+        if not self.global_rate:
+            return
+        now = time.time()
+        if self._next_global > now:
+            time.sleep(self._next_global - now)
+            now = self._next_global
+        self._next_global = now + 1.0 / self.global_rate
+
+    def _post(self, chat_id, text):
+        # returns (ok, retry_after, error); retry_after is seconds, None (use backoff) or False (permanent)
+        url = f'{self.api_base}/bot{self.token}/sendMessage'
         payload = {'chat_id': chat_id, 'text': text}
         try:
-            r = requests.post(url, data=payload, timeout=5)
-            if r.status_code == 200:
-                logging.info(f'Telegram message sent to {chat_id}')
-                return True
-            else:
-                logging.error(f'Telegram error {r.status_code} {r.text}')
-                return False
-        except Exception:
-            logging.exception('Telegram gönderilemedi')
-            return False
+            r = self.session.post(url, data=payload, timeout=5)
+        except Exception as e:
+            log.warning('Telegram gönderilemedi: %s', e)
+            return False, None, str(e)
+        if r.status_code == 200:
+            return True, None, None
+        error = f'{r.status_code} {r.text[:200]}'
+        log.error('Telegram error %s', error)
+        if r.status_code == 429:
+            try:
+                return False, float(r.json().get('parameters', {}).get('retry_after', 1)), error
+            except Exception:
+                return False, 1.0, error
+        if r.status_code in (400, 401, 403, 404):
+            return False, False, error
+        return False, None, error
+
+    def _attendance_text(self, s, status):
+        return f"Öğrenciniz {s.get('name')} {s.get('surname')} - durum: {status}. Saat: {datetime_now()}"
 
     def notify_parent_attendance(self, student_id, status):
+        # in digest mode only absences go out now; everything else is in the evening digest
+        if status not in REALTIME_STATUSES and self.mode == 'digest':
+            return True
         s = self.db.get_student(student_id)
         if not s:
             return False
         chat = s.get('parent_chat_id')
-        text = f"Öğrenciniz {s.get('name')} {s.get('surname')} - durum: {status}. Saat: {datetime_now()}"
-        self._send(chat, text)
+        if chat:
+            self.db.enqueue_message(chat, self._attendance_text(s, status))
+            self._wake.set()
+        else:
+            log.warning('Veli chat_id eksik: öğrenci %s', student_id)
         return True
 
+    def notify_class_attendance(self, records):
+        # records: (student_id, status) pairs from one roll-call; queued in one transaction
+        messages = []
+        digest = self.mode == 'digest'
+        for student_id, status in records:
+            if digest and status not in REALTIME_STATUSES:
+                continue
+            s = self.db.get_student(student_id)
+            if s and s.get('parent_chat_id'):
+                messages.append((s['parent_chat_id'], self._attendance_text(s, status)))
+        queued = self.db.enqueue_messages(messages)
+        if queued:
+            self._wake.set()
+        return queued
 
-def datetime_now():
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # daily digest
+    def send_digest_if_due(self, now=None):
+        # called by the worker on every round: queues today's digests once the digest
+        # time has passed. A day missed while no notifier was running is not sent later.
+        if self.mode != 'digest':
+            return 0
+        now = now or datetime.now()
+        day = now.date().isoformat()
+        if now.strftime('%H:%M') < self.digest_time or (self.db.get_setting('digest_last_day') or '') >= day:
+            return 0
+        return self.queue_digest(day)
 
+    def queue_digest(self, day):
+        # builds every parent's digest for day with one query and queues them in one
+        # transaction; 0 when another notifier already did
+        messages = []
+        for chat, items in self.db.parent_digest(day):
+            messages.extend((chat, text) for text in self._digest_texts(day, items))
+        queued = self.db.enqueue_digest(day, messages)
+        if queued:
+            self._wake.set()
+        return queued or 0
 
+    def _digest_texts(self, day, items):
+        lines = [f"Günlük özet - {datetime.strptime(str(day), '%Y-%m-%d').strftime('%d.%m.%Y')}"]
+        student = None
+        for item in items:
+            if item['student_id'] != student:
+                student = item['student_id']
+                lines.append('')
+                lines.append(f"{item['name']} {item['surname']}")
+            ts = item['ts'] or ''
+            if item['kind'] == 'attendance':
+                lines.append(f"  Yoklama {ts[11:16]}: {item['detail']}")
+            elif item['kind'] == 'exam':
+                score = item['score']
+                lines.append(f"  Sınav: {item['detail']} - {score:g} puan" if score is not None else f"  Sınav: {item['detail']}")
+            else:
+                teacher = f" ({item['detail']})" if item['detail'] else ''
+                lines.append(f"  Randevu: {ts[8:10]}.{ts[5:7]} {ts[11:16]}{teacher}")
+        # split on line boundaries to stay under Telegram's limit
+        texts, current = [], ''
+        for line in lines:
+            if current and len(current) + len(line) + 1 > MAX_MESSAGE_CHARS:
+                texts.append(current)
+                current = line
+            else:
+                current = f'{current}\n{line}' if current else line
+        texts.append(current)
+        return texts
+
+
+def datetime_now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,250 @@
+import asyncio
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache
+from database import ATTENDANCE_STATUSES
+from telegram_bot import TELEGRAM_API, GLOBAL_RATE, MAX_MESSAGE_CHARS
+
+log = logging.getLogger(__name__)
+
+# getUpdates long-poll wait; the HTTP timeout is a little longer
+POLL_TIMEOUT_S = 25
+POLL_BATCH = 100
+# lookups (and their replies) run on this many threads at once
+LOOKUP_WORKERS = 8
+# answers are reused for the same chat and command for this long
+RESPONSE_CACHE_TTL_S = 60
+RESPONSE_CACHE_SIZE = 5000
+RECENT_EXAMS = 5
+RECENT_ABSENCES = 5
+MAX_SEND_ATTEMPTS = 3
+ERROR_BACKOFF_S = 5.0
+
+HELP_TEXT = ('Komutlar:\n'
+             '/notlar - son sınav sonuçları\n'
+             '/devamsizlik - bu dönemin yoklama özeti')
+
+
+def term_start(today):
+    # school year starts in September
+    return datetime.date(today.year if today.month >= 9 else today.year - 1, 9, 1)
+
+
+def _command(text):
+    # '/notlar@SmartDershaneBot argüman' -> '/notlar'
+    words = (text or '').split(maxsplit=1)
+    return words[0].split('@', 1)[0].lower() if words else ''
+
+
+class InboundBot:
+    # answers parents' commands (/notlar, /devamsizlik) for the children linked to their
+    # chat (students.parent_chat_id). One asyncio task long-polls getUpdates; every
+    # update is handled in its own task, with lookups and replies on a thread pool, so
+    # slow chats do not hold up others. Updates from one chat are answered in order.
+    # Only one process per bot token may call getUpdates: run this in one place
+    # (manage.py telegram-bot), next to any number of outbound notifiers.
+    def __init__(self, db, token=None, api_base=TELEGRAM_API, poll_timeout=POLL_TIMEOUT_S, workers=LOOKUP_WORKERS,
+                 cache_ttl=RESPONSE_CACHE_TTL_S, global_rate=GLOBAL_RATE):
+        self.db = db
+        self.token = token or db.get_setting('telegram_token')
+        self.api_base = api_base.rstrip('/')
+        self.poll_timeout = poll_timeout
+        self.global_rate = global_rate
+        self.cache = TTLCache(RESPONSE_CACHE_SIZE, cache_ttl)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='telegram-inbound')
+        # getUpdates waits up to poll_timeout: it gets a thread of its own
+        self._poller = ThreadPoolExecutor(1, thread_name_prefix='telegram-getupdates')
+        self._session = None
+        self._session_lock = threading.Lock()
+        # chat_id -> [lock, tasks using it]; dropped when the last one finishes
+        self._chat_locks = {}
+        self._tasks = set()
+        self._next_global = 0.0
+        self._stop = None
+        self._loop = None
+        self.offset = int(db.get_setting('telegram_update_offset') or 0)
+        self.handled = 0
+
+    @property
+    def session(self):
+        # requests is imported on first use, like in TelegramNotifier
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._executor._max_workers + 1)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _call(self, method, payload, timeout):
+        r = self.session.post(f'{self.api_base}/bot{self.token}/{method}', json=payload, timeout=timeout)
+        try:
+            body = r.json()
+        except ValueError:
+            body = {}
+        return r.status_code, body
+
+    async def run(self):
+        if not self.token:
+            raise RuntimeError('Telegram token ayarlanmamış')
+        self._loop = loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        log.info('Inbound Telegram bot started at offset %d', self.offset)
+        try:
+            while not self._stop.is_set():
+                payload = {'offset': self.offset, 'limit': POLL_BATCH, 'timeout': self.poll_timeout,
+                           'allowed_updates': ['message']}
+                try:
+                    status, body = await loop.run_in_executor(self._poller, self._call, 'getUpdates', payload, self.poll_timeout + 10)
+                except Exception as e:
+                    log.warning('getUpdates failed: %s', e)
+                    await self._sleep(ERROR_BACKOFF_S)
+                    continue
+                if status != 200 or not body.get('ok'):
+                    log.error('getUpdates error %s: %s', status, str(body)[:200])
+                    await self._sleep((body.get('parameters') or {}).get('retry_after') or ERROR_BACKOFF_S)
+                    continue
+                updates = body.get('result') or []
+                for update in updates:
+                    task = asyncio.create_task(self.handle_update(update))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                if updates:
+                    # the next getUpdates confirms these; saved so a restart does not answer them twice
+                    self.offset = updates[-1]['update_id'] + 1
+                    await loop.run_in_executor(self._executor, self.db.set_setting, 'telegram_update_offset', str(self.offset))
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self):
+        # safe from any thread; run() returns after the current long poll
+        if self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def close(self):
+        self._executor.shutdown()
+        self._poller.shutdown()
+        if self._session is not None:
+            self._session.close()
+
+    async def handle_update(self, update):
+        message = update.get('message') or {}
+        chat_id = (message.get('chat') or {}).get('id')
+        if chat_id is None or not message.get('text'):
+            return
+        command = _command(message['text'])
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await self._answer_update(entry[0], chat_id, command, message)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+        self.handled += 1
+
+    async def _answer_update(self, lock, chat_id, command, message):
+        loop = asyncio.get_running_loop()
+        async with lock:
+            try:
+                text = self.cache.get((chat_id, command), None)
+                if text is None:
+                    text = await loop.run_in_executor(self._executor, self.answer, chat_id, command)
+                    self.cache.put((chat_id, command), text)
+                await self._reply(chat_id, text, message.get('message_id'))
+            except Exception:
+                log.exception('Reply to chat %s failed', chat_id)
+
+    async def _reply(self, chat_id, text, reply_to=None):
+        loop = asyncio.get_running_loop()
+        payload = {'chat_id': chat_id, 'text': text}
+        if reply_to is not None:
+            payload['reply_to_message_id'] = reply_to
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self._throttle()
+            status, body = await loop.run_in_executor(self._executor, self._call, 'sendMessage', payload, 10)
+            if status == 200:
+                return True
+            retry_after = (body.get('parameters') or {}).get('retry_after')
+            log.error('Telegram reply error %s: %s', status, str(body)[:200])
+            if status in (400, 401, 403, 404):
+                return False
+            await asyncio.sleep(retry_after or 2 ** attempt)
+        return False
+
+    async def _throttle(self):
+        # Telegram's global limit, shared by all reply tasks
+        if not self.global_rate:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_global)
+        self._next_global = slot + 1.0 / self.global_rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    # answers (worker threads)
+    def answer(self, chat_id, command):
+        children = self.db.students_for_chat(chat_id)
+        if not children:
+            return (f'Bu sohbete bağlı öğrenci bulunamadı. Sohbet numaranızı ({chat_id}) '
+                    'dershaneye ileterek kayıt yaptırabilirsiniz.')
+        if command == '/notlar':
+            return self._scores_text(children)
+        if command == '/devamsizlik':
+            return self._attendance_text(children)
+        names = ', '.join(f"{s['name']} {s['surname']}" for s in children)
+        return f'Merhaba! Bağlı öğrenci: {names}\n\n{HELP_TEXT}'
+
+    def _scores_text(self, children):
+        parts = []
+        for s in children:
+            lines = [f"{s['name']} {s['surname']}"]
+            exams = self.db.list_exams(s['id'], limit=RECENT_EXAMS)
+            if not exams:
+                lines.append('  Henüz sınav sonucu yok.')
+            for e in exams:
+                score = f"{e['score']:g}" if e['score'] is not None else '-'
+                lines.append(f"  {(e['ts'] or '')[:10]} {e['name']}: {score}")
+            summary = self.db.student_exam_summary(s['id'])
+            if summary:
+                lines.append(f"  Ortalama: {summary['mean']:.1f} ({summary['n']} sınav)")
+            parts.append('\n'.join(lines))
+        return '\n\n'.join(parts)[:MAX_MESSAGE_CHARS]
+
+    def _attendance_text(self, children):
+        since = term_start(datetime.date.today())
+        parts = []
+        for s in children:
+            summary = self.db.attendance_summary(s['id'], since=since, recent=RECENT_ABSENCES)
+            counts = summary['counts']
+            lines = [f"{s['name']} {s['surname']} ({since.strftime('%d.%m.%Y')} sonrası)",
+                     '  ' + ', '.join(f'{status}: {counts.get(status, 0)}' for status in ATTENDANCE_STATUSES)]
+            if summary['absences']:
+                days = ', '.join(f'{ts[8:10]}.{ts[5:7]}' for ts in summary['absences'])
+                lines.append(f'  Son devamsızlıklar: {days}')
+            parts.append('\n'.join(lines))
+        return '\n\n'.join(parts)[:MAX_MESSAGE_CHARS]
+
+
+def run_bot(db, **kwargs):
+    bot = InboundBot(db, **kwargs)
+    try:
+        asyncio.run(bot.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bot.close()
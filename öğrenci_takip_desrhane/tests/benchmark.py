@@ -0,0 +1,321 @@
+# Times every public Database method on generated data (tests/datagen.py) at one or
+# more scales and writes the results as JSON for comparison between releases.
+#   python tests/benchmark.py --scales tiny small medium --out bench.json
+#   python tests/benchmark.py --scales medium --compare bench-1.4.json
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen  # noqa: E402
+from database import Database, ATTENDANCE_STATUSES  # noqa: E402
+
+DEFAULT_REPEAT = 20
+REGRESSION_RATIO = 1.25
+# differences below this are timer noise, never a regression
+REGRESSION_MIN_MS = 0.05
+# not timed directly: close() ends the run, start_backup() is backup() on a thread
+SKIPPED = {'close': 'ends the benchmark', 'start_backup': 'thread wrapper around backup'}
+
+
+class Context:
+    # ids and names from the generated database, plus a seeded rng for arguments
+    def __init__(self, db, workdir, seed):
+        # a different stream than the generator's, which would repeat its TC numbers
+        self.rng = random.Random(f'bench-{seed}')
+        self.workdir = workdir
+        conn = db.conn
+        self.student_ids = [r[0] for r in conn.execute('SELECT id FROM students ORDER BY id')]
+        self.teacher_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE role='teacher' ORDER BY id")]
+        self.classes = db.list_classes()
+        self.exam_names = [r[0] for r in conn.execute('SELECT exam FROM exam_stats ORDER BY exam')]
+        self.days = datagen.school_days()
+        self.counter = 0
+
+    def student(self):
+        return self.rng.choice(self.student_ids)
+
+    def new_tc(self, db):
+        while True:
+            tc = datagen.make_tc(self.rng)
+            if not db.conn.execute('SELECT 1 FROM students WHERE tc=?', (tc,)).fetchone():
+                return tc
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f'{prefix}{self.counter}'
+
+    def slot(self):
+        day = self.rng.choice(self.days)
+        start = datetime.datetime.combine(day, datetime.time(9)) + datetime.timedelta(minutes=15 * self.rng.randrange(32))
+        return start.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _day_start(ctx):
+    return datetime.datetime.combine(ctx.rng.choice(ctx.days), datetime.time())
+
+
+def _new_user(db, ctx):
+    name = ctx.unique('bench_user')
+    db.create_user(name, datagen.PASSWORD, 'parent')
+    return db.conn.execute('SELECT id FROM users WHERE username=?', (name,)).fetchone()[0]
+
+
+def _new_student(db, ctx):
+    tc = ctx.new_tc(db)
+    db.add_student('Bench', 'Öğrenci', tc, class_name=ctx.classes[0])
+    return db.conn.execute('SELECT id FROM students WHERE tc=?', (tc,)).fetchone()[0]
+
+
+def _pending_id(db):
+    return db.conn.execute("SELECT id FROM outbox WHERE status='pending' ORDER BY id LIMIT 1").fetchone()[0]
+
+
+def _digest_day(ctx):
+    # enqueue_digest only queues days after the last one
+    ctx.unique('digest')
+    return datetime.date(2100, 1, 1) + datetime.timedelta(days=ctx.counter)
+
+
+def _refill_outbox(db, ctx):
+    if db.conn.execute("SELECT COUNT(*) FROM outbox WHERE status='pending'").fetchone()[0] < 200:
+        db.enqueue_messages([(str(ctx.rng.randrange(10 ** 6)), 'doldurma') for _ in range(500)])
+
+
+def _class_roll(db, ctx):
+    cls = ctx.rng.choice(ctx.classes)
+    return ([(s['id'], ctx.rng.choice(ATTENDANCE_STATUSES)) for s in db.list_students(class_name=cls)],)
+
+
+# method -> list of (label, repeat, setup, run). setup(db, ctx) runs untimed and returns
+# the argument tuple for run(db, *args); repeat None means DEFAULT_REPEAT.
+def _ops():
+    no_args = lambda db, ctx: ()  # noqa: E731
+    return {
+        'authenticate': [('authenticate', 5, lambda db, ctx: (f'ogretmen{ctx.rng.randint(1, len(ctx.teacher_ids))}', datagen.PASSWORD, 'teacher'),
+                          lambda db, u, p, r: db.authenticate(u, p, r))],
+        'create_user': [('create_user', 3, lambda db, ctx: (ctx.unique('bench_new'),), lambda db, u: db.create_user(u, 'pw', 'parent'))],
+        'create_users_bulk': [('create_users_bulk[20]', 2, lambda db, ctx: ([(ctx.unique('bench_bulk'), 'pw', 'parent') for _ in range(20)],),
+                               lambda db, users: db.create_users_bulk(users))],
+        'change_password': [('change_password', 3, lambda db, ctx: (ctx.rng.choice(ctx.teacher_ids),),
+                             lambda db, uid: db.change_password(uid, datagen.PASSWORD))],
+        'delete_user': [('delete_user', 3, lambda db, ctx: (_new_user(db, ctx),), lambda db, uid: db.delete_user(uid))],
+        'list_users': [('list_users[page]', None, no_args, lambda db: db.list_users(limit=50)),
+                       ('list_users[all]', None, no_args, lambda db: db.list_users())],
+        'count_users': [('count_users', None, no_args, lambda db: db.count_users())],
+
+        'add_student': [('add_student', None, lambda db, ctx: (ctx.new_tc(db),),
+                         lambda db, tc: db.add_student('Yeni', 'Öğrenci', tc, class_name='9-A'))],
+        'upsert_students': [('upsert_students[100]', 5, lambda db, ctx: ([{'tc': ctx.new_tc(db), 'name': 'Ad', 'surname': 'Soyad'} for _ in range(100)],),
+                             lambda db, rows: db.upsert_students(rows))],
+        'get_student': [('get_student', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.get_student(sid))],
+        'edit_student': [('edit_student', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.edit_student(sid, surname='Değişti'))],
+        'delete_student': [('delete_student', None, lambda db, ctx: (_new_student(db, ctx),), lambda db, sid: db.delete_student(sid))],
+        'list_students': [('list_students[class]', None, lambda db, ctx: (ctx.rng.choice(ctx.classes),), lambda db, c: db.list_students(class_name=c)),
+                          ('list_students[page]', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.list_students(after_id=sid, limit=50)),
+                          ('list_students[all]', 5, no_args, lambda db: db.list_students())],
+        'students_for_chat': [('students_for_chat', None, lambda db, ctx: (db.get_student(ctx.student())['parent_chat_id'],),
+                               lambda db, chat: db.students_for_chat(chat))],
+        'list_classes': [('list_classes', None, no_args, lambda db: db.list_classes())],
+        'search_students': [('search_students[prefix]', None, lambda db, ctx: (ctx.rng.choice(datagen.LAST_NAMES)[:2],), lambda db, q: db.search_students(q)),
+                            ('search_students[full]', None, lambda db, ctx: (f'{ctx.rng.choice(datagen.FIRST_NAMES)} {ctx.rng.choice(datagen.LAST_NAMES)}',),
+                             lambda db, q: db.search_students(q))],
+        'count_students': [('count_students', None, no_args, lambda db: db.count_students())],
+
+        'add_attendance': [('add_attendance', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.add_attendance(sid, 'Gelen'))],
+        'add_attendance_bulk': [('add_attendance_bulk[class]', 5, _class_roll, lambda db, records: db.add_attendance_bulk(records))],
+        'list_attendance': [('list_attendance[page]', None, no_args, lambda db: db.list_attendance(limit=50)),
+                            ('list_attendance[new]', None, lambda db, ctx: (db.list_attendance(limit=10)[-1]['id'],),
+                             lambda db, aid: db.list_attendance(after_id=aid, limit=50))],
+        'attendance_summary': [('attendance_summary', None, lambda db, ctx: (ctx.student(),),
+                                lambda db, sid: db.attendance_summary(sid, since='2024-09-01'))],
+        'count_attendance': [('count_attendance', None, no_args, lambda db: db.count_attendance())],
+        'attendance_monthly': [('attendance_monthly[month]', 3, no_args, lambda db: sum(1 for _ in db.attendance_monthly('2024-10-01', '2024-11-01'))),
+                               ('attendance_monthly[year,class]', 2, no_args,
+                                lambda db: sum(1 for _ in db.attendance_monthly('2024-01-01', '2026-01-01', by='class')))],
+
+        'add_appointment': [('add_appointment', None, lambda db, ctx: (ctx.student(), ctx.rng.choice(ctx.teacher_ids), ctx.slot()),
+                             lambda db, sid, tid, ts: db.add_appointment(sid, tid, ts))],
+        'delete_appointment': [('delete_appointment', None,
+                                lambda db, ctx: (db.conn.execute('SELECT MAX(id) FROM appointments').fetchone()[0],),
+                                lambda db, aid: db.delete_appointment(aid))],
+        'list_appointments': [('list_appointments[student]', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.list_appointments(sid)),
+                              ('list_appointments[all]', 3, no_args, lambda db: db.list_appointments())],
+        'find_free_slots': [('find_free_slots[all]', None, lambda db, ctx: (_day_start(ctx),),
+                             lambda db, t: db.find_free_slots(t, t + datetime.timedelta(days=14))),
+                            ('find_free_slots[teacher,term]', None, lambda db, ctx: (ctx.rng.choice(ctx.teacher_ids), _day_start(ctx)),
+                             lambda db, tid, t: db.find_free_slots(t, t + datetime.timedelta(days=120), teacher_id=tid)),
+                            ('find_free_slots[student]', None, lambda db, ctx: (ctx.student(), _day_start(ctx)),
+                             lambda db, sid, t: db.find_free_slots(t, t + datetime.timedelta(days=14), student_id=sid))],
+        'add_availability': [('add_availability', None, lambda db, ctx: (ctx.rng.choice(ctx.teacher_ids), ctx.rng.choice(ctx.days)),
+                              lambda db, tid, day: db.add_availability(tid, f'{day}T17:00', f'{day}T18:00'))],
+        'delete_availability': [('delete_availability', None,
+                                 lambda db, ctx: (db.add_availability(ctx.rng.choice(ctx.teacher_ids), '2025-07-01T09:00', '2025-07-01T10:00'),),
+                                 lambda db, av: db.delete_availability(av))],
+
+        'add_exam': [('add_exam', None, lambda db, ctx: (ctx.student(), ctx.rng.choice(ctx.exam_names), ctx.rng.randint(0, 100)),
+                      lambda db, sid, name, score: db.add_exam(sid, name, score))],
+        'list_exams': [('list_exams', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.list_exams(sid)),
+                       ('list_exams[recent]', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.list_exams(sid, limit=5))],
+        'exam_summary': [('exam_summary', None, lambda db, ctx: (ctx.rng.choice(ctx.exam_names),), lambda db, name: db.exam_summary(name))],
+        'student_exam_summary': [('student_exam_summary', None, lambda db, ctx: (ctx.student(),), lambda db, sid: db.student_exam_summary(sid))],
+        'exam_rank': [('exam_rank', None, lambda db, ctx: (ctx.rng.choice(ctx.exam_names), ctx.rng.randint(0, 100)),
+                       lambda db, name, score: db.exam_rank(name, score))],
+        'rebuild_exam_stats': [('rebuild_exam_stats', 2, no_args, lambda db: db.rebuild_exam_stats())],
+
+        'backup': [('backup', 2, lambda db, ctx: (os.path.join(ctx.workdir, 'backups'),), lambda db, d: db.backup(d, verify=True))],
+        'list_backups': [('list_backups', None, no_args, lambda db: db.list_backups())],
+        'prune_backups': [('prune_backups', 2, no_args, lambda db: db.prune_backups(1))],
+
+        'enqueue_message': [('enqueue_message', None, lambda db, ctx: (str(ctx.rng.randrange(10 ** 6)),), lambda db, chat: db.enqueue_message(chat, 'test'))],
+        'enqueue_messages': [('enqueue_messages[100]', 5, lambda db, ctx: ([(str(ctx.rng.randrange(10 ** 6)), 'test') for _ in range(100)],),
+                              lambda db, msgs: db.enqueue_messages(msgs))],
+        'due_messages': [('due_messages', None, lambda db, ctx: _refill_outbox(db, ctx) or (), lambda db: db.due_messages(limit=100))],
+        'claim_messages': [('claim_messages[100]', 5, lambda db, ctx: _refill_outbox(db, ctx) or (),
+                            lambda db: db.release_messages([m['id'] for m in db.claim_messages('bench', limit=100)]))],
+        'release_messages': [('release_messages[100]', 5, lambda db, ctx: _refill_outbox(db, ctx) or ([m['id'] for m in db.claim_messages('bench', limit=100)],),
+                              lambda db, ids: db.release_messages(ids))],
+        'next_message_due_at': [('next_message_due_at', None, no_args, lambda db: db.next_message_due_at())],
+        'mark_messages_sent': [('mark_messages_sent[100]', 5, lambda db, ctx: _refill_outbox(db, ctx) or ([m['id'] for m in db.due_messages(limit=100)],),
+                                lambda db, ids: db.mark_messages_sent(ids))],
+        'mark_message_retry': [('mark_message_retry', None, lambda db, ctx: _refill_outbox(db, ctx) or (_pending_id(db),),
+                                lambda db, mid: db.mark_message_retry(mid, 0, 'bench'))],
+        'mark_message_failed': [('mark_message_failed', None, lambda db, ctx: _refill_outbox(db, ctx) or (_pending_id(db),),
+                                 lambda db, mid: db.mark_message_failed(mid, 'bench'))],
+        'outbox_counts': [('outbox_counts', None, no_args, lambda db: db.outbox_counts())],
+        'parent_digest': [('parent_digest[day]', 3, lambda db, ctx: (ctx.rng.choice(ctx.days),), lambda db, day: sum(1 for _ in db.parent_digest(day)))],
+        'enqueue_digest': [('enqueue_digest[100]', 5, lambda db, ctx: (_digest_day(ctx), [(str(100000 + i), 'özet') for i in range(100)]),
+                            lambda db, day, msgs: db.enqueue_digest(day, msgs))],
+
+        'get_setting': [('get_setting', None, no_args, lambda db: db.get_setting('telegram_token'))],
+        'set_setting': [('set_setting', None, lambda db, ctx: (ctx.unique('v'),), lambda db, v: db.set_setting('bench', v))],
+        'cache_stats': [('cache_stats', None, no_args, lambda db: db.cache_stats())],
+
+        'last_change_seq': [('last_change_seq', None, no_args, lambda db: db.last_change_seq())],
+        'changes_since': [('changes_since[100]', None, lambda db, ctx: (max(0, db.last_change_seq() - 100),), lambda db, seq: db.changes_since(seq))],
+        'subscribe': [('subscribe', None, no_args, lambda db: db.subscribe(lambda changes: None)())],
+        'poll_changes': [('poll_changes[100]', None, lambda db, ctx: (max(0, db.last_change_seq() - 100),),
+                          lambda db, seq: (db.subscribe(lambda changes: None, since=seq), db.poll_changes())[0]())],
+        'prune_changes': [('prune_changes', 2, no_args, lambda db: db.prune_changes(1000))],
+    }
+
+
+def public_methods():
+    return sorted(n for n, _ in inspect.getmembers(Database, inspect.isfunction) if not n.startswith('_'))
+
+
+def uncovered():
+    ops = _ops()
+    return [m for m in public_methods() if m not in ops and m not in SKIPPED]
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    ms = [s * 1000 for s in samples]
+    return {'n': len(ms), 'min_ms': ms[0], 'median_ms': statistics.median(ms), 'mean_ms': statistics.fmean(ms),
+            'p95_ms': ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))], 'max_ms': ms[-1]}
+
+
+def run_scale(scale, seed=datagen.DEFAULT_SEED, repeat=DEFAULT_REPEAT, data_dir=None, only=None, log=print):
+    # generates (or reuses from data_dir) the dataset, times every op on a scratch copy
+    workdir = tempfile.mkdtemp(prefix=f'bench-{scale}-')
+    try:
+        template = os.path.join(data_dir or workdir, f'bench_{scale}_{seed}.db')
+        t0 = time.perf_counter()
+        if data_dir and os.path.exists(template):
+            counts = datagen.sizes(scale)
+            generate_s = None
+        else:
+            counts = datagen.generate(template, scale, seed)
+            generate_s = time.perf_counter() - t0
+        path = os.path.join(workdir, 'bench.db')
+        shutil.copyfile(template, path)
+        db = Database(path)
+        ctx = Context(db, workdir, seed)
+        results = {}
+        try:
+            for method, variants in _ops().items():
+                if only and method not in only:
+                    continue
+                for label, n, setup, run in variants:
+                    samples = []
+                    for i in range((n or repeat) + 1):
+                        args = setup(db, ctx)
+                        t = time.perf_counter()
+                        run(db, *args)
+                        if i:  # the first call warms caches and is not counted
+                            samples.append(time.perf_counter() - t)
+                    results[label] = dict(_stats(samples), method=method)
+                    log(f"  {scale:>6} {label:<32} median {results[label]['median_ms']:9.3f} ms  p95 {results[label]['p95_ms']:9.3f} ms")
+        finally:
+            db.close()
+        return {'seed': seed, 'sizes': counts, 'generate_s': generate_s, 'ops': results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(scales, seed=datagen.DEFAULT_SEED, repeat=DEFAULT_REPEAT, data_dir=None, only=None, log=print):
+    return {
+        'meta': {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(), 'cpus': os.cpu_count(), 'repeat': repeat},
+        'skipped': SKIPPED,
+        'not_benchmarked': uncovered(),
+        'scales': {scale: run_scale(scale, seed, repeat, data_dir, only, log) for scale in scales},
+    }
+
+
+def compare(old, new, ratio=REGRESSION_RATIO, min_ms=REGRESSION_MIN_MS):
+    # [(scale, label, old_median_ms, new_median_ms)] for ops that got slower than ratio
+    regressions = []
+    for scale, res in new['scales'].items():
+        before = old.get('scales', {}).get(scale, {}).get('ops', {})
+        for label, stats in res['ops'].items():
+            if label not in before:
+                continue
+            a, b = before[label]['median_ms'], stats['median_ms']
+            if b > a * ratio and b - a > min_ms:
+                regressions.append((scale, label, a, b))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Database benchmark')
+    parser.add_argument('--scales', nargs='+', default=['tiny', 'small'], choices=datagen.SCALES)
+    parser.add_argument('--seed', type=int, default=datagen.DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--only', nargs='+', help='benchmark only these Database methods')
+    parser.add_argument('--data-dir', help='keep generated datasets here and reuse them')
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier JSON result; exit code 1 on regressions')
+    parser.add_argument('--ratio', type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args(argv)
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+    result = run(args.scales, args.seed, args.repeat, args.data_dir, args.only)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f'results written to {args.out}')
+    if result['not_benchmarked']:
+        print(f"not benchmarked: {', '.join(result['not_benchmarked'])}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), result, args.ratio)
+        for scale, label, a, b in regressions:
+            print(f'REGRESSION {scale} {label}: {a:.3f} ms -> {b:.3f} ms ({b / a:.2f}x)')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
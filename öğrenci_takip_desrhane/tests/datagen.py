@@ -0,0 +1,153 @@
+# Deterministic synthetic data for benchmarks. Full scale: 10k students, 2M attendance
+# rows (200 school days each), 200k exams, 50k appointments; smaller scales are fractions.
+#   python tests/datagen.py out.db --scale small
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Database, ATTENDANCE_STATUSES, TS_FORMAT  # noqa: E402
+
+SCALES = {'tiny': 0.001, 'small': 0.01, 'medium': 0.1, 'full': 1.0}
+FULL = {'students': 10000, 'teachers': 100, 'parents': 200, 'outbox': 5000}
+SCHOOL_DAYS = 200
+EXAMS_PER_STUDENT = 20
+APPOINTMENTS_PER_STUDENT = 5
+TERM_START = datetime.date(2024, 9, 2)  # a Monday
+DEFAULT_SEED = 2024
+PASSWORD = 'bench-pass'
+
+FIRST_NAMES = ('Ayşe', 'Mehmet', 'Zeynep', 'Mustafa', 'Elif', 'Ahmet', 'Fatma', 'Emre', 'Şule', 'Çağan',
+               'İrem', 'Oğuz', 'Gül', 'Ümit', 'Büşra', 'Kaan', 'Ece', 'Burak', 'Merve', 'Yusuf')
+LAST_NAMES = ('Yılmaz', 'Kaya', 'Demir', 'Şahin', 'Çelik', 'Yıldız', 'Öztürk', 'Aydın', 'Özdemir', 'Arslan',
+              'Doğan', 'Kılıç', 'Aslan', 'Çetin', 'Kara', 'Koç', 'Kurt', 'Özkan', 'Şimşek', 'Polat')
+CLASSES = tuple(f'{grade}-{section}' for grade in (9, 10, 11, 12) for section in 'ABCDEFGH')
+
+
+def make_tc(rng):
+    d = [rng.randint(1, 9)] + [rng.randint(0, 9) for _ in range(8)]
+    d.append(((d[0] + d[2] + d[4] + d[6] + d[8]) * 7 - (d[1] + d[3] + d[5] + d[7])) % 10)
+    d.append(sum(d) % 10)
+    return ''.join(map(str, d))
+
+
+def school_days(n=SCHOOL_DAYS):
+    day, days = TERM_START, []
+    while len(days) < n:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def sizes(scale):
+    factor = SCALES.get(scale, scale)
+    n = {k: max(2, int(v * factor)) for k, v in FULL.items()}
+    n['attendance'] = n['students'] * SCHOOL_DAYS
+    n['exams'] = n['students'] * EXAMS_PER_STUDENT
+    n['appointments'] = n['students'] * APPOINTMENTS_PER_STUDENT
+    return n
+
+
+def generate(path, scale='small', seed=DEFAULT_SEED, password_iterations=None):
+    # builds a fresh database at `path`; same (scale, seed) -> same rows.
+    # Returns the row counts.
+    if os.path.exists(path):
+        os.remove(path)
+    n = sizes(scale)
+    rng = random.Random(seed)
+    days = school_days()
+    db = Database(path, password_iterations=password_iterations)
+    try:
+        users = [(f'ogretmen{i}', PASSWORD, 'teacher') for i in range(1, n['teachers'] + 1)]
+        users += [(f'veli{i}', PASSWORD, 'parent') for i in range(1, n['parents'] + 1)]
+        db.create_users_bulk(users)
+        cur = db.conn.execute("SELECT id FROM users WHERE role='teacher' ORDER BY id")
+        teacher_ids = [r[0] for r in cur.fetchall()]
+
+        tcs = set()
+        while len(tcs) < n['students']:
+            tcs.add(make_tc(rng))
+        students = [{'tc': tc, 'name': rng.choice(FIRST_NAMES), 'surname': rng.choice(LAST_NAMES),
+                     'class_name': CLASSES[i % len(CLASSES)], 'parent_chat_id': str(100000 + i)}
+                    for i, tc in enumerate(sorted(tcs))]
+        db.upsert_students(students)
+        student_ids = [r[0] for r in db.conn.execute('SELECT id FROM students ORDER BY id').fetchall()]
+
+        with db._write() as cur:
+            for day in days:
+                ts = f'{day.isoformat()}T08:{rng.randint(30, 59):02d}:00'
+                cur.executemany('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)',
+                                ((sid, rng.choices(ATTENDANCE_STATUSES, (85, 7, 6, 2))[0], ts) for sid in student_ids))
+            exam_days = days[::SCHOOL_DAYS // EXAMS_PER_STUDENT][:EXAMS_PER_STUDENT]
+            for i, day in enumerate(exam_days, start=1):
+                cur.executemany('INSERT INTO exams (student_id,name,score,ts) VALUES (?,?,?,?)',
+                                ((sid, f'Deneme-{i:02d}', min(100, max(0, int(rng.gauss(62, 15)))), f'{day.isoformat()}T10:00:00')
+                                 for sid in student_ids))
+
+            # teachers are available 09:00-17:00 on school days; appointments are 15-minute
+            # slots inside those windows, never overlapping and at most 3 per student per week
+            cur.executemany('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUES (?,?,?)',
+                            ((t, f'{day.isoformat()}T09:00:00', f'{day.isoformat()}T17:00:00') for t in teacher_ids for day in days))
+            slots_per_day = 32
+            picked = sorted(rng.sample(range(len(teacher_ids) * len(days) * slots_per_day), n['appointments']))
+            per_week = {}
+            rows = []
+            for i, slot in enumerate(picked):
+                t, rest = divmod(slot, len(days) * slots_per_day)
+                d, s = divmod(rest, slots_per_day)
+                start = datetime.datetime.combine(days[d], datetime.time(9)) + datetime.timedelta(minutes=15 * s)
+                week = days[d].isocalendar()[:2]
+                sid = student_ids[i % len(student_ids)]
+                while per_week.get((sid, week), 0) >= 3:
+                    i += 1
+                    sid = student_ids[i % len(student_ids)]
+                per_week[(sid, week)] = per_week.get((sid, week), 0) + 1
+                rows.append((sid, teacher_ids[t], start.strftime(TS_FORMAT), 15))
+            cur.executemany('INSERT INTO appointments (student_id,teacher_id,start_ts,duration_min) VALUES (?,?,?,?)', rows)
+            cur.executemany('INSERT INTO outbox (chat_id,text,created_ts) VALUES (?,?,?)',
+                            ((str(100000 + i % n['students']), f'Deneme mesajı {i}', f'{TERM_START.isoformat()}T08:00:00')
+                             for i in range(n['outbox'])))
+        db.rebuild_exam_stats()
+    finally:
+        db.close()
+    return n
+
+
+def fingerprint(path):
+    # digest of the generated rows; password hashes and salts are random by design and left out
+    queries = ('SELECT username, role FROM users ORDER BY id',
+               'SELECT * FROM students ORDER BY id',
+               'SELECT * FROM attendance ORDER BY id',
+               'SELECT * FROM exams ORDER BY id',
+               'SELECT * FROM teacher_availability ORDER BY id',
+               'SELECT * FROM appointments ORDER BY id',
+               'SELECT chat_id, text, created_ts FROM outbox ORDER BY id')
+    h = hashlib.sha256()
+    db = Database(path)
+    try:
+        for q in queries:
+            for row in db.conn.execute(q):
+                h.update(repr(tuple(row)).encode())
+    finally:
+        db.close()
+    return h.hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='deterministic benchmark data')
+    parser.add_argument('path')
+    parser.add_argument('--scale', default='small', choices=SCALES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+    t0 = time.perf_counter()
+    counts = generate(args.path, args.scale, args.seed)
+    print(f'{args.path}: {counts} ({time.perf_counter() - t0:.1f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeTelegram:
+    # local stand-in for api.telegram.org: records sendMessage calls and can
+    # fail the first N calls with a given status code. Incoming messages queued with
+    # push() are served by getUpdates; replies to them record their latency.
+    def __init__(self, fail_first=0, fail_status=500, retry_after=None, max_poll_s=0.5):
+        self.sent = []
+        self.calls = 0
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.max_poll_s = max_poll_s
+        self.lock = threading.Lock()
+        self.updates = []
+        self.pushed_at = {}
+        self.latencies = []
+        self.replies = []
+        self.new_update = threading.Condition(self.lock)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # answer in one segment: headers+body buffered, no Nagle delay on keep-alive
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = {k: v[0] for k, v in urllib.parse.parse_qs(body).items()}
+                status, payload = fake.handle(self.path.rsplit('/', 1)[-1], params)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def push(self, chat_id, text):
+        # a parent's message; its message_id is the update_id
+        with self.lock:
+            update_id = len(self.updates) + 1
+            self.updates.append({'update_id': update_id, 'message': {
+                'message_id': update_id, 'chat': {'id': chat_id, 'type': 'private'}, 'text': text}})
+            self.pushed_at[update_id] = time.perf_counter()
+            self.new_update.notify_all()
+        return update_id
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), self.max_poll_s)
+        with self.lock:
+            while True:
+                # update_id n is at index n-1
+                batch = self.updates[max(offset - 1, 0):max(offset - 1, 0) + limit]
+                remaining = deadline - time.monotonic()
+                if batch or remaining <= 0:
+                    return 200, {'ok': True, 'result': batch}
+                self.new_update.wait(remaining)
+
+    def handle(self, method, params):
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method != 'sendMessage':
+            return 404, {'ok': False, 'description': 'Not Found'}
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.fail_first:
+                payload = {'ok': False, 'error_code': self.fail_status}
+                if self.retry_after is not None:
+                    payload['parameters'] = {'retry_after': self.retry_after}
+                return self.fail_status, payload
+            self.sent.append((params.get('chat_id'), params.get('text')))
+            pushed = self.pushed_at.pop(params.get('reply_to_message_id'), None)
+            if pushed is not None:
+                self.replies.append((params.get('chat_id'), params.get('reply_to_message_id')))
+                self.latencies.append(time.perf_counter() - pushed)
+        return 200, {'ok': True, 'result': {'message_id': self.calls}}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
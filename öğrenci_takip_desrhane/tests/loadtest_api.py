@@ -0,0 +1,135 @@
+# Load test for the API server: starts `manage.py serve` on a generated database
+# (tests/datagen.py) and runs concurrent RemoteDatabase clients against it, one
+# keep-alive connection each, with a front-desk mix of reads and attendance writes.
+#   python tests/loadtest_api.py --clients 50 --requests 200 --scale small
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import datagen  # noqa: E402
+from api_client import RemoteDatabase  # noqa: E402
+
+DEFAULT_CLIENTS = 50
+DEFAULT_REQUESTS = 200
+SERVER_START_TIMEOUT_S = 15
+# (label, weight, call(db, rng, ctx))
+MIX = (
+    ('get_student', 40, lambda db, rng, ctx: db.get_student(rng.choice(ctx['students']))),
+    ('list_attendance', 20, lambda db, rng, ctx: db.list_attendance(limit=20)),
+    ('search_students', 20, lambda db, rng, ctx: db.search_students(rng.choice(datagen.LAST_NAMES)[:3])),
+    ('student_exam_summary', 5, lambda db, rng, ctx: db.student_exam_summary(rng.choice(ctx['students']))),
+    ('add_attendance', 15, lambda db, rng, ctx: db.add_attendance(rng.choice(ctx['students']), 'Gelen')),
+)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path, port, token=None):
+    cmd = [sys.executable, os.path.join(ROOT, 'manage.py'), '--db', db_path, '--log', '', 'serve', '--port', str(port)]
+    if token:
+        cmd += ['--token', token]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+    while True:
+        try:
+            RemoteDatabase(f'http://127.0.0.1:{port}', token=token).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError(f'API server did not start: {proc.stderr.read().decode(errors="replace")}')
+            time.sleep(0.1)
+
+
+def _client(url, n, seed, ctx, barrier, out):
+    rng = random.Random(seed)
+    labels = [m[0] for m in MIX]
+    weights = [m[1] for m in MIX]
+    calls = {m[0]: m[2] for m in MIX}
+    db = RemoteDatabase(url)
+    timings = {label: [] for label in labels}
+    errors = 0
+    barrier.wait()
+    for label in rng.choices(labels, weights, k=n):
+        t0 = time.perf_counter()
+        try:
+            calls[label](db, rng, ctx)
+        except Exception:
+            errors += 1
+        timings[label].append(time.perf_counter() - t0)
+    db.close()
+    out.append((timings, errors))
+
+
+def run(db_path, clients=DEFAULT_CLIENTS, requests=DEFAULT_REQUESTS, seed=datagen.DEFAULT_SEED):
+    port = _free_port()
+    url = f'http://127.0.0.1:{port}'
+    proc = start_server(db_path, port)
+    try:
+        probe = RemoteDatabase(url)
+        ctx = {'students': [s['id'] for s in probe.list_students(limit=5000)]}
+        probe.close()
+        barrier = threading.Barrier(clients + 1)
+        out = []
+        threads = [threading.Thread(target=_client, args=(url, requests, f'{seed}-{i}', ctx, barrier, out)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        proc.terminate()
+        proc.wait()
+    per_op = {}
+    for timings, _ in out:
+        for label, samples in timings.items():
+            per_op.setdefault(label, []).extend(samples)
+    total = sum(len(s) for s in per_op.values())
+    ops = {}
+    for label, samples in per_op.items():
+        if samples:
+            ms = sorted(s * 1000 for s in samples)
+            ops[label] = {'n': len(ms), 'median_ms': statistics.median(ms), 'p95_ms': ms[int(0.95 * (len(ms) - 1))], 'max_ms': ms[-1]}
+    return {'clients': clients, 'requests': total, 'errors': sum(e for _, e in out), 'elapsed_s': elapsed,
+            'requests_per_sec': total / elapsed, 'ops': ops}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='API server load test')
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='requests per client')
+    parser.add_argument('--scale', default='small', choices=datagen.SCALES)
+    parser.add_argument('--seed', type=int, default=datagen.DEFAULT_SEED)
+    parser.add_argument('--db', help='existing database to serve (default: generate one)')
+    args = parser.parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='smartdershane-load-')
+    db_path = args.db
+    if not db_path:
+        db_path = os.path.join(workdir, f'{args.scale}.db')
+        datagen.generate(db_path, args.scale, args.seed)
+    result = run(db_path, args.clients, args.requests, args.seed)
+    print(f"{result['clients']} clients, {result['requests']} requests, {result['errors']} errors, "
+          f"{result['elapsed_s']:.2f} s: {result['requests_per_sec']:.0f} requests/s")
+    for label, st in sorted(result['ops'].items()):
+        print(f"  {label:<22} n={st['n']:<6} median {st['median_ms']:8.2f} ms  p95 {st['p95_ms']:8.2f} ms  max {st['max_ms']:8.2f} ms")
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
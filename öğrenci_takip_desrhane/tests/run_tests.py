@@ -48,12 +48,12 @@ today = datetime.now()
 base = today - timedelta(days=today.weekday()) + timedelta(hours=9)
 for i in range(3):
     ts = (base + timedelta(days=i)).isoformat()
-    ok,err = db.add_appointment(sid, 1, ts, duration_min=15)
+    ok,err,_ = db.add_appointment(sid, 1, ts, duration_min=15)
     print('Add appt', i, ok, err)
     assert ok, f'Failed to add appointment {i} : {err}'
 # fourth should fail
 ts = (base + timedelta(days=4)).isoformat()
-ok,err = db.add_appointment(sid,1,ts, duration_min=15)
+ok,err,_ = db.add_appointment(sid,1,ts, duration_min=15)
 print('Add appt 4', ok, err)
 assert not ok, 'Fourth appointment should be rejected'
 
@@ -69,12 +69,12 @@ cur.execute('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUE
 db.conn.commit()
 # try appointment outside slot
 outside = (start - timedelta(hours=3)).isoformat()
-ok,err = db.add_appointment(sid,1,outside, duration_min=15)
+ok,err,_ = db.add_appointment(sid,1,outside, duration_min=15)
 print('Outside slot', ok, err)
 assert not ok
 # inside slot
 inside = (start + timedelta(minutes=30)).isoformat()
-ok,err = db.add_appointment(sid,1,inside, duration_min=15)
+ok,err,_ = db.add_appointment(sid,1,inside, duration_min=15)
 print('Inside slot', ok, err)
 assert ok
 
@@ -0,0 +1,138 @@
+import os
+import random
+import sqlite3
+import threading
+import pytest
+import datagen
+import loadtest_api
+from api_client import RemoteDatabase, RemoteError
+from api_server import ApiServer, ALLOWED_METHODS, WRITE_METHODS, exposed_methods
+from database import Database
+
+
+@pytest.fixture
+def served(tmp_path):
+    db = Database(str(tmp_path / "api.db"), password_iterations=1000)
+    server = ApiServer(db, port=0, token='anahtar')
+    port = server.start_background()
+    client = RemoteDatabase(f'http://127.0.0.1:{port}', token='anahtar')
+    yield server, client
+    client.close()
+    server.stop()
+    db.close()
+
+
+def test_remote_database_round_trip(served):
+    server, db = served
+    db.add_student('Ali', 'Veli', '10000000146', class_name='9-A')
+    sid = db.list_students()[0]['id']
+    assert db.get_student(sid)['surname'] == 'Veli'
+    assert db.search_students('ali')[0]['id'] == sid
+    # server-side exceptions keep their type
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_student('Ali', 'Tekrar', '10000000146')
+    with pytest.raises(ValueError):
+        list(db.attendance_monthly('2024-01-01', '2025-01-01', by='şube'))
+    db.add_attendance(sid, 'Gelen')
+    assert db.list_attendance()[0]['status'] == 'Gelen'
+    assert len(db.attendance_monthly('2000-01-01', '2100-01-01')) == 1  # generators arrive as lists
+
+    db.create_user('ogretmen1', 'gizli', 'teacher')
+    user = db.authenticate('ogretmen1', 'gizli', 'teacher')
+    assert user['username'] == 'ogretmen1' and 'password_hash' not in user and 'salt' not in user
+    assert db.authenticate('ogretmen1', 'yanlis', 'teacher') is None
+    with pytest.raises(AttributeError):
+        db.close_connection()
+
+    # keep-alive: all of the above went over one connection
+    assert server.connections == 1 and server.requests > 10
+
+
+def test_api_rejects_missing_token(served):
+    server, _ = served
+    with pytest.raises(RemoteError) as e:
+        RemoteDatabase(f'http://127.0.0.1:{server.port}')
+    assert e.value.status == 401
+
+
+def test_writes_are_serialized_and_reads_run_in_parallel(served):
+    server, db = served
+    errors = []
+
+    def worker(i):
+        try:
+            for j in range(20):
+                db.add_student('Ad', f'Soyad{i}', datagen.make_tc(random.Random(f'{i}-{j}')))
+                db.count_students()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert db.count_students() == 160
+    assert server.connections == 9  # one per client thread, plus the main thread
+
+
+def test_allowed_methods_are_database_methods():
+    assert WRITE_METHODS <= set(exposed_methods())
+    assert all(callable(getattr(Database, name, None)) for name in ALLOWED_METHODS)
+
+
+def test_api_hides_secrets_and_admin_only_methods(served):
+    server, db = served
+    server.db.set_setting('telegram_token', 'gizli-anahtar')
+    assert db.get_setting('telegram_token') is None
+    # write-only from clients; internal settings cannot be changed at all
+    db.set_setting('telegram_token', 'yeni-anahtar')
+    assert server.db.get_setting('telegram_token') == 'yeni-anahtar'
+    for key in ('password_iterations', 'telegram_update_offset'):
+        with pytest.raises(RemoteError) as e:
+            db.set_setting(key, '1')
+        assert e.value.status == 403 and server.db.get_setting(key) is None
+    for name in ('prune_backups', 'claim_messages', 'upsert_students', 'enqueue_digest'):
+        with pytest.raises(AttributeError):
+            getattr(db, name)
+    with pytest.raises(RemoteError) as e:
+        db.call('prune_backups', 0)
+    assert e.value.status == 404
+
+
+def test_backup_retention_is_set_by_the_server(served, tmp_path):
+    server, db = served
+    server.backup_dir, server.backup_keep = str(tmp_path / 'yedek'), 2
+    for _ in range(3):
+        db.call('backup', str(tmp_path / 'istemci'), keep=1, compress=True)
+    backups = db.list_backups()
+    assert len(backups) == 2 and all(b['compressed'] for b in backups)
+    assert {os.path.dirname(b['path']) for b in backups} == {server.backup_dir}
+    assert not os.path.exists(tmp_path / 'istemci')
+
+
+def test_api_needs_token_off_loopback(tmp_path):
+    db = Database(str(tmp_path / "lan.db"), password_iterations=1000)
+    with pytest.raises(ValueError):
+        ApiServer(db, host='0.0.0.0')
+    ApiServer(db, host='0.0.0.0', token='anahtar').stop()
+    db.close()
+
+
+def test_client_closes_connections_of_finished_threads(served):
+    import gc
+    _, db = served
+    t = threading.Thread(target=db.count_students)
+    t.start()
+    t.join()
+    del t
+    gc.collect()
+    assert len(db._conns) == 1  # only the main thread's
+
+
+def test_load_50_clients(tmp_path):
+    path = str(tmp_path / "load.db")
+    datagen.generate(path, 'tiny')
+    result = loadtest_api.run(path, clients=50, requests=20)
+    print(f"{result['requests_per_sec']:.0f} requests/s with 50 clients")
+    assert result['errors'] == 0 and result['requests'] == 1000
@@ -0,0 +1,87 @@
+import cache
+from cache import TTLCache
+from database import Database
+
+
+def test_ttl_cache_lru_ttl_and_counters(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    c = TTLCache(maxsize=2, ttl=10)
+    assert c.get('a', None) is None
+    c.put('a', 1); c.put('b', 2)
+    assert c.get('a') == 1          # 'a' is now most recent
+    c.put('c', 3)                   # evicts 'b'
+    assert c.get('b', None) is None
+    now[0] += 11
+    assert c.get('a', None) is None
+    st = c.stats()
+    assert (st['hits'], st['misses'], st['evictions'], st['expired']) == (1, 3, 1, 1)
+    assert st['size'] == 1 and st['hit_rate'] == 0.25
+
+
+def test_ttl_cache_drops_value_loaded_before_invalidate():
+    c = TTLCache(maxsize=10, ttl=60)
+
+    def load():
+        # a writer commits and invalidates while this reader still holds the old value
+        c.invalidate('k')
+        return 'old'
+
+    assert c.get_or_load('k', load) == 'old'
+    assert c.get('k', None) is None
+    assert c.get_or_load('k', lambda: 'new') == 'new'
+    assert c.get('k') == 'new'
+
+
+def test_database_caches_are_invalidated_by_writes(tmp_path):
+    db = Database(str(tmp_path / 'cache.db'), password_iterations=1000)
+    db.add_student('Ali', 'Veli', '11111111110', class_name='9-A')
+    db.add_student('Ayşe', 'Kaya', '22222222220', class_name='9-B')
+    ali, ayse = (s['id'] for s in db.list_students())
+
+    assert db.get_student(ali)['surname'] == 'Veli'
+    s = db.get_student(ali)
+    s['surname'] = 'oynandı'  # callers get copies
+    assert db.get_student(ali)['surname'] == 'Veli'
+    assert db.cache_stats()['students']['hits'] == 2
+    db.get_student(ayse)
+
+    # only the edited student is dropped
+    db.edit_student(ali, surname='Yılmaz')
+    assert db._student_cache.get(ayse, None) is not None
+    assert db.get_student(ali)['surname'] == 'Yılmaz'
+    db.upsert_students([{'tc': '22222222220', 'name': 'Ayşe', 'surname': 'Demir'}])
+    assert db.get_student(ayse)['surname'] == 'Demir'
+    db.delete_student(ali)
+    assert db.get_student(ali) is None
+    assert db.get_student(ali) is None  # misses are not cached
+
+    assert db.get_setting('telegram_token') is None
+    db.set_setting('telegram_token', 'abc')
+    assert db.get_setting('telegram_token') == 'abc'
+    assert db.get_setting('telegram_token') == 'abc'
+    assert db.cache_stats()['settings']['hits'] == 1
+
+    db.create_user('veli1', 'eski', 'parent')
+    assert db.authenticate('veli1', 'eski', 'parent') is not None
+    uid = db.authenticate('veli1', 'eski', 'parent')['id']
+    assert db.cache_stats()['users']['hits'] >= 1
+    db.change_password(uid, 'yeni')
+    assert db.authenticate('veli1', 'eski', 'parent') is None
+    assert db.authenticate('veli1', 'yeni', 'parent') is not None
+    db.delete_user(uid)
+    assert db.authenticate('veli1', 'yeni', 'parent') is None
+    db.close()
+
+
+def test_database_cache_ttl_bounds_staleness_from_other_connections(tmp_path):
+    path = str(tmp_path / 'ttl.db')
+    db = Database(path, cache_ttl=0)
+    db.add_student('Ali', 'Veli', '11111111110')
+    sid = db.list_students()[0]['id']
+    assert db.get_student(sid)['surname'] == 'Veli'
+    other = Database(path)  # e.g. manage.py in another process
+    other.edit_student(sid, surname='Başka')
+    other.close()
+    assert db.get_student(sid)['surname'] == 'Başka'
+    db.close()
@@ -0,0 +1,53 @@
+import gc
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from database import Database
+from charts import ExamChart
+
+
+def test_exam_chart_reuses_figure_and_memory_stays_flat(tmp_path):
+    db = Database(str(tmp_path / "chart.db"))
+    for sid in range(1, 51):
+        for i in range(8):
+            db.add_exam(sid, f'Deneme-{i}', (sid * 7 + i * 13) % 101, ts=f'2024-01-{i + 1:02d}')
+    chart = ExamChart(db)
+    FigureCanvasAgg(chart.figure)
+    figure, line = chart.figure, chart.score_line
+
+    caption = chart.show(3)
+    assert 'sıra' in caption
+    assert list(chart.score_line.get_xdata()) == [0, 1, 2, 3, 4, 5]
+    assert [t.get_text() for t in chart.ax.get_xticklabels()] == [f'Deneme-{i}' for i in range(2, 8)]
+    assert chart.show(999) is None
+
+    # a new exam for the student invalidates its cached series
+    db.add_exam(3, 'Deneme-8', 100, ts='2024-01-09')
+    chart.show(3)
+    assert chart.score_line.get_ydata()[-1] == 100
+
+    # Tk coalesces draw_idle requests; Agg would render on every call, so count the
+    # requests and render for real every 100 lookups
+    canvas = chart.figure.canvas
+    requests = []
+    canvas.draw_idle = lambda: requests.append(1)
+    for i in range(100):
+        chart.show(i % 50 + 1)
+    canvas.draw()
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    for i in range(1000):
+        chart.show(i % 50 + 1)
+        if i % 100 == 99:
+            canvas.draw()
+    gc.collect()
+    grown = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, 'filename'))
+    tracemalloc.stop()
+    assert grown < 512 * 1024, grown
+    assert len(requests) == 1100
+    assert chart.figure is figure and chart.score_line is line and len(chart.ax.lines) == 2
+    assert plt.get_fignums() == []
+    db.close()
@@ -1,4 +1,6 @@
+import os
 import datetime
+import sqlite3
 import pytest
 from database import Database
 
@@ -36,28 +38,478 @@ def test_appointments_and_availability(tmp_path):
     students = db.list_students()
     sid = students[0]['id']
 
-    # add an availability slot for teacher id 1
-    now = datetime.datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
-    start_ts = now.isoformat()
-    end_ts = (now + datetime.timedelta(hours=2)).isoformat()
+    # add availability slots (09:00-11:00, Monday to Friday) for teacher id 1
+    now = datetime.datetime(2026, 3, 2, 9, 0)
     cur = db.conn.cursor()
-    cur.execute('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUES (?,?,?)', (1, start_ts, end_ts))
+    for i in range(5):
+        start_ts = (now + datetime.timedelta(days=i)).isoformat()
+        end_ts = (now + datetime.timedelta(days=i, hours=2)).isoformat()
+        cur.execute('INSERT INTO teacher_availability (teacher_id,start_ts,end_ts) VALUES (?,?,?)', (1, start_ts, end_ts))
     db.conn.commit()
 
     # add three appointments in the same calendar week -> allowed
     for i in range(3):
         appt_time = (now + datetime.timedelta(days=i)).isoformat()
-        ok, msg = db.add_appointment(sid, 1, appt_time)
+        ok, msg, reason = db.add_appointment(sid, 1, appt_time)
         assert ok, f"Appointment {i} should be added: {msg}"
 
     # fourth in same week -> rejected
     appt_time = (now + datetime.timedelta(days=4)).isoformat()
-    ok, msg = db.add_appointment(sid, 1, appt_time)
-    assert not ok
+    ok, msg, reason = db.add_appointment(sid, 1, appt_time)
+    assert not ok and reason == 'weekly_limit'
 
     # appointment outside defined availability -> rejected
     outside = (now - datetime.timedelta(days=1)).isoformat()
-    ok2, msg2 = db.add_appointment(sid, 1, outside)
-    assert not ok2
+    ok2, msg2, reason2 = db.add_appointment(sid, 1, outside)
+    assert not ok2 and reason2 == 'unavailable'
 
     db.close()
+
+
+def test_bulk_attendance_single_transaction(tmp_path):
+    db = Database(str(tmp_path / "bulk.db"))
+    for i in range(5):
+        db.add_student(f'Ogr{i}', 'Test', f'1000000000{i}', class_name='9-A')
+    db.add_student('Diger', 'Sinif', '20000000000', class_name='10-B')
+    assert db.list_classes() == ['10-B', '9-A']
+    roster = db.list_students(class_name='9-A')
+    assert len(roster) == 5
+    # paging within a class follows the roster order
+    page1 = db.list_students(class_name='9-A', limit=2)
+    page2 = db.list_students(class_name='9-A', after_id=page1[-1]['id'], limit=2)
+    page3 = db.list_students(class_name='9-A', after_id=page2[-1]['id'], limit=2)
+    assert page1 + page2 + page3 == roster and len(page3) == 1
+
+    records = [(s['id'], 'Gelen') for s in roster]
+    records[0] = (roster[0]['id'], 'Gelmedi')
+    ids = db.add_attendance_bulk(records)
+    assert len(ids) == 5 and ids == sorted(ids)
+    cur = db.conn.cursor()
+    cur.execute('SELECT student_id, status FROM attendance WHERE id IN (%s) ORDER BY id' % ','.join('?' * len(ids)), ids)
+    assert [tuple(r) for r in cur.fetchall()] == records
+    assert db.add_attendance_bulk([]) == []
+
+    # an invalid status rejects the whole class, nothing is written
+    with pytest.raises(ValueError):
+        db.add_attendance_bulk([(roster[1]['id'], 'Gelen'), (roster[2]['id'], 'yok')])
+    cur.execute('SELECT COUNT(*) FROM attendance')
+    assert cur.fetchone()[0] == 5
+    db.close()
+
+
+def test_wal_mode_and_per_thread_readers(tmp_path):
+    import threading
+    db = Database(str(tmp_path / "wal.db"))
+    assert db.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    db.add_student('Ali', 'Veli', '12345678901')
+
+    main_reader = db._reader()
+    assert main_reader is db._reader() and main_reader is not db.conn
+    seen = {}
+
+    def worker():
+        seen['conn'] = db._reader()
+        seen['students'] = db.list_students()
+
+    t = threading.Thread(target=worker)
+    t.start(); t.join()
+    assert seen['conn'] is not main_reader
+    assert len(seen['students']) == 1
+
+    # a reader is not blocked while the writer holds an open write transaction
+    with db._write(immediate=True) as cur:
+        cur.execute("INSERT INTO students (name,surname,tc) VALUES ('Ayse','Kaya','98765432100')")
+        t = threading.Thread(target=worker)
+        t.start(); t.join(timeout=5)
+        assert not t.is_alive()
+        assert len(seen['students']) == 1
+    assert len(db.list_students()) == 2
+    db.close()
+
+
+def test_schema_migrations_and_indexes(tmp_path):
+    import sqlite3
+    from database import SCHEMA_VERSION
+    path = str(tmp_path / "legacy.db")
+    # database created by an old release: no user_version, no hash columns
+    legacy = sqlite3.connect(path)
+    legacy.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT)')
+    legacy.execute("INSERT INTO users (username,password,role) VALUES ('eski','pw','teacher')")
+    legacy.execute('CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT, surname TEXT, tc TEXT, parent_chat_id TEXT)')
+    legacy.commit(); legacy.close()
+
+    db = Database(path)
+    assert db.conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    cols = [r[1] for r in db.conn.execute('PRAGMA table_info(users)')]
+    assert 'password_hash' in cols and 'salt' in cols
+    assert db.authenticate('eski', 'pw', 'teacher') is not None
+    indexes = {r[0] for r in db.conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'idx_attendance_student_ts', 'idx_exams_student_ts', 'idx_appointments_teacher_start',
+            'idx_availability_teacher_start', 'ux_students_tc'} <= indexes
+    plan = ' '.join(r[3] for r in db.conn.execute('EXPLAIN QUERY PLAN SELECT * FROM attendance WHERE student_id=? ORDER BY ts', (1,)))
+    assert 'idx_attendance_student_ts' in plan
+
+    # same TC twice is rejected, empty TC is allowed many times
+    db.add_student('Ali', 'Veli', '12345678901')
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_student('Ali', 'Tekrar', '12345678901')
+    db.add_student('A', 'B', '')
+    db.add_student('C', 'D', '')
+    db.close()
+
+
+def test_duplicate_tcs_postpone_unique_index_until_resolved(tmp_path, caplog):
+    import sqlite3
+    path = str(tmp_path / "dups.db")
+    legacy = sqlite3.connect(path)
+    legacy.execute('CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT, surname TEXT, tc TEXT, parent_chat_id TEXT)')
+    legacy.executemany('INSERT INTO students (name,surname,tc) VALUES (?,?,?)',
+                       [('Ali', 'Veli', '12345678901'), ('Ali', 'Veli', '12345678901'), ('Can', 'Kaya', '')])
+    legacy.commit(); legacy.close()
+
+    with caplog.at_level('WARNING', logger='database'):
+        db = Database(path)
+    assert '12345678901' in caplog.text
+    indexes = {r[0] for r in db.conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert 'idx_students_tc' in indexes and 'ux_students_tc' not in indexes
+    db.delete_student(db.list_students()[1]['id'])
+    db.close()
+
+    # the next start sees the duplicates gone and creates the unique index
+    db = Database(path)
+    indexes = {r[0] for r in db.conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert 'ux_students_tc' in indexes and 'idx_students_tc' not in indexes
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_student('Ali', 'Tekrar', '12345678901')
+    db.close()
+
+
+def test_weekly_limit_range_query_and_concurrency(tmp_path):
+    import threading
+    path = str(tmp_path / "week.db")
+    db = Database(path)
+    db.add_student('Deniz', 'Kaya', '98765432100')
+    sid = db.list_students()[0]['id']
+    monday = datetime.datetime(2026, 3, 2, 10, 0)
+
+    # stored in the sortable form, microseconds and 'HH:MM' inputs normalized
+    ok, err, _ = db.add_appointment(sid, 1, '2026-03-01T23:59')  # previous week (Sunday)
+    assert ok, err
+    ok, err, _ = db.add_appointment(sid, 1, (monday + datetime.timedelta(microseconds=5)).isoformat())
+    assert ok, err
+    assert [a['start_ts'] for a in db.list_appointments(sid)] == ['2026-03-02T10:00:00', '2026-03-01T23:59:00']
+    plan = ' '.join(r[3] for r in db.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM appointments WHERE student_id=? AND start_ts >= ? AND start_ts < ?', (sid, 'a', 'b')))
+    assert 'idx_appointments_student_start' in plan
+
+    # two clients race for the two remaining slots of the week: exactly two win
+    other = Database(path)
+    results = []
+    def book(conn_db, day):
+        results.append(conn_db.add_appointment(sid, 1, (monday + datetime.timedelta(days=day)).isoformat())[0])
+    threads = [threading.Thread(target=book, args=(d, i + 1)) for i, d in enumerate([db, other, db, other])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 2
+    ok, err, _ = db.add_appointment(sid, 1, (monday + datetime.timedelta(days=7)).isoformat())  # next week
+    assert ok, err
+    other.close()
+    db.close()
+
+
+def test_teacher_double_booking_and_interval_index(tmp_path):
+    db = Database(str(tmp_path / "sched.db"))
+    for i in range(3):
+        db.add_student(f'Ogr{i}', 'Test', f'3000000000{i}')
+    s1, s2, s3 = [s['id'] for s in db.list_students()]
+    day = datetime.datetime(2026, 3, 3)
+    av1 = db.add_availability(7, day.replace(hour=9), day.replace(hour=10))
+    db.add_availability(7, day.replace(hour=10), day.replace(hour=12))  # touching windows merge
+
+    ok, err, reason = db.add_appointment(s1, 7, day.replace(hour=9, minute=50).isoformat(), duration_min=20)
+    assert ok, err
+    # overlaps the 09:50-10:10 booking
+    ok, err, reason = db.add_appointment(s2, 7, day.replace(hour=10).isoformat())
+    assert not ok and reason == 'teacher_busy'
+    ok, err, reason = db.add_appointment(s2, 7, day.replace(hour=10, minute=10).isoformat())
+    assert ok, err
+    ok, err, reason = db.add_appointment(s3, 7, day.replace(hour=11, minute=50).isoformat(), duration_min=30)
+    assert not ok and reason == 'unavailable'
+
+    # deleting a booking frees the slot, deleting availability closes it
+    first = [a for a in db.list_appointments(s1)][0]
+    db.delete_appointment(first['id'])
+    ok, err, reason = db.add_appointment(s3, 7, day.replace(hour=9, minute=55).isoformat())
+    assert ok, err
+    db.delete_availability(av1)
+    ok, err, reason = db.add_appointment(s1, 7, day.replace(hour=9, minute=0).isoformat())
+    assert not ok and reason == 'unavailable'
+
+    # a booking made by another client is seen (index rebuilt on data_version change)
+    other = Database(db.path)
+    ok, err, reason = other.add_appointment(s1, 7, day.replace(hour=11).isoformat())
+    assert ok, err
+    ok, err, reason = db.add_appointment(s2, 7, day.replace(hour=11, minute=5).isoformat())
+    assert not ok and reason == 'teacher_busy'
+    other.close()
+    db.close()
+
+
+def test_find_free_slots_across_teachers_and_weekly_quota(tmp_path):
+    db = Database(str(tmp_path / "slots.db"))
+    db.add_student('Deniz', 'Kaya', '98765432100')
+    sid = db.list_students()[0]['id']
+    monday = datetime.datetime(2026, 3, 2)
+    db.add_availability(1, monday.replace(hour=9), monday.replace(hour=10))
+    db.add_availability(2, monday.replace(hour=9, minute=30), monday.replace(hour=10))
+    ok, err, _ = db.add_appointment(sid, 1, monday.replace(hour=9))
+    assert ok, err
+    slots = db.find_free_slots(monday, monday + datetime.timedelta(days=1), limit=4)
+    # both teachers' sweeps merged in time order
+    assert [(s['start_ts'][11:16], s['teacher_id']) for s in slots] == [('09:15', 1), ('09:30', 1), ('09:30', 2), ('09:45', 1)]
+    assert db.find_free_slots(monday, monday + datetime.timedelta(days=1), teacher_id=2, limit=10)[-1]['end_ts'] == '2026-03-02T10:00:00'
+    # every listed slot is accepted by add_appointment
+    ok, err, _ = db.add_appointment(sid, slots[2]['teacher_id'], slots[2]['start_ts'])
+    assert ok, err
+
+    # a third appointment fills the week: the student is offered next week's slots only
+    db.add_availability(1, monday.replace(day=9, hour=9), monday.replace(day=9, hour=9, minute=30))
+    ok, err, _ = db.add_appointment(sid, 1, monday.replace(hour=9, minute=45))
+    assert ok, err
+    slots = db.find_free_slots(monday, monday + datetime.timedelta(days=14), student_id=sid)
+    assert [s['start_ts'] for s in slots] == ['2026-03-09T09:00:00', '2026-03-09T09:15:00']
+    assert len(db.find_free_slots(monday, monday + datetime.timedelta(days=14))) == 5
+    db.close()
+
+
+def test_online_backup_with_concurrent_writes_and_retention(tmp_path):
+    import gzip
+    import sqlite3
+    db = Database(str(tmp_path / "live.db"))
+    db.add_student('Ali', 'Veli', '12345678901')
+    sid = db.list_students()[0]['id']
+    db.add_attendance_bulk([(sid, 'Gelen')] * 2000)
+    steps = []
+
+    def progress(done, total):
+        steps.append((done, total))
+        # the app keeps writing while the copy is in progress
+        db.add_attendance(sid, 'Geç Kaldı')
+
+    dest = db.backup(dest_dir=str(tmp_path / "bk"), pages=2, progress=progress)
+    assert len(steps) > 3 and steps[-1][0] == steps[-1][1]
+    copy = sqlite3.connect(dest)
+    # the copy is the snapshot taken when the backup started
+    assert copy.execute('SELECT COUNT(*) FROM attendance').fetchone()[0] == 2000
+    copy.close()
+    cur = db.conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM attendance')
+    assert cur.fetchone()[0] == 2000 + len(steps)
+
+    # compressed copies in the background, retention keeps the newest two
+    done = []
+    for _ in range(3):
+        db.start_backup(callback=lambda d, e: done.append((d, e)), dest_dir=str(tmp_path / "bk"), compress=True, keep=2).join()
+    assert all(e is None for _, e in done)
+    backups = db.list_backups()
+    assert len(backups) == 2 and all(b['path'].endswith('.gz') and b['verified'] for b in backups)
+    assert not os.path.exists(dest)
+    with gzip.open(backups[0]['path'], 'rb') as f:
+        assert f.read(16) == b'SQLite format 3\x00'
+    db.close()
+
+
+def test_keyset_pagination(tmp_path):
+    db = Database(str(tmp_path / "pages.db"))
+    with db._write() as cur:
+        cur.executemany('INSERT INTO students (name,surname,tc) VALUES (?,?,?)',
+                        [(f'Ad{i}', f'Soyad{i}', str(10000000000 + i)) for i in range(250)])
+    pages, after = [], None
+    while True:
+        page = db.list_students(after_id=after, limit=100)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]['id']
+    assert [len(p) for p in pages] == [100, 100, 50]
+    ids = [s['id'] for p in pages for s in p]
+    assert ids == sorted(ids) and len(set(ids)) == db.count_students() == 250
+    assert len(db.list_students()) == 250
+
+    sid = ids[0]
+    db.add_attendance_bulk([(sid, 'Gelen')] * 30)
+    first = db.list_attendance(limit=20)
+    rest = db.list_attendance(before_id=first[-1]['id'], limit=20)
+    assert len(first) == 20 and len(rest) == 10 and first[0]['name'] == 'Ad0'
+    assert first[0]['id'] > first[-1]['id'] > rest[0]['id']
+    assert [u['username'] for u in db.list_users(limit=1)] == ['admin'] and db.count_users() == 1
+    db.close()
+
+
+def test_student_search_turkish_folding(tmp_path):
+    import time
+    from database import tr_fold
+    assert tr_fold('İSMAİL IŞIK') == tr_fold('ismail ışık') == 'ismail isik'
+    db = Database(str(tmp_path / "search.db"))
+    db.add_student('İsmail', 'Işık', '12345678901')
+    db.add_student('Ilgaz', 'Şahin', '98765432100')
+    db.add_student('Şükrü', 'Çağlar', '11122233344')
+    db.add_student('Alişan', 'Öztürk', '55566677788')
+    db.add_student('Ali', 'Ünal', '55500000000')
+
+    def names(q):
+        return [s['name'] for s in db.search_students(q)]
+    assert names('ISMAIL') == ['İsmail'] and names('ismail ışı') == ['İsmail']
+    assert names('ılgaz') == ['Ilgaz'] and names('ILG') == ['Ilgaz']
+    assert names('sukru caglar') == ['Şükrü'] and names('ŞÜKRÜ') == ['Şükrü']
+    assert names('5556') == ['Alişan']
+    assert names('ali') == ['Ali', 'Alişan']  # whole word before prefix
+    assert names('') == [] and names('zzz') == []
+
+    # triggers keep the index in sync
+    sid = db.search_students('ilgaz')[0]['id']
+    db.edit_student(sid, name='Işıl')
+    assert names('ilgaz') == [] and names('ISIL') == ['Işıl']
+    db.delete_student(sid)
+    assert names('isil') == []
+
+    # another SQLite client can write students: the triggers need no Python function
+    plain = sqlite3.connect(db.path)
+    plain.execute("INSERT INTO students (name,surname,tc) VALUES ('Zeynep','Dogan','30000000000')")
+    plain.commit(); plain.close()
+    assert names('zeynep') == ['Zeynep']
+
+    db.upsert_students([{'name': f'Mehmet{i % 50}', 'surname': 'Yılmaz', 'tc': str(20000000000 + i)} for i in range(20000)])
+    t0 = time.perf_counter()
+    for _ in range(20):
+        assert len(db.search_students('meh yıl')) == 20
+    assert (time.perf_counter() - t0) / 20 < 0.010
+    db.close()
+
+
+def test_password_cost_stored_per_user_and_upgraded_on_login(tmp_path):
+    path = str(tmp_path / "auth.db")
+    db = Database(path, password_iterations=1000)
+    db.create_user('veli1', 'gizli', 'parent')
+    row = db.conn.execute("SELECT hash_algo, hash_iterations FROM users WHERE username='veli1'").fetchone()
+    assert tuple(row) == ('sha256', 1000)
+    # legacy plain-text row is hashed with the current cost and the plain text removed
+    with db._write() as cur:
+        cur.execute("INSERT INTO users (username,password,role) VALUES ('eski','pw','teacher')")
+    assert db.authenticate('eski', 'pw', 'teacher') is not None
+    row = db.conn.execute("SELECT password, hash_iterations FROM users WHERE username='eski'").fetchone()
+    assert row['password'] is None and row['hash_iterations'] == 1000
+    db.close()
+
+    # raising the cost: old hashes still verify and are upgraded on successful login
+    db = Database(path, password_iterations=2000)
+    assert db.authenticate('veli1', 'yanlis', 'parent') is None
+    assert db.conn.execute("SELECT hash_iterations FROM users WHERE username='veli1'").fetchone()[0] == 1000
+    assert db.authenticate('veli1', 'gizli', 'parent') is not None
+    assert db.conn.execute("SELECT hash_iterations FROM users WHERE username='veli1'").fetchone()[0] == 2000
+    assert db.authenticate('veli1', 'gizli', 'parent') is not None
+    db.set_setting('password_iterations', '3000')
+    db.close()
+    db = Database(path)
+    assert db.password_iterations == 3000
+    db.close()
+
+
+def test_exam_stats_incremental_matches_rebuild(tmp_path, monkeypatch):
+    import random
+    import statistics
+    import sys
+    db = Database(str(tmp_path / "exams.db"))
+    rng = random.Random(8)
+    scores = {}
+    for sid in range(1, 41):
+        for name in ('TYT-1', 'TYT-2', 'AYT-1'):
+            score = rng.randint(20, 100)
+            db.add_exam(sid, name, score)
+            scores.setdefault(name, []).append(score)
+
+    s = db.exam_summary('TYT-1')
+    assert s['n'] == 40 and s['min'] == min(scores['TYT-1']) and s['max'] == max(scores['TYT-1'])
+    assert s['mean'] == pytest.approx(statistics.mean(scores['TYT-1']))
+    assert s['std'] == pytest.approx(statistics.pstdev(scores['TYT-1']))
+    assert db.student_exam_summary(7)['n'] == 3
+    assert db.exam_summary('yok') is None
+
+    top = max(scores['AYT-1'])
+    rank, n, pct = db.exam_rank('AYT-1', top)
+    assert rank == 1 and n == 40
+    below = sum(1 for x in scores['AYT-1'] if x < top)
+    same = scores['AYT-1'].count(top)
+    assert pct == pytest.approx(100 * (below + same / 2) / 40)
+
+    def snapshot():
+        return [sorted(tuple(r) for r in db.conn.execute(f'SELECT * FROM {t}'))
+                for t in ('exam_stats', 'student_exam_stats', 'exam_score_buckets')]
+    incremental = snapshot()
+    assert db.rebuild_exam_stats() == 3
+    assert snapshot() == incremental
+    # same result without NumPy
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    db.conn.execute('DELETE FROM exam_stats')
+    db.conn.commit()
+    db.rebuild_exam_stats()
+    assert snapshot() == incremental
+    db.close()
+
+
+def test_exam_stats_backfilled_on_upgrade(tmp_path):
+    path = str(tmp_path / "old.db")
+    db = Database(path)
+    db.close()
+    conn = sqlite3.connect(path)
+    conn.execute('DROP TABLE exam_stats')
+    conn.execute('DROP TABLE student_exam_stats')
+    conn.execute('DROP TABLE exam_score_buckets')
+    conn.executemany('INSERT INTO exams (student_id,name,score,ts) VALUES (?,?,?,?)',
+                     [(1, 'Deneme', 60, '2024-01-01'), (2, 'Deneme', 80, '2024-01-01')])
+    conn.execute('PRAGMA user_version=7')
+    conn.commit()
+    conn.close()
+    db = Database(path)
+    assert db.exam_summary('Deneme')['mean'] == 70
+    assert db.exam_rank('Deneme', 60)[:2] == (2, 2)
+    db.close()
+
+
+def test_change_feed_covers_other_clients_and_subscribers(tmp_path):
+    path = str(tmp_path / "feed.db")
+    db = Database(path)
+    start = db.last_change_seq()
+    received = []
+    unsubscribe = db.subscribe(received.extend, tables=('attendance',))
+    db.add_student('Ali', 'Veli', '10000000146')
+    sid = db.list_students()[0]['id']
+    db.add_attendance(sid, 'Gelen')
+    assert [c[1:3] for c in received] == [('attendance', 'insert')]
+    db.get_student(sid)
+
+    # a second client (another GUI, manage.py) writes the same file
+    other = Database(path)
+    other.edit_student(sid, surname='Yılmaz')
+    other.add_attendance_bulk([(sid, 'Geç Kaldı')])
+    other.close()
+    assert db.get_student(sid)['surname'] == 'Veli'  # cached, still within the TTL
+    changes = db.changes_since(start)
+    assert [c[1:] for c in changes] == [('students', 'insert', sid), ('attendance', 'insert', received[0][3]),
+                                       ('students', 'update', sid), ('attendance', 'insert', received[0][3] + 1)]
+    assert [c[0] for c in changes] == list(range(start + 1, start + 5))
+    # reading the feed drops cache entries for rows other clients changed
+    assert db.get_student(sid)['surname'] == 'Yılmaz'
+    assert db.poll_changes() == 2 and len(received) == 2
+    assert [r['status'] for r in db.list_attendance(after_id=received[0][3])] == ['Geç Kaldı']
+    unsubscribe()
+    db.add_attendance(sid, 'Gelen')
+    assert len(received) == 2
+
+    # behind the pruned part of the feed: None, reload and restart from last_change_seq
+    assert db.prune_changes(keep=1) == db.last_change_seq() - 1
+    assert db.changes_since(start) is None
+    assert db.changes_since(db.last_change_seq()) == []
+    db.close()
@@ -0,0 +1,34 @@
+import json
+import datagen
+import benchmark
+from database import Database
+
+
+def test_generator_is_deterministic(tmp_path):
+    a, b, c = (str(tmp_path / f'{n}.db') for n in 'abc')
+    counts = datagen.generate(a, 'tiny', seed=7)
+    datagen.generate(b, 'tiny', seed=7)
+    datagen.generate(c, 'tiny', seed=8)
+    assert datagen.fingerprint(a) == datagen.fingerprint(b)
+    assert datagen.fingerprint(a) != datagen.fingerprint(c)
+    db = Database(a)
+    assert db.count_students() == counts['students']
+    assert db.count_attendance() == counts['attendance'] == counts['students'] * datagen.SCHOOL_DAYS
+    assert db.exam_summary('Deneme-01')['n'] == counts['students']
+    assert db.authenticate('ogretmen1', datagen.PASSWORD, 'teacher') is not None
+    db.close()
+
+
+def test_benchmark_covers_every_public_method(tmp_path):
+    assert benchmark.uncovered() == []
+    result = benchmark.run(['tiny'], repeat=2, data_dir=str(tmp_path), log=lambda *_: None,
+                           only={'get_student', 'add_appointment', 'search_students', 'attendance_monthly'})
+    ops = json.loads(json.dumps(result))['scales']['tiny']['ops']
+    assert {'get_student', 'add_appointment', 'search_students[prefix]', 'attendance_monthly[month]'} <= set(ops)
+    assert ops['get_student']['n'] == 2 and ops['get_student']['median_ms'] > 0
+
+    slower = json.loads(json.dumps(result))
+    slower['scales']['tiny']['ops']['get_student']['median_ms'] += 10
+    assert benchmark.compare(result, slower) == [('tiny', 'get_student', ops['get_student']['median_ms'],
+                                                 ops['get_student']['median_ms'] + 10)]
+    assert benchmark.compare(slower, result) == []
@@ -0,0 +1,91 @@
+import random
+import time
+import pytest
+from database import Database
+from importer import import_students, valid_tc
+import manage
+from datagen import make_tc
+
+
+def test_valid_tc():
+    assert valid_tc('10000000146')
+    assert not valid_tc('10000000147')
+    assert not valid_tc('01234567890')
+    assert not valid_tc('1234')
+    assert not valid_tc('1000000014a')
+
+
+def test_import_50k_rows_csv(tmp_path):
+    rng = random.Random(12)
+    tcs = list(dict.fromkeys(make_tc(rng) for _ in range(50500)))[:50000]
+    path = tmp_path / 'eokul.csv'
+    lines = ['T.C. Kimlik No;Adı;Soyadı;Sınıf/Şube']
+    lines += [f'{tc};Ad{i};Soyad{i};{9 + i % 4}-{"ABC"[i % 3]}' for i, tc in enumerate(tcs)]
+    lines += ['12345678901;Hatalı;TC;9-A', f'{tcs[0]};;Eksik;9-A']
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    db = Database(str(tmp_path / 'import.db'))
+    t0 = time.perf_counter()
+    report = import_students(db, str(path))
+    assert time.perf_counter() - t0 < 20
+    assert report['rows'] == 50002
+    assert report['inserted'] == 50000 and report['updated'] == 0
+    assert [(line, reason) for line, _, reason in report['errors']] == [
+        (50002, 'geçersiz TC kimlik numarası'), (50003, 'ad/soyad eksik')]
+    assert db.count_students() == 50000
+    assert report['rows_per_sec'] > 0
+
+    # re-importing the same export updates in place instead of duplicating
+    report = import_students(db, str(path))
+    assert report['inserted'] == 0 and report['updated'] == 50000
+    assert db.count_students() == 50000
+    db.close()
+
+
+def test_import_updates_by_tc_and_keeps_missing_fields(tmp_path):
+    rng = random.Random(3)
+    a, b = make_tc(rng), make_tc(rng)
+    db = Database(str(tmp_path / 'upd.db'))
+    db.add_student('Eski', 'Ad', a, parent_chat_id='111', class_name='9-A')
+    path = tmp_path / 'liste.csv'
+    path.write_text(f'tc,ad,soyad\n{a},Yeni,Ad\n{b},Ali,Veli\n{b},Ali,Veli2\n', encoding='utf-8')
+    report = manage.main(['--db', str(tmp_path / 'upd.db'), '--log', '', 'import-students', str(path)])
+    assert report == 0
+    by_tc = {s['tc']: s for s in db.list_students()}
+    assert by_tc[a]['name'] == 'Yeni'
+    assert by_tc[a]['parent_chat_id'] == '111' and by_tc[a]['class_name'] == '9-A'
+    assert by_tc[b]['surname'] == 'Veli2'
+    assert db.count_students() == 2
+    db.close()
+
+
+def test_upsert_looks_up_tcs_on_the_unique_index(tmp_path):
+    rng = random.Random(9)
+    db = Database(str(tmp_path / 'plan.db'))
+    db.add_student('Eski', 'Ad', make_tc(rng))
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    db.upsert_students([{'tc': make_tc(rng), 'name': 'Ali', 'surname': 'Veli'} for _ in range(3)])
+    db.conn.set_trace_callback(None)
+    lookup = next(sql for sql in statements if sql.startswith('SELECT tc, id FROM students'))
+    plan = ' '.join(r[3] for r in db.conn.execute('EXPLAIN QUERY PLAN ' + lookup))
+    assert 'ux_students_tc' in plan and 'SCAN students' not in plan
+    db.close()
+
+
+def test_import_xlsx(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    rng = random.Random(5)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['TCKN', 'Adı', 'Soyadı', 'Şube'])
+    tcs = [make_tc(rng) for _ in range(20)]
+    for i, tc in enumerate(tcs):
+        ws.append([int(tc), f'Ad{i}', f'Soyad{i}', '10-B'])
+    path = tmp_path / 'liste.xlsx'
+    wb.save(path)
+    db = Database(str(tmp_path / 'x.db'))
+    report = import_students(db, str(path), chunk_size=7)
+    assert report['inserted'] == len(set(tcs)) and not report['errors']
+    assert {s['class_name'] for s in db.list_students()} == {'10-B'}
+    db.close()
@@ -0,0 +1,58 @@
+import logging
+import random
+import pytest
+from database import Database
+from instrumentation import Instrumentation, LatencyHistogram
+
+
+def test_histogram_percentiles_within_a_bucket():
+    h = LatencyHistogram()
+    rng = random.Random(1)
+    values = sorted(rng.uniform(0.05, 50) for _ in range(10000))
+    for v in values:
+        h.record(v)
+    for q in (50, 95, 99):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert exact <= h.percentile(q) <= exact * 1.2
+    assert h.percentile(100) == values[-1] == h.max_ms
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_database_methods_and_sql_are_timed(tmp_path, caplog):
+    inst = Instrumentation(slow_ms=0)  # everything counts as slow
+    db = Database(str(tmp_path / "inst.db"), password_iterations=1000, instrumentation=inst)
+    db.create_user('veli1', 'cokgizli', 'parent')
+    db.add_student('Ali', 'Veli', '10000000146')
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='smartdershane.slow_query'):
+        assert db.authenticate('veli1', 'cokgizli', 'parent') is not None
+        for _ in range(10):
+            db.get_student(1)
+        rows = list(db.attendance_monthly('2024-01-01', '2025-01-01'))
+    methods = dict(inst.stats())
+    assert methods['get_student']['count'] == 10
+    assert methods['authenticate']['count'] == 1 and methods['authenticate']['p99_ms'] > 0
+    assert methods['attendance_monthly']['count'] == 1 and rows == []
+    statements = dict(inst.stats('sql'))
+    # repeated lookups are served from the student cache
+    assert statements['SELECT * FROM students WHERE id=?']['count'] == 1
+
+    # slow-query log has the statement but never the parameter values
+    text = '\n'.join(r.getMessage() for r in caplog.records)
+    assert 'FROM users WHERE username=?' in text and 'params redacted' in text
+    assert 'veli1' not in text and 'cokgizli' not in text
+    db.close()
+
+
+def test_instrumentation_is_opt_in(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "plain.db"))
+    assert db.instrumentation is None
+    assert 'get_student' not in vars(db)
+    db.close()
+    monkeypatch.setenv('SMARTDERSHANE_INSTRUMENT', '1')
+    monkeypatch.setenv('SMARTDERSHANE_SLOW_MS', '250')
+    db = Database(str(tmp_path / "plain.db"))
+    assert db.instrumentation.slow_ms == 250
+    db.count_students()
+    assert dict(db.instrumentation.stats())['count_students']['count'] == 1
+    db.close()
@@ -0,0 +1,67 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import threading
+import pytest
+from logsetup import setup_logging, shutdown_logging
+
+
+class Probe:
+    # records which thread turned it into text
+    def __init__(self):
+        self.formatted_on = []
+
+    def __str__(self):
+        self.formatted_on.append(threading.current_thread().name)
+        return 'probe'
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    level = logging.getLogger().level
+    path = tmp_path / "app.log"
+    setup_logging(str(path), max_bytes=20000, backups=3)
+    yield path
+    shutdown_logging()
+    logging.getLogger().setLevel(level)
+
+
+def test_json_lines_rotated_and_compressed(pipeline):
+    log = logging.getLogger('database')
+    for i in range(2000):
+        log.info('Attendance for %s: %s', i, 'Gelen')
+    try:
+        raise ValueError('bozuk')
+    except ValueError:
+        log.exception('Backup failed')
+    shutdown_logging()
+
+    current = [json.loads(line) for line in pipeline.read_text(encoding='utf-8').splitlines()]
+    assert current[-1]['level'] == 'ERROR' and 'ValueError: bozuk' in current[-1]['exc']
+    assert current[0]['logger'] == 'database' and current[0]['msg'].startswith('Attendance for ')
+    rotated = sorted(pipeline.parent.glob('app.log.*'))
+    assert [p.name for p in rotated] == ['app.log.1.gz', 'app.log.2.gz', 'app.log.3.gz']
+    with gzip.open(rotated[0], 'rt', encoding='utf-8') as f:
+        assert all(json.loads(line)['msg'].startswith('Attendance') for line in f)
+
+
+def test_formatting_is_deferred_and_skipped_when_disabled(pipeline):
+    log = logging.getLogger('telegram_bot')
+    disabled, enabled = Probe(), Probe()
+    # pytest's own capture handlers format on the caller's thread; detach them meanwhile
+    root = logging.getLogger()
+    others = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    for h in others:
+        root.removeHandler(h)
+    try:
+        log.debug('never rendered %s', disabled)
+        log.info('rendered later %s', enabled)
+    finally:
+        for h in others:
+            root.addHandler(h)
+    shutdown_logging()
+    # DEBUG is dropped before formatting; INFO is rendered on the listener thread only
+    assert disabled.formatted_on == []
+    assert enabled.formatted_on and threading.current_thread().name not in enabled.formatted_on
+    assert 'rendered later probe' in pipeline.read_text(encoding='utf-8')
@@ -0,0 +1,27 @@
+import database
+from database import Database
+import manage
+
+
+def test_import_users_reports_duplicates(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(database, 'PASSWORD_ITERATIONS', 1000)
+    db_path = str(tmp_path / "users.db")
+    db = Database(db_path)
+    db.create_user('veli_0', 'x', 'parent')
+    db.close()
+    csv_path = tmp_path / "veliler.csv"
+    lines = ['username,password,role'] + [f'veli_{i},pw{i},parent' for i in range(1200)]
+    lines += ['veli_5,tekrar,parent', 'ogretmen,pw,teacher', ',pw,parent', 'x,pw,root']
+    csv_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    rc = manage.main(['--db', db_path, '--log', '', 'import-users', str(csv_path), '--workers', '2', '--chunk-size', '500'])
+    out = capsys.readouterr().out
+    assert rc == 1  # two invalid rows
+    assert '1200 kullanıcı oluşturuldu' in out
+    assert '2 tekrar eden' in out and 'veli_0' in out and 'veli_5' in out
+
+    db = Database(db_path)
+    assert db.count_users() == 1 + 1 + 1200  # admin, veli_0 (existing), 1199 new veli + ogretmen
+    assert db.authenticate('veli_1199', 'pw1199', 'parent') is not None
+    assert db.authenticate('ogretmen', 'pw', 'teacher') is not None
+    db.close()
@@ -0,0 +1,90 @@
+import csv
+import os
+import threading
+import pytest
+from database import Database, ATTENDANCE_STATUSES
+import reports
+from reports import attendance_report, export_attendance_report, start_attendance_report
+
+# generous, for shared CI runners; override with the environment variable
+REPORT_TIMEOUT_S = float(os.environ.get('SMARTDERSHANE_REPORT_TIMEOUT_S', 60))
+
+
+def _seed(db):
+    db.add_student('Ayşe', 'Kaya', '1', class_name='9-A')
+    db.add_student('Mehmet', 'Demir', '2', class_name='9-A')
+    db.add_student('Zeynep', 'Ak', '3', class_name='10-B')
+    a, b, c = (s['id'] for s in sorted(db.list_students(), key=lambda s: s['tc']))
+    rows = [(a, 'Gelen', '2024-03-04T09:00:00'), (a, 'Geç Kaldı', '2024-03-05T09:00:00'),
+            (a, 'Gelmedi', '2024-04-01T09:00:00'), (b, 'Gelen', '2024-03-04T09:00:00'),
+            (b, 'İzinli', '2024-03-31T23:59:59'), (c, 'Gelmedi', '2024-03-04T09:00:00'),
+            (c, 'Gelen', '2025-01-01T00:00:00')]
+    with db._write() as cur:
+        cur.executemany('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)', rows)
+    return a, b, c
+
+
+def test_monthly_report_by_student_and_class(tmp_path):
+    db = Database(str(tmp_path / "rep.db"))
+    a, b, c = _seed(db)
+    rows = list(attendance_report(db, 2024))
+    assert rows == [
+        ('2024-03', c, 'Zeynep', 'Ak', '10-B', 0, 0, 1, 0, 1, 0.0),
+        ('2024-03', b, 'Mehmet', 'Demir', '9-A', 1, 0, 0, 1, 2, 50.0),
+        ('2024-03', a, 'Ayşe', 'Kaya', '9-A', 1, 1, 0, 0, 2, 100.0),
+        ('2024-04', a, 'Ayşe', 'Kaya', '9-A', 0, 0, 1, 0, 1, 0.0),
+    ]
+    assert list(attendance_report(db, 2024, month=3, by='class')) == [
+        ('2024-03', '10-B', 1, 0, 0, 1, 0, 1, 0.0),
+        ('2024-03', '9-A', 2, 2, 1, 0, 1, 4, 75.0),
+    ]
+    assert list(attendance_report(db, 2024, month=12)) == []
+    with pytest.raises(ValueError):
+        list(attendance_report(db, 2024, by='teacher'))
+    db.close()
+
+
+def test_export_csv_and_xlsx(tmp_path):
+    db = Database(str(tmp_path / "rep.db"))
+    _seed(db)
+    path = tmp_path / "yoklama.csv"
+    assert export_attendance_report(db, str(path), 2024, by='class') == 3
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        lines = list(csv.reader(f, delimiter=';'))
+    assert lines[0] == list(reports.REPORT_HEADERS['class'])
+    assert lines[1][:3] == ['2024-03', '10-B', '1']
+
+    openpyxl = pytest.importorskip('openpyxl')
+    path = tmp_path / "yoklama.xlsx"
+    assert export_attendance_report(db, str(path), 2024) == 4
+    ws = openpyxl.load_workbook(path, read_only=True).active
+    values = list(ws.iter_rows(values_only=True))
+    assert values[0][:5] == ('Ay', 'Öğrenci ID', 'Ad', 'Soyad', 'Sınıf')
+    assert values[-1][0] == '2024-04' and len(values) == 5
+    db.close()
+
+
+def test_background_report_for_5000_students(tmp_path):
+    db = Database(str(tmp_path / "big.db"))
+    with db._write() as cur:
+        cur.executemany('INSERT INTO students (name,surname,tc,class_name) VALUES (?,?,?,?)',
+                        ((f'Ad{i}', f'Soyad{i}', str(10 ** 10 + i), f'{9 + i % 4}-A') for i in range(5000)))
+        cur.executemany('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)',
+                        ((sid, ATTENDANCE_STATUSES[(sid + day) % 4], f'2024-{1 + day % 12:02d}-{1 + day // 12:02d}T09:00:00')
+                         for day in range(24) for sid in range(1, 5001)))
+    done = threading.Event()
+    result = {}
+    progress = []
+
+    def finished(rows, err):
+        result.update(rows=rows, err=err, thread=threading.current_thread().name)
+        done.set()
+
+    start_attendance_report(db, str(tmp_path / "yil.csv"), callback=finished, year=2024, progress=progress.append)
+    assert done.wait(REPORT_TIMEOUT_S)
+    # streamed: progress is reported per batch, not once at the end
+    assert len(progress) > 1 and progress == sorted(progress)
+    assert result['err'] is None and result['rows'] == 5000 * 12
+    assert result['thread'] == 'attendance-report'
+    assert progress[-1] == 60000
+    db.close()
@@ -0,0 +1,37 @@
+import datetime
+from schedule import TeacherSchedule
+
+
+def test_conflict_finds_long_earlier_booking():
+    d = datetime.datetime(2026, 3, 2, 9, 0)
+    m = datetime.timedelta(minutes=1)
+    sched = TeacherSchedule(
+        availability=[(1, d, d + 180 * m), (2, d + 240 * m, d + 300 * m)],
+        bookings=[(10, d, d + 120 * m), (11, d + 30 * m, d + 45 * m), (12, d + 130 * m, d + 145 * m)],
+    )
+    # the 2-hour booking #10 starts before #11 but still covers 100-115
+    assert sched.conflict(d + 100 * m, d + 115 * m) == 10
+    assert sched.conflict(d + 120 * m, d + 130 * m) is None
+    assert sched.conflict(d + 140 * m, d + 150 * m) == 12
+    assert sched.is_available(d + 170 * m, d + 180 * m)
+    assert not sched.is_available(d + 170 * m, d + 185 * m)
+    assert not sched.is_available(d + 200 * m, d + 210 * m)
+    sched.remove_booking(10)
+    assert sched.conflict(d + 100 * m, d + 115 * m) is None
+
+
+def test_free_slots_sweep_windows_minus_bookings():
+    d = datetime.datetime(2026, 3, 2, 9, 0)
+    m = datetime.timedelta(minutes=1)
+    sched = TeacherSchedule(
+        availability=[(1, d, d + 60 * m), (2, d + 50 * m, d + 90 * m), (3, d + 300 * m, d + 330 * m)],
+        bookings=[(10, d + 15 * m, d + 45 * m), (11, d + 70 * m, d + 80 * m)],
+    )
+    assert list(sched.windows_between(d + 10 * m, d + 320 * m)) == [(d + 10 * m, d + 90 * m), (d + 300 * m, d + 320 * m)]
+    assert [b[2] for b in sched.bookings_between(d + 40 * m, d + 75 * m)] == [10, 11]
+    slots = list(sched.free_slots(d, d + 24 * 60 * m, 15 * m))
+    # 09:00 and 09:45 in the merged 09:00-10:30 window (10:20-10:30 is too short), then 14:00 and 14:15
+    assert [(t - d) // m for t in slots] == [0, 45, 300, 315]
+    # a window starting off the grid: first slot is on the next quarter hour
+    assert [(t - d) // m for t in sched.free_slots(d + 50 * m, d + 70 * m, 15 * m)] == []
+    assert [(t - d) // m for t in sched.free_slots(d + 300 * m + 5 * m, d + 330 * m, 15 * m)] == [315]
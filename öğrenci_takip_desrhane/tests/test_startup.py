@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# fresh interpreter up to a usable Database and notifier (everything App does before
+# the login window is drawn). About 0.2s here and 0.9s with matplotlib imported
+# eagerly. The import checks below are what guard the lazy loading; the wall-clock
+# budget only catches gross regressions and can be raised on slow CI runners.
+COLD_START_BUDGET_S = float(os.environ.get('SMARTDERSHANE_COLD_START_BUDGET_S', 5.0))
+# loaded on first use only (parent dashboard, first Telegram send, .xlsx reports)
+LAZY_MODULES = ('matplotlib', 'requests', 'openpyxl')
+
+PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+import main
+from database import Database
+from telegram_bot import TelegramNotifier
+db = Database(sys.argv[1])
+TelegramNotifier(db)
+elapsed = time.perf_counter() - t0
+db.close()
+print(json.dumps({'elapsed': elapsed, 'loaded': sorted(m for m in sys.argv[2:] if m in sys.modules)}))
+'''
+
+
+def test_cold_start_budget_and_lazy_imports(tmp_path):
+    db_path = str(tmp_path / "startup.db")
+    # first run creates and migrates the database; the budget applies to a normal start
+    cmd = [sys.executable, '-c', PROBE, db_path, *LAZY_MODULES]
+    subprocess.run(cmd, cwd=APP_DIR, check=True, capture_output=True)
+    t0 = time.perf_counter()
+    out = subprocess.run(cmd, cwd=APP_DIR, check=True, capture_output=True, text=True).stdout
+    wall = time.perf_counter() - t0
+    report = json.loads(out.strip().splitlines()[-1])
+    assert report['loaded'] == [], f"imported at startup: {report['loaded']}"
+    assert wall < COLD_START_BUDGET_S, f'cold start {wall:.2f}s over budget ({report["elapsed"]:.2f}s after interpreter start)'
@@ -0,0 +1,185 @@
+import time
+from api_client import RemoteDatabase
+from api_server import ApiServer
+from database import Database
+from telegram_bot import TelegramNotifier
+from fake_telegram import FakeTelegram
+
+
+def _wait_for(cond, timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+def test_outbox_retries_and_resumes_after_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    db = Database(path)
+    db.set_setting('telegram_token', 'TEST')
+    db.add_student('Ali', 'Veli', '12345678901', '1001')
+    db.add_student('Ayse', 'Kaya', '98765432100', '1002')
+    sids = [s['id'] for s in db.list_students()]
+    notifier = TelegramNotifier(db)
+    # no worker running: messages wait in the outbox
+    assert notifier.notify_class_attendance([(sids[0], 'Gelen'), (sids[1], 'Gelmedi')]) == 2
+    assert db.outbox_counts() == {'pending': 2}
+    db.close()
+
+    # "restart": a new process picks up the pending rows; first two calls fail with 500
+    db = Database(path)
+    with FakeTelegram(fail_first=2) as tg:
+        notifier = TelegramNotifier(db, api_base=tg.url, retry_base=0.05, per_chat_interval=0)
+        notifier.start()
+        assert _wait_for(lambda: db.outbox_counts() == {'sent': 2})
+        notifier.stop()
+    assert sorted(c for c, _ in tg.sent) == ['1001', '1002']
+    assert tg.calls == 4
+    db.close()
+
+
+def test_outbox_honours_retry_after_and_drops_permanent_errors(tmp_path):
+    db = Database(str(tmp_path / "outbox2.db"))
+    db.set_setting('telegram_token', 'TEST')
+    db.enqueue_message('1001', 'a')
+    with FakeTelegram(fail_first=1, fail_status=429, retry_after=0.2) as tg:
+        notifier = TelegramNotifier(db, api_base=tg.url, per_chat_interval=0)
+        notifier.start()
+        assert _wait_for(lambda: db.outbox_counts() == {'sent': 1})
+        notifier.stop()
+    db.enqueue_message('1002', 'b')
+    with FakeTelegram(fail_first=1, fail_status=403) as tg:
+        notifier = TelegramNotifier(db, api_base=tg.url, per_chat_interval=0)
+        notifier.deliver_due()
+    assert db.outbox_counts() == {'sent': 1, 'failed': 1}
+    db.close()
+
+
+def test_outbox_throughput_thousands_of_parents(tmp_path):
+    db = Database(str(tmp_path / "outbox3.db"))
+    db.set_setting('telegram_token', 'TEST')
+    n = 3000
+    db.enqueue_messages((str(100000 + i), f'mesaj {i}') for i in range(n))
+    with FakeTelegram() as tg:
+        # rate limit lifted to measure the worker itself
+        notifier = TelegramNotifier(db, api_base=tg.url, global_rate=None)
+        t0 = time.perf_counter()
+        notifier.start()
+        assert _wait_for(lambda: db.outbox_counts() == {'sent': n}, timeout=120)
+        elapsed = time.perf_counter() - t0
+        notifier.stop()
+    assert len(tg.sent) == n
+    print(f'outbox delivery: {n / elapsed:.0f} msg/s ({n} parents, {elapsed:.2f}s)')
+    db.close()
+
+
+def test_two_workers_send_each_message_once(tmp_path):
+    path = str(tmp_path / "outbox4.db")
+    db = Database(path)
+    db.set_setting('telegram_token', 'TEST')
+    n = 400
+    db.enqueue_messages((str(100000 + i % 50), f'mesaj {i}') for i in range(n))
+    other = Database(path)
+    with FakeTelegram() as tg:
+        # two front-desk PCs on one shared database
+        workers = [TelegramNotifier(d, api_base=tg.url, global_rate=None, per_chat_interval=0) for d in (db, other)]
+        for w in workers:
+            w.start()
+        assert _wait_for(lambda: db.outbox_counts() == {'sent': n})
+        for w in workers:
+            w.stop()
+    assert sorted(t for _, t in tg.sent) == sorted(f'mesaj {i}' for i in range(n))
+    # each chat's messages still arrive in the order they were queued
+    for chat in {c for c, _ in tg.sent}:
+        ids = [int(t.split()[1]) for c, t in tg.sent if c == chat]
+        assert ids == sorted(ids)
+    other.close()
+    db.close()
+
+
+def test_blocked_chats_do_not_hold_up_others_and_leases_expire(tmp_path):
+    db = Database(str(tmp_path / "outbox5.db"))
+    db.set_setting('telegram_token', 'TEST')
+    # a full batch for one chat, then one message for another
+    db.enqueue_messages([('1001', f'a{i}') for i in range(150)] + [('1002', 'b')])
+    with FakeTelegram() as tg:
+        notifier = TelegramNotifier(db, api_base=tg.url, global_rate=None, per_chat_interval=60)
+        assert notifier.deliver_due()
+        assert notifier.deliver_due()
+    assert tg.sent == [('1001', 'a0'), ('1002', 'b')]
+    assert db.outbox_counts() == {'sent': 2, 'pending': 149}
+
+    # a worker that crashed after claiming: its rows come back once the lease runs out
+    claimed = db.claim_messages('crashed', limit=10, lease_s=60)
+    # nobody else takes that chat's messages while some are in flight
+    assert len(claimed) == 10 and db.claim_messages('other', limit=10) == []
+    again = db.claim_messages('other', limit=10, now=time.time() + 61)
+    assert [m['id'] for m in again] == [m['id'] for m in claimed]
+    db.close()
+
+
+def test_daily_digest_one_message_per_parent(tmp_path):
+    from datetime import datetime
+    path = str(tmp_path / "digest.db")
+    db = Database(path)
+    db.add_student('Ali', 'Veli', '10000000146', '1001')
+    db.add_student('Ayşe', 'Veli', '10000000222', '1001')
+    db.add_student('Can', 'Kaya', '10000000308', '1002')
+    db.add_student('Deniz', 'Ak', '10000000384')  # no parent chat
+    ali, ayse, can, deniz = (s['id'] for s in db.list_students())
+    db.create_user('ogretmen1', 'pw', 'teacher')
+    teacher = db.conn.execute("SELECT id FROM users WHERE username='ogretmen1'").fetchone()[0]
+    with db._write() as cur:
+        cur.executemany('INSERT INTO attendance (student_id,status,ts) VALUES (?,?,?)', [
+            (ali, 'Gelen', '2025-03-10T09:05:00'), (ali, 'Geç Kaldı', '2025-03-10T10:02:00'),
+            (ayse, 'Gelmedi', '2025-03-10T09:05:00'), (can, 'Gelen', '2025-03-10T09:06:00'),
+            (deniz, 'Gelen', '2025-03-10T09:06:00'), (can, 'Gelmedi', '2025-03-09T09:06:00')])
+        cur.execute('INSERT INTO appointments (student_id,teacher_id,start_ts,duration_min) VALUES (?,?,?,15)',
+                    (ali, teacher, '2025-03-12T14:30:00'))
+    db.add_exam(ayse, 'Matematik', 85, ts='2025-03-10T12:00:00')
+
+    notifier = TelegramNotifier(db)
+    notifier.set_mode('digest', '18:00')
+    # absences still go out at once, everything else waits for the digest
+    assert notifier.notify_class_attendance([(ali, 'Gelen'), (ayse, 'Gelmedi')]) == 1
+    assert notifier.notify_parent_attendance(can, 'Geç Kaldı') and db.outbox_counts() == {'pending': 1}
+    db.mark_messages_sent([m['id'] for m in db.due_messages()])
+
+    assert notifier.send_digest_if_due(now=datetime(2025, 3, 10, 17, 59)) == 0
+    assert notifier.send_digest_if_due(now=datetime(2025, 3, 10, 18, 0)) == 2
+    assert notifier.send_digest_if_due(now=datetime(2025, 3, 10, 21, 0)) == 0
+    # a notifier on another PC does not queue the same day again
+    other = Database(path)
+    assert TelegramNotifier(other).queue_digest('2025-03-10') == 0
+    other.close()
+
+    texts = {m['chat_id']: m['text'] for m in db.due_messages()}
+    assert set(texts) == {'1001', '1002'}
+    assert texts['1001'].splitlines() == [
+        'Günlük özet - 10.03.2025', '', 'Ali Veli', '  Yoklama 09:05: Gelen', '  Yoklama 10:02: Geç Kaldı',
+        '  Randevu: 12.03 14:30 (ogretmen1)', '', 'Ayşe Veli', '  Yoklama 09:05: Gelmedi', '  Sınav: Matematik - 85 puan']
+    assert 'Gelmedi' not in texts['1002']  # the 9th is not part of the 10th's digest
+    db.close()
+
+
+def test_server_notifier_picks_up_token_saved_over_api(tmp_path):
+    db = Database(str(tmp_path / "token.db"))
+    server = ApiServer(db, port=0, token='anahtar')
+    client = RemoteDatabase(f'http://127.0.0.1:{server.start_background()}', token='anahtar')
+    with FakeTelegram() as tg:
+        # started before any token exists, like api_server.serve() on a fresh install
+        notifier = TelegramNotifier(db, api_base=tg.url, per_chat_interval=0, poll_interval=0.05)
+        notifier.start()
+        client.enqueue_message('1001', 'a')
+        time.sleep(0.2)
+        assert db.outbox_counts() == {'pending': 1}
+        # AdminDashboard.save_token on a client-mode PC
+        client.set_setting('telegram_token', 'TEST')
+        assert _wait_for(lambda: db.outbox_counts() == {'sent': 1})
+        notifier.stop()
+    assert tg.sent == [('1001', 'a')]
+    client.close()
+    server.stop()
+    db.close()
@@ -0,0 +1,97 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+import datagen
+from database import Database
+from fake_telegram import FakeTelegram
+from telegram_inbound import InboundBot
+
+
+def _wait_for(cond, timeout=60):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+def _start(bot):
+    thread = threading.Thread(target=asyncio.run, args=(bot.run(),), daemon=True)
+    thread.start()
+    assert _wait_for(lambda: bot._stop is not None)
+    return thread
+
+
+def test_answers_scores_and_attendance(tmp_path):
+    db = Database(str(tmp_path / "inbound.db"))
+    db.add_student('Ali', 'Veli', '10000000146', parent_chat_id='555')
+    sid = db.list_students()[0]['id']
+    db.add_exam(sid, 'Deneme 1', 80)
+    db.add_exam(sid, 'Deneme 2', 90)
+    db.add_attendance(sid, 'Gelmedi')
+    bot = InboundBot(db, token='TEST')
+    scores = bot.answer(555, '/notlar')
+    assert 'Ali Veli' in scores and 'Deneme 2: 90' in scores and 'Ortalama: 85.0 (2 sınav)' in scores
+    assert scores.index('Deneme 2') < scores.index('Deneme 1')
+    assert 'Gelmedi: 1' in bot.answer(555, '/devamsizlik')
+    assert '/notlar' in bot.answer(555, '/start')
+    assert '(777)' in bot.answer(777, '/notlar')
+    bot.close()
+    db.close()
+
+
+def test_replay_thousands_of_updates(tmp_path):
+    path = str(tmp_path / "replay.db")
+    datagen.generate(path, 'small')
+    db = Database(path)
+    chats = sorted({int(s['parent_chat_id']) for s in db.list_students(limit=5000) if s['parent_chat_id']})
+    rng = random.Random(7)
+    with FakeTelegram() as tg:
+        bot = InboundBot(db, token='TEST', api_base=tg.url, poll_timeout=1, global_rate=0)
+        thread = _start(bot)
+        n = 2000
+        expected = {}
+        for _ in range(n):
+            # a few chats that are not linked to any student
+            chat = rng.choice(chats) if rng.random() < 0.95 else 1
+            update_id = tg.push(chat, rng.choice(('/notlar', '/devamsizlik', '/start')))
+            expected.setdefault(chat, []).append(update_id)
+        assert _wait_for(lambda: len(tg.sent) == n)
+        bot.stop()
+        thread.join()
+        bot.close()
+    # one reply per update; per chat in the order the messages were sent
+    replied = {}
+    for chat, update_id in tg.replies:
+        replied.setdefault(chat, []).append(update_id)
+    assert replied == expected
+    assert db.get_setting('telegram_update_offset') == str(n + 1)
+    assert bot.cache.stats()['hits'] > 0
+    ms = sorted(x * 1000 for x in tg.latencies)
+    print(f'{n} updates: median {statistics.median(ms):.1f} ms, p95 {ms[int(0.95 * (len(ms) - 1))]:.1f} ms')
+    db.close()
+
+
+def test_restart_resumes_after_saved_offset(tmp_path):
+    db = Database(str(tmp_path / "offset.db"))
+    db.add_student('Ali', 'Veli', '10000000146', parent_chat_id='555')
+    with FakeTelegram() as tg:
+        tg.push(555, '/notlar')
+        bot = InboundBot(db, token='TEST', api_base=tg.url, poll_timeout=1)
+        thread = _start(bot)
+        assert _wait_for(lambda: len(tg.sent) == 1)
+        bot.stop()
+        thread.join()
+        bot.close()
+        tg.push(555, '/devamsizlik')
+        bot = InboundBot(db, token='TEST', api_base=tg.url, poll_timeout=1)
+        thread = _start(bot)
+        assert _wait_for(lambda: len(tg.sent) == 2)
+        bot.stop()
+        thread.join()
+        bot.close()
+    assert 'Gelmedi' in tg.sent[1][1]
+    db.close()